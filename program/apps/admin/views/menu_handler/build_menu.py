@@ -3,7 +3,13 @@ from sqlalchemy import select
 from apps.admin.models import Menu
 from oracle.sqlalchemy import sql_helper
 from oracle.types import ModelStatus
-from watchtower.depends.cache.cache import cache as cache_client
+from watchtower.depends.cache.cache import cache as cache_client, get_menu_key, MENU_FAMILY
+from watchtower.depends.cache.fill import CacheFill
+from watchtower.depends.cache.response_cache import response_cache, MENU_RESPONSE
+from watchtower.depends.cache.shared import shared_store
+
+# 共享数据中菜单的key
+SHARED_MENU_KEY = 'menu'
 
 
 def build_menu_tree(menu_dict: dict):
@@ -43,14 +49,53 @@ async def build():
     return build_menu_tree(menu_dict)
 
 
-async def set_menu_tree(menu: list):
-    await cache_client.set_menu(value=menu)
+async def on_menu_fill(menu_tree: list):
+    """
+    将重新加载的菜单写入共享数据，同一台主机上的其他进程立即可见，并使所有进程中缓存的菜单响应失效
+    :param menu_tree: 菜单树
+    :return:
+    """
+    if shared_store is not None:
+        await shared_store.put({SHARED_MENU_KEY: menu_tree})
+    if response_cache is not None:
+        await response_cache.invalidate(MENU_RESPONSE)
+
+
+# 菜单缓存，1 小时后在后台刷新，7 天后过期
+menu_cache = CacheFill(
+    cache_client,
+    get_menu_key(),
+    build,
+    soft_ttl=3600,
+    hard_ttl=7 * 24 * 3600,
+    family=MENU_FAMILY,
+    on_fill=on_menu_fill
+)
+
+if shared_store is not None:
+    # 刷新进程定时从缓存读取菜单，其他主机修改的菜单在刷新间隔内生效
+    shared_store.register(SHARED_MENU_KEY, menu_cache.get)
 
 
 async def get_menu_tree(refresh: bool = False):
-    menu = await cache_client.get_menu()
-    if menu is None or refresh:
-        menu = await build()
-        await set_menu_tree(menu)
+    if not refresh and shared_store is not None:
+        menu_tree = shared_store.get(SHARED_MENU_KEY)
+        if menu_tree is not None:
+            return menu_tree
+    return await menu_cache.get(refresh)
+
+
+def get_menu_variant() -> int | None:
+    """
+    菜单响应依赖的共享数据版本，其他主机修改菜单后，共享数据刷新之前生成的响应不再使用
+    :return:
+    """
+    return shared_store.generation if shared_store is not None else None
+
 
-    return menu
+def refresh_menu_tree():
+    """
+    菜单发生变化后在后台刷新菜单缓存，不阻塞当前请求
+    :return:
+    """
+    menu_cache.refresh_in_background(force=True)
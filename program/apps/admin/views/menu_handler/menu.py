@@ -1,11 +1,13 @@
+from fastapi import Request
 from sqlalchemy import Update
 from sqlalchemy.ext.declarative import DeclarativeMeta as Model
 
 from apps.admin.models import Menu
-from apps.admin.views.menu_handler.build_menu import get_menu_tree
+from apps.admin.views.menu_handler.build_menu import get_menu_tree, get_menu_variant, refresh_menu_tree
 from apps.admin.views.menu_handler.menu_type import MenuQueryData, MenuCreateData, MenuUpdateData
 from oracle.sqlalchemy import SQLAlchemyCRUDRouter
 from watchtower import PayloadData
+from watchtower.depends.cache.response_cache import response_cache, MENU_RESPONSE
 from watchtower.status.types.response import GetAllData, GenericBaseResponse, PaginationData
 
 
@@ -17,17 +19,28 @@ class MenuCRUDRouter(SQLAlchemyCRUDRouter):
         return item
 
     async def _post_create(self, model: Model) -> Model:
-        await get_menu_tree(refresh=True)
+        await self.refresh_menu()
         return model
 
     async def _post_update(self, model: Model) -> Model:
-        await get_menu_tree(refresh=True)
+        await self.refresh_menu()
         return model
 
     async def _post_delete(self, model: Model) -> Model:
-        await get_menu_tree(refresh=True)
+        await self.refresh_menu()
         return model
 
+    @staticmethod
+    async def refresh_menu():
+        """
+        菜单发生变化后立即使缓存的菜单响应失效，再在后台刷新菜单缓存
+        刷新完成后 on_menu_fill 会再次使响应失效，刷新期间按照旧菜单生成的响应不会继续使用
+        :return:
+        """
+        if response_cache is not None:
+            await response_cache.invalidate(MENU_RESPONSE)
+        refresh_menu_tree()
+
     async def _orm_update_statement(self, item_id: int, data: dict, payload: PayloadData | None = None) -> Update:
         # 非超级管理员用户无法修改状态
         if "status" in data:
@@ -70,8 +83,7 @@ def get_all_menu_node(menu_list: list) -> list:
     return all_node
 
 
-@router.get("", summary="获取菜单", description="获取菜单", response_model=MenuQueryData)
-async def get_menu():
+async def get_menu_records() -> tuple[list, PaginationData]:
     menus = await get_menu_tree()
     if menus:
         all_records = get_all_menu_node(menus)
@@ -80,6 +92,25 @@ async def get_menu():
 
     all_records_count = len(all_records)
     pagination_data = PaginationData(index=1, limit=all_records_count, total=all_records_count, offset=0)
+    return all_records, pagination_data
+
+
+async def render_menu() -> bytes:
+    all_records, pagination_data = await get_menu_records()
+    return GenericBaseResponse[GetAllData](data={"items": all_records, "pagination": pagination_data}).as_response().body
+
+
+@router.get("", summary="获取菜单", description="获取菜单", response_model=MenuQueryData)
+async def get_menu(request: Request):
+    # 菜单对所有用户相同，直接返回编码后的响应
+    if response_cache is not None:
+        cached = await response_cache.get_or_render(MENU_RESPONSE, get_menu_variant(), render_menu)
+        return cached.response(request)
+
+    all_records, pagination_data = await get_menu_records()
+    if router.fast_response:
+        return GenericBaseResponse[GetAllData](data={"items": all_records, "pagination": pagination_data}).as_response()
+
     data = GetAllData(items=all_records, pagination=pagination_data).dict()
 
     return GenericBaseResponse[GetAllData](data=data)
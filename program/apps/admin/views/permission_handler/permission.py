@@ -56,5 +56,7 @@ router = PermissionCRUDRouter(
     create_route=False,
     update_route=False,
     delete_one_route=False,
+    # 权限的id在初始化时指定，不是由雪花算法生成
+    created_range_by_id=False,
 )
 tags_metadata = [{"name": "permission", "description": "权限相关接口"}]
@@ -1,4 +1,5 @@
 from sqlalchemy import Update, Select
+from sqlalchemy.ext.declarative import DeclarativeMeta as Model
 
 from apps.admin.models import Role
 from apps.admin.views.role_handler.role_type import RoleQueryData, RoleCreateData, RoleUpdateData
@@ -6,6 +7,9 @@ from oracle.sqlalchemy import SQLAlchemyCRUDRouter
 from oracle.types import ModelStatus, PAGINATION
 from oracle.utils import is_superuser
 from watchtower import PayloadData
+from watchtower.depends.authorization.permission_catalog import permission_catalog
+from watchtower.depends.cache.cache import cache as cache_client
+from watchtower.depends.cache.response_cache import response_cache, LOAD_DATA_RESPONSE
 
 
 class RoleCRUDRouter(SQLAlchemyCRUDRouter):
@@ -45,6 +49,28 @@ class RoleCRUDRouter(SQLAlchemyCRUDRouter):
 
         return await super()._orm_update_statement(item_id, data, payload)
 
+    async def _post_delete(self, model: Model) -> Model:
+        await self.revoke_role_permissions([model['id']])
+        return model
+
+    async def _post_delete_all(self, models: list[Model]) -> list[Model]:
+        await self.revoke_role_permissions([model['id'] for model in models])
+        return models
+
+    @staticmethod
+    async def revoke_role_permissions(role_ids: list[int]):
+        """
+        角色删除后收回角色的权限
+        :param role_ids: 已经删除的角色id列表
+        :return:
+        """
+        # 删除的角色不再拥有权限，只删除这些角色的权限缓存，其他角色不受影响
+        await cache_client.delete_role_permission(role_ids)
+        # 已经签发的 token 中的权限位图仍然包含这些角色的权限，更新权限目录的版本使旧的位图失效，回退到查询缓存
+        await permission_catalog.bump()
+        if response_cache is not None:
+            await response_cache.invalidate(LOAD_DATA_RESPONSE)
+
 
 router = RoleCRUDRouter(
     RoleQueryData,
@@ -54,6 +80,8 @@ router = RoleCRUDRouter(
     tags=['role'],
     verbose_name='role',
     # TODO 限制管理员登陆
-    get_all_route=True
+    get_all_route=True,
+    # 管理员角色的id在初始化时指定，不是由雪花算法生成
+    created_range_by_id=False,
 )
 tags_metadata = [{"name": "role", "description": "角色相关接口"}]
@@ -9,6 +9,8 @@ from oracle.types import ITEM_NOT_FOUND_CODE, ONLY_SUPERUSER_CODE, CREATE_FAILED
 from oracle.utils import is_superuser
 from watchtower import PayloadData, SiteException
 from watchtower.depends.authorization.authorization import get_password_hash, signature_authentication
+from watchtower.depends.authorization.permission_catalog import permission_catalog
+from watchtower.depends.cache.cache import cache as cache_client
 from watchtower.status.global_status import StatusMap
 from watchtower.status.types.response import GenericBaseResponse, Status, generate_response_model
 
@@ -133,7 +135,9 @@ router = UserCRUDRouter(
     tags=['user'],
     verbose_name='User',
     # TODO 限制管理员登陆
-    get_all_route=True
+    get_all_route=True,
+    # 管理员用户的id在初始化时指定，不是由雪花算法生成
+    created_range_by_id=False,
 )
 tags_metadata = [{"name": "user", "description": "用户处理"}]
 
@@ -177,6 +181,11 @@ async def update_user_roles(user_id: int, roles: list[int] = Body(default=None,
         await session.commit()
         await session.flush()
 
+    # 用户角色变化后，token中的权限位图不再准确，需要更新权限目录版本
+    if add_roles_ids or remove_roles_ids:
+        await cache_client.update_permission_roles(user_id, [role.id for role in user.roles])
+        await permission_catalog.bump()
+
     data = router.format_query_data(user)
     return GenericBaseResponse[UserQueryData](data=data)
 
@@ -1,3 +1,4 @@
+import asyncio
 from calendar import timegm
 from dataclasses import dataclass
 from datetime import timedelta, datetime
@@ -6,14 +7,19 @@ from fastapi import Depends, APIRouter, Request, Form
 from fastapi.security import OAuth2PasswordRequestForm, SecurityScopes
 from sqlalchemy import select
 
-from apps.admin.models import User, Role, Permission, PermissionMethods
+from apps.admin.models import User, Role, Permission, PermissionMethods, UserRole, RolePermission
 from apps.auth.views.auth_types import LoadData, UserInfo
 from oracle.sqlalchemy import sql_helper
 from oracle.types import ModelStatus
+from oracle.write_behind import write_behind
 from watchtower import generate_response_model, SiteException, Response, settings
 from watchtower.depends.authorization.authorization import verify_password, create_access_token, signature_authentication, optional_signature_authentication
+from watchtower.depends.authorization.fallback import authorization_fallback
+from watchtower.depends.authorization.permission_catalog import permission_catalog
+from watchtower.depends.authorization.revocation import revocation_set
 from watchtower.depends.authorization.types import Token, PayloadData, PayloadDataUserInfo, TokenType
-from watchtower.depends.cache.cache import CacheSystem, cache
+from watchtower.depends.cache.cache import CacheSystem, cache, PERMISSION_ROLES_FIELD, ROLE_PERMISSION_FAMILY
+from watchtower.depends.cache.response_cache import response_cache, LOAD_DATA_RESPONSE
 from watchtower.settings import settings, logger
 from watchtower.status.global_status import StatusMap
 
@@ -100,41 +106,115 @@ class OAuth2RequestForm(OAuth2PasswordRequestForm):
         self.remember = remember
 
 
-async def get_user_info(username: str) -> User | None:
+async def get_user_info(username: str) -> tuple[User | None, list[int]]:
     """
-    获取用户信息
+    获取用户信息以及用户的角色id列表，只使用一次查询
     :param username: 查找用户的用户名
-    :return: User
+    :return: User, 角色id列表
     """
-    select_user_statement = select(User).where(User.username == username)
+    select_user_statement = select(User, UserRole.role_id).join(UserRole, UserRole.user_id == User.id, isouter=True).where(User.username == username)
     async with sql_helper.get_session().begin() as session:
-        user = (await session.execute(select_user_statement)).scalar_one_or_none()
+        rows = (await session.execute(select_user_statement)).all()
 
-    return user
+    if not rows:
+        return None, []
+    return rows[0][0], [row.role_id for row in rows if row.role_id is not None]
 
 
-async def get_permissions_by_user_id(user_id: int) -> dict[str, list[str]]:
+async def get_role_ids_by_user_id(user_id: int) -> list[int]:
     """
-    通过用户id获取权限和菜单，菜单信息作为权限的一部分返回
+    获取用户的角色id列表
     :param user_id: 用户id
-    :return: 权限列表
+    :return: 角色id列表
+    """
+    select_roles_statement = select(UserRole.role_id).where(UserRole.user_id == user_id)
+    async with sql_helper.get_session().begin() as session:
+        role_ids = (await session.execute(select_roles_statement)).scalars().all()
+
+    return list(role_ids)
+
+
+async def load_role_permissions(role_ids: list[int]) -> dict[int, dict[str, list[dict]]]:
+    """
+    获取角色权限，所有角色共享同一份权限缓存
+    :param role_ids: 角色id列表
+    :return: {role_id: {method: list[{ 'id': int, 'url': str, 'code': str}]}}
     """
-    permissions = {method: list() for method in PermissionMethods.__members__.keys()}
+    role_permissions = {role_id: {method: list() for method in PermissionMethods.__members__.keys()} for role_id in role_ids}
 
-    # 获取用户权限的sql语句
-    select_permissions_statement = select(Permission.id, Permission.method, Permission.url, Permission.code).join(User.roles).join(Role.permissions) \
-        .where(User.id == user_id, Permission.status == ModelStatus.ACTIVE).distinct()
+    select_permissions_statement = select(RolePermission.role_id, Permission.id, Permission.method, Permission.url, Permission.code) \
+        .join(Permission, RolePermission.permission_id == Permission.id).join(Role, RolePermission.role_id == Role.id) \
+        .where(RolePermission.role_id.in_(role_ids), Role.status == ModelStatus.ACTIVE, Permission.status == ModelStatus.ACTIVE)
     async with sql_helper.get_session().begin() as session:
         permission_queryset = (await session.execute(select_permissions_statement)).all()
 
     for permission in permission_queryset:
-        permissions[permission.method.name].append({
+        role_permissions[permission.role_id][permission.method.name].append({
             "id": permission.id,
             "url": permission.url,
             "code": permission.code
         })
 
-    return permissions
+    return role_permissions
+
+
+cache.register_role_permission_loader(load_role_permissions)
+
+
+async def load_user_authorization(user_id: int) -> tuple[bool, list[int]] | None:
+    """
+    缓存不可用时获取用户是否是超级管理员以及角色id列表，只使用一次查询
+    :param user_id: 用户id
+    :return: 是否是超级管理员, 角色id列表，用户不存在时返回 None
+    """
+    select_user_statement = select(User.superuser, UserRole.role_id).join(UserRole, UserRole.user_id == User.id, isouter=True).where(User.id == user_id)
+    async with sql_helper.get_session().begin() as session:
+        rows = (await session.execute(select_user_statement)).all()
+
+    if not rows:
+        return None
+    return rows[0].superuser, [row.role_id for row in rows if row.role_id is not None]
+
+
+authorization_fallback.register_user_loader(load_user_authorization)
+
+
+async def get_permissions_by_user_id(user_id: int, role_ids: list[int] | None = None) -> dict[str, list[dict]]:
+    """
+    通过用户id获取权限和菜单，菜单信息作为权限的一部分返回
+    用户权限为所有角色权限的并集，角色权限从缓存中获取，不存在时再从数据库中加载
+    :param user_id: 用户id
+    :param role_ids: 角色id列表，为 None 时从数据库中获取
+    :return: 权限列表
+    """
+    if role_ids is None:
+        role_ids = await get_role_ids_by_user_id(user_id)
+
+    methods = list(PermissionMethods.__members__.keys())
+    role_permissions = await cache.get_role_permissions(role_ids, methods)
+
+    permissions = {method: dict() for method in methods}
+    for role_id in role_ids:
+        for method, method_permissions in zip(methods, role_permissions[role_id]):
+            for permission in method_permissions or []:
+                permissions[method][permission["id"]] = permission
+
+    return {method: list(permissions[method].values()) for method in methods}
+
+
+async def load_permission_catalog() -> list[dict]:
+    """
+    获取全部有效权限，用于生成权限目录
+    :return: 权限列表
+    """
+    select_permissions_statement = select(Permission.id, Permission.method, Permission.url).where(Permission.status == ModelStatus.ACTIVE)
+    async with sql_helper.get_session().begin() as session:
+        permission_queryset = (await session.execute(select_permissions_statement)).all()
+
+    return [{"id": permission.id, "method": permission.method.name, "url": permission.url} for permission in permission_queryset]
+
+
+permission_catalog.register_loader(load_permission_catalog)
 
 
 async def generate_token(form_data: OAuth2RequestForm, cache_client: CacheSystem, login_ip: str = "0.0.0.0", is_token: bool = True):
@@ -162,14 +242,20 @@ async def generate_token(form_data: OAuth2RequestForm, cache_client: CacheSystem
 
         # TODO 添加 LDAP/邮箱认证
         # 本地数据库认证
-        user = await get_user_info(form_data.username)
+        user, role_ids = await get_user_info(form_data.username)
         if user:
-            if is_token:
-                is_auth = await verify_password(form_data.password, user.password)
-            else:
-                is_auth = True
+            # 密码校验和获取权限同时进行，校验失败时丢弃权限数据
+            is_auth, permissions = await asyncio.gather(
+                verify_password(form_data.password, user.password) if is_token else asyncio.sleep(0, result=True),
+                get_permissions_by_user_id(user.id, role_ids),
+                return_exceptions=True
+            )
+            if isinstance(is_auth, Exception):
+                raise is_auth
             # 认证通过则将用户信息进行格式化
             if is_auth:
+                if isinstance(permissions, Exception):
+                    raise permissions
                 user_data = UserData(id=user.id, name=user.name, email=user.email, avatar=user.avatar, username=user.username, superuser=user.superuser, status=user.status)
             else:
                 response.update(status=StatusMap.IDENTIFY_INVALID)
@@ -213,30 +299,28 @@ async def generate_token(form_data: OAuth2RequestForm, cache_client: CacheSystem
             else:
                 expires_delta = timedelta(days=1)
 
-            access_token = await create_access_token(payload=PayloadData(scopes=scopes, data=data, aud=user_data.username))
+            # 权限位图，超级管理员不进行权限验证，不需要携带
+            perm = None
+            if settings.TOKEN_PERMISSION_BITMAP_ENABLE and not user_data.superuser:
+                perm = permission_catalog.encode([permission["id"] for method in permissions for permission in permissions[method]])
+
+            access_token = await create_access_token(payload=PayloadData(scopes=scopes, data=data, aud=user_data.username, perm=perm))
             refresh_token = await create_access_token(
-                payload=PayloadData(scopes=scopes, data=data, aud=user_data.username),
+                payload=PayloadData(scopes=scopes, data=data, aud=user_data.username, perm=perm),
                 expires_delta=expires_delta,
                 subject=TokenType.REFRESH_TOKEN
             )
 
-            # 获取权限信息和菜单，然后存储到缓存中
-            permissions = await get_permissions_by_user_id(user_data.id)
-
-            # 如果权限为空，则删除该key，即空访问方法
-            permissions = {method: permissions[method] for method in permissions if permissions[method]}
+            # 用户缓存中只存储角色列表，权限由角色权限缓存共享
             # 是否是超级管理员的信息也存储到权限信息中
-            permissions["superuser"] = [user_data.superuser]
+            # 角色id存储为字符串，与 dump_permission_roles 一致，验证权限的脚本中不会丢失精度
+            user_permissions = {"superuser": [user_data.superuser], "roles": [str(role_id) for role_id in role_ids]}
 
-            await cache_client.set_permission(identify=user_data.id, permissions=permissions, expire=expires_delta if expires_delta else settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+            await cache_client.set_permission(identify=user_data.id, permissions=user_permissions, expire=expires_delta if expires_delta else settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
             if is_token:
-                # 对数据库数据进行操作
-                # 用户保存登录ip和登录时间
-                user.last_login_ip = login_ip
-                user.last_login_time = datetime.now()
-                async with sql_helper.get_session().begin() as session:
-                    await session.merge(user)
+                # 用户保存登录ip和登录时间，延迟批量写入，不阻塞登录响应
+                write_behind.set(User, user_data.id, last_login_ip=login_ip, last_login_time=datetime.now())
 
     except SiteException as error:
         logger.error(f"用户登录错误，错误原因为：{error.response.message}")
@@ -330,19 +414,15 @@ async def logout(payload: PayloadData = Depends(optional_signature_authenticatio
     """
     if payload.data:
         expire = payload.exp - timegm(datetime.utcnow().utctimetuple())
-        await cache_client.set_blacklist(identify=payload.data.id, value=payload.json(), expire=expire)
-        await cache_client.delete_permission(identify=payload.data.id)
+        # 黑名单和删除权限在同一个事务中执行
+        async with cache_client.pipeline() as pipe:
+            await revocation_set.revoke(payload, expire=expire, cache_client=pipe)
+            await pipe.delete_permission(identify=payload.data.id)
     return Response[dict]()
 
 
-@router.get("/load_data", summary="加载数据", response_model=Response[LoadData])
-async def load_init_data(request: Request, payload: PayloadData = Depends(optional_signature_authentication), cache_client: CacheSystem = Depends(cache)):
+async def get_load_data(payload: PayloadData, cache_client: CacheSystem) -> LoadData:
     load_data = LoadData()
-    if not payload.data:
-        token = request.headers.get("Authorization-Refresh", None)
-        if token:
-            payload = await optional_signature_authentication(request, SecurityScopes(), token, cache_client)
-
     if payload.data:
         load_data.auth = True
         methods = ['GET', 'POST', 'PUT', 'DELETE', 'PATCH']
@@ -357,8 +437,40 @@ async def load_init_data(request: Request, payload: PayloadData = Depends(option
     else:
         load_data.permissions = {}
         load_data.auth = False
+    return load_data
+
+
+async def get_load_data_variant(payload: PayloadData, cache_client: CacheSystem) -> tuple | None:
+    """
+    加载数据只取决于用户的角色，角色相同的用户使用同一个缓存的响应
+    :param payload: token 负载数据
+    :param cache_client: 缓存客户端
+    :return: 角色权限的版本号和用户角色，用户权限不在缓存中时返回 None，此时不使用缓存的响应
+    """
+    if not payload.data:
+        return ()
+    roles = await cache_client.get_permission(payload.data.id, PERMISSION_ROLES_FIELD)
+    if roles is None:
+        return None
+    return await cache_client.get_generation(ROLE_PERMISSION_FAMILY), tuple(sorted(roles))
+
+
+@router.get("/load_data", summary="加载数据", response_model=Response[LoadData])
+async def load_init_data(request: Request, payload: PayloadData = Depends(optional_signature_authentication), cache_client: CacheSystem = Depends(cache)):
+    if not payload.data:
+        token = request.headers.get("Authorization-Refresh", None)
+        if token:
+            payload = await optional_signature_authentication(request, SecurityScopes(), token, cache_client)
+
+    variant = await get_load_data_variant(payload, cache_client) if response_cache is not None else None
+    if variant is not None:
+        async def render() -> bytes:
+            return Response[LoadData](data=await get_load_data(payload, cache_client)).as_response().body
+
+        cached = await response_cache.get_or_render(LOAD_DATA_RESPONSE, variant, render)
+        return cached.response(request)
 
-    return Response[LoadData](data=load_data)
+    return Response[LoadData](data=await get_load_data(payload, cache_client))
 
 
 @router.get("/user/info", summary="获取用户信息", response_model=Response[UserInfo])
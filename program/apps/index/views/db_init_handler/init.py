@@ -9,6 +9,8 @@ from apps.index.views.db_init_handler.init_db_items import permission_list
 from oracle.sqlalchemy import sql_helper
 from watchtower import Response
 from watchtower.depends.authorization.authorization import get_password_hash
+from watchtower.depends.authorization.permission_catalog import permission_catalog
+from watchtower.depends.cache.cache import cache as cache_client, ROLE_PERMISSION_FAMILY
 from watchtower.settings import settings
 
 router = APIRouter()
@@ -88,5 +90,8 @@ async def init_db(force: bool = False):
             await session.flush()
 
     await business_init.run()
+    # 权限发生变化，业务初始化也可能修改其他角色的权限，使所有角色的权限缓存失效并更新权限目录版本
+    await cache_client.bump_generation(ROLE_PERMISSION_FAMILY)
+    await permission_catalog.bump()
 
     return InitResponse()
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends
+
+from oracle.snowflake import snow
+from oracle.types import ONLY_SUPERUSER_CODE
+from oracle.utils import is_superuser
+from watchtower import PayloadData, Response, SiteException, signature_authentication
+from watchtower.depends.authorization.fallback import authorization_fallback
+from watchtower.depends.cache.backend.redis_backend import get_pool_stats
+from watchtower.depends.cache.cache import cache
+from watchtower.depends.cache.response_cache import response_cache
+from watchtower.depends.cache.shared import shared_store
+from watchtower.settings import settings
+from watchtower.status.global_status import StatusMap
+from watchtower.status.types.response import Status
+
+
+async def superuser_authentication(payload: PayloadData = Depends(signature_authentication)) -> PayloadData:
+    """
+    运行状态中包含带有用户id的key、连接池和熔断器状态以及机器id，只允许超级管理员查看
+    :param payload: 登录用户信息
+    :return:
+    """
+    if not await is_superuser(payload):
+        status = Status(code=StatusMap.ONLY_SUPERUSER.code, message="当前用户不是超级管理员，无法查看运行状态")
+        response = Response[dict](status=status)
+        raise SiteException(status_code=ONLY_SUPERUSER_CODE, response=response)
+    return payload
+
+
+router = APIRouter(dependencies=[Depends(superuser_authentication)])
+
+
+@router.get("/metrics/cache", response_model=Response[dict], summary="缓存运行状态")
+async def cache_metrics():
+    """
+    缓存运行状态，包括各类key的命令延迟、命中率、数据量、访问最多的key、连接池使用情况、熔断器状态、权限验证降级次数、一级缓存命中率、共享数据的版本以及响应缓存的命中率，只统计当前进程
+    \f
+    :return:
+    """
+    if settings.CACHE_REDIS_ENABLE:
+        backend = get_pool_stats()
+    else:
+        backend = cache.backend.stats()
+
+    data = {
+        "commands": cache.metrics.snapshot() if cache.metrics is not None else None,
+        "backend": backend,
+        "breaker": cache.breaker.stats() if cache.breaker is not None else None,
+        "authorization_fallback": authorization_fallback.stats(),
+        "local": cache.local.stats() if cache.local is not None else None,
+        "shared": shared_store.stats() if shared_store is not None else None,
+        "response": response_cache.stats() if response_cache is not None else None,
+    }
+    return Response[dict](data=data)
+
+
+@router.get("/metrics/snowflake", response_model=Response[dict], summary="id生成器运行状态")
+async def snowflake_metrics():
+    """
+    id生成器运行状态，包括当前使用的机器id、时钟回拨次数、最大回拨毫秒数、拒绝生成的次数以及等待时间，只统计当前进程
+    \f
+    :return:
+    """
+    return Response[dict](data=snow.stats())
@@ -1,10 +1,33 @@
 # from apps.admin.views.menu_handler.build_menu import get_menu_tree
+from oracle.worker_lease import worker_lease
+from oracle.write_behind import write_behind
+from watchtower.depends.authorization.permission_catalog import permission_catalog
+from watchtower.depends.authorization.revocation import revocation_set
+from watchtower.depends.cache.shared import shared_store
+from watchtower.depends.cache.subscriber import subscriber
 
 
 async def on_startup():
     # await get_menu_tree(True)
-    pass
+    # 租用雪花算法的id之后才能写入数据
+    if worker_lease is not None:
+        await worker_lease.start()
+    await revocation_set.start()
+    await permission_catalog.start()
+    if shared_store is not None:
+        await shared_store.start()
+    # 所有频道注册完成之后再启动订阅
+    subscriber.start()
+    write_behind.start()
 
 
 async def on_shutdown():
-    pass
+    await revocation_set.stop()
+    await permission_catalog.stop()
+    if shared_store is not None:
+        await shared_store.stop()
+    await subscriber.stop()
+    # 关闭前写入所有延迟写入的数据
+    await write_behind.stop()
+    if worker_lease is not None:
+        await worker_lease.stop()
@@ -1,7 +1,15 @@
+import asyncio
+import threading
 import time
+from dataclasses import dataclass
+from datetime import datetime
 
 from watchtower.settings import logger, settings
 
+# 剩余可用时间少于该年数时在启动时警告
+LIFETIME_WARNING_YEARS = 10
+MILLISECONDS_PER_YEAR = 365.25 * 24 * 3600 * 1000
+
 
 class InvalidSystemClock(Exception):
     """
@@ -10,12 +18,101 @@ class InvalidSystemClock(Exception):
     pass
 
 
+class WorkerLeaseExpired(Exception):
+    """
+    机器id和机房id的租约已经失效，其他进程可能正在使用同一组id
+    """
+    pass
+
+
+# 前端 js 可以精确表示的整数位数
+JS_SAFE_BITS = 53
+
+
+@dataclass(frozen=True)
+class SnowLayout:
+    """
+    雪花算法id的位数划分：时间戳-机房id-机器id-序号
+    timestamp_bits: 时间戳位数，决定从基准时间开始可以使用的年数
+    datacenter_id_bits、server_id_bits: 机房id、机器id位数，两者决定最多可以同时运行的进程数量
+    sequence_bits: 序号位数，决定每个进程每毫秒最多生成的id数量
+    tw_epoch: 基准时间戳，单位为毫秒
+    """
+    timestamp_bits: int
+    datacenter_id_bits: int
+    server_id_bits: int
+    sequence_bits: int
+    tw_epoch: int
+
+    @property
+    def total_bits(self) -> int:
+        return self.timestamp_bits + self.datacenter_id_bits + self.server_id_bits + self.sequence_bits
+
+    @property
+    def js_safe(self) -> bool:
+        # 前端 js 的 Number 只能精确表示 53 位以内的整数
+        return self.total_bits <= JS_SAFE_BITS
+
+    @property
+    def nodes(self) -> int:
+        return 1 << (self.datacenter_id_bits + self.server_id_bits)
+
+    @property
+    def ids_per_millisecond(self) -> int:
+        return 1 << self.sequence_bits
+
+    @property
+    def expire_timestamp(self) -> int:
+        return self.tw_epoch + (1 << self.timestamp_bits)
+
+
+# 可以通过 SNOWFLAKE_PROFILE 选择的位数划分
+# 修改已有数据的项目的划分时，新划分生成的id必须大于已有的id，否则可能重复，即时间戳的左移位数不能减少、基准时间不能推后
+SNOW_PROFILES = {
+    # 53位，前端js可以直接显示：64个进程，每个进程每毫秒64个id
+    'js_safe': SnowLayout(timestamp_bits=41, datacenter_id_bits=2, server_id_bits=4, sequence_bits=6, tw_epoch=1673366400000),
+    # 53位，前端js可以直接显示：8个进程，每个进程每毫秒512个id，用于批量导入
+    'js_safe_bulk': SnowLayout(timestamp_bits=41, datacenter_id_bits=1, server_id_bits=2, sequence_bits=9, tw_epoch=1673366400000),
+    # 63位，接口中的id需要按照字符串返回，create_snow 不能使用，只用于基准测试：128个进程，每个进程每毫秒32768个id
+    'high_throughput': SnowLayout(timestamp_bits=41, datacenter_id_bits=2, server_id_bits=5, sequence_bits=15, tw_epoch=1673366400000),
+    # 63位，接口中的id需要按照字符串返回，create_snow 不能使用，只用于基准测试：1024个进程，每个进程每毫秒4096个id
+    'many_nodes': SnowLayout(timestamp_bits=41, datacenter_id_bits=5, server_id_bits=5, sequence_bits=12, tw_epoch=1673366400000),
+}
+
+
+@dataclass
+class SnowId:
+    """
+    解析后的雪花算法id
+    """
+    timestamp: int
+    datacenter_id: int
+    server_id: int
+    sequence: int
+
+    @property
+    def create_time(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp / 1000)
+
+
 class Snow:
     """
     雪花算法生成全局自增唯一id
     """
 
-    def __init__(self, server_id=0, datacenter_id=0, sequence=0, server_id_bits=5, datacenter_id_bits=5, sequence_bits=12, tw_epoch=1288834974657):
+    def __init__(
+            self,
+            server_id=0,
+            datacenter_id=0,
+            sequence=0,
+            server_id_bits=5,
+            datacenter_id_bits=5,
+            sequence_bits=12,
+            tw_epoch=1288834974657,
+            timestamp_bits=41,
+            max_backward_ms=0,
+            reserved_sequences=0
+    ):
         # 64位ID的划分
         # server_id_bits = 5
         # datacenter_id_bits = 5
@@ -24,16 +121,12 @@ class Snow:
         # tw_epoch = 1288834974657
 
         # 最大取值计算 机房和机器的ID
-        max_server_id = -1 ^ (-1 << server_id_bits)  # 2**5-1 0b11111
-        max_datacenter_id = -1 ^ (-1 << datacenter_id_bits)
+        self.max_server_id = -1 ^ (-1 << server_id_bits)  # 2**5-1 0b11111
+        self.max_datacenter_id = -1 ^ (-1 << datacenter_id_bits)
 
         # sanity check
         # 最大编号可为00-31  实际使用范围 00-29  备用 30 31
-        if server_id > max_server_id or server_id < 0:
-            raise ValueError('worker_id值越界')
-
-        if datacenter_id > max_datacenter_id or datacenter_id < 0:
-            raise ValueError('datacenter_id值越界')
+        self.check_worker(server_id, datacenter_id)
 
         # 移位偏移计算
         self.server_id_shift = sequence_bits
@@ -45,61 +138,267 @@ class Snow:
 
         # Twitter元年时间戳
         self.tw_epoch = tw_epoch
+        self.layout = SnowLayout(timestamp_bits, datacenter_id_bits, server_id_bits, sequence_bits, tw_epoch)
+        self.check_lifetime()
+
+        # 时钟回拨容忍：回拨不超过 max_backward_ms 毫秒时继续使用上次的时间戳，序号用完后等待时钟追上，超过时拒绝生成
+        # 每毫秒保留 reserved_sequences 个序号只在回拨期间使用，回拨较小时不需要等待
+        if reserved_sequences < 0 or reserved_sequences > self.sequence_mask:
+            raise ValueError('reserved_sequences值越界')
+        self.max_backward_ms = max_backward_ms
+        self.sequence_limit = self.sequence_mask + 1 - reserved_sequences
+        self.clock_backward = False
+        self.rollback_count = 0
+        self.max_rollback_ms = 0
+        self.rejected_count = 0
+        self.stall_seconds = 0.0
+        self.rollback_stall_seconds = 0.0
 
         self.server_id = server_id
         self.datacenter_id = datacenter_id
         self.sequence = sequence
+        # 机器id租约的过期时间，time.monotonic_ns() 的值，过期后拒绝生成id直到重新租用；为 None 时使用配置的id，不限制
+        self.lease_deadline_ns: int | None = None
 
-        # 上次计算的时间戳
+        # 上次分配id的时间戳，以及该毫秒内下一个可用的序号
         self.last_timestamp = int(time.time() * 1000)
+        self.lock = threading.Lock()
 
-    def get_id(self):
+    @classmethod
+    def from_layout(cls, layout: SnowLayout, server_id=0, datacenter_id=0, **kwargs) -> 'Snow':
+        return cls(
+            server_id,
+            datacenter_id,
+            0,
+            layout.server_id_bits,
+            layout.datacenter_id_bits,
+            layout.sequence_bits,
+            layout.tw_epoch,
+            layout.timestamp_bits,
+            **kwargs
+        )
+
+    def check_lifetime(self):
         """
-        获取雪花算法生成的id
+        检查基准时间和时间戳位数，基准时间在未来或者时间戳已经用完时不能使用
         :return:
         """
-        # 生成整数时间戳
-        now_timestamp = int(time.time() * 1000)
+        if self.layout.total_bits > 63:
+            raise ValueError(f'雪花算法id的位数 {self.layout.total_bits} 超过了 63 位')
+        now_timestamp = self.get_timestamp()
+        if self.tw_epoch > now_timestamp:
+            raise ValueError('雪花算法的基准时间不能晚于当前时间')
+        remaining = self.layout.expire_timestamp - now_timestamp
+        if remaining <= 0:
+            raise ValueError(f'雪花算法的时间戳已经用完，过期时间为 {datetime.fromtimestamp(self.layout.expire_timestamp / 1000)}')
+        if remaining < LIFETIME_WARNING_YEARS * MILLISECONDS_PER_YEAR:
+            logger.warning(f'snowflake timestamp will run out at {datetime.fromtimestamp(self.layout.expire_timestamp / 1000)}')
 
-        # 时钟回拨
-        if now_timestamp < self.last_timestamp:
-            logger.error(f'clock is moving backwards. Rejecting requests until {self.last_timestamp}')
-            raise InvalidSystemClock
+    def decode(self, snow_id: int) -> SnowId:
+        """
+        解析id中的时间戳、机房id、机器id和序号
+        :param snow_id: 当前划分生成的id
+        :return:
+        """
+        return SnowId(
+            timestamp=(snow_id >> self.timestamp_left_shift) + self.tw_epoch,
+            datacenter_id=snow_id >> self.datacenter_id_shift & self.max_datacenter_id,
+            server_id=snow_id >> self.server_id_shift & self.max_server_id,
+            sequence=snow_id & self.sequence_mask
+        )
 
-        if now_timestamp == self.last_timestamp:
-            self.sequence = (self.sequence + 1) & self.sequence_mask
-            # sequence 大于 4096强制停1ms
-            if self.sequence == 0:
-                while True:
-                    now_timestamp = int(time.time() * 1000)
-                    if now_timestamp > self.last_timestamp:
-                        break
-        else:
-            self.sequence = 0
+    def get_min_id(self, create_time: datetime) -> int:
+        """
+        指定时间生成的最小id，id按照时间递增，时间范围可以转换为主键范围
+        :param create_time: 时间，不带时区时按照本地时间处理，与 create_time 字段一致
+        :return: 早于基准时间时返回 0
+        """
+        timestamp = int(create_time.timestamp() * 1000)
+        return max(timestamp - self.tw_epoch, 0) << self.timestamp_left_shift
 
-        new_id = ((now_timestamp - self.tw_epoch) << self.timestamp_left_shift) | \
-                 (self.datacenter_id << self.datacenter_id_shift) | \
-                 (self.server_id << self.server_id_shift) | self.sequence
+    def check_worker(self, server_id: int, datacenter_id: int):
+        if server_id > self.max_server_id or server_id < 0:
+            raise ValueError('worker_id值越界')
 
-        return new_id
+        if datacenter_id > self.max_datacenter_id or datacenter_id < 0:
+            raise ValueError('datacenter_id值越界')
 
+    def set_worker(self, server_id: int, datacenter_id: int, lease_deadline_ns: int | None = None):
+        """
+        修改机器id和机房id，用于启动后租用到id的情况
+        :param server_id: 机器id
+        :param datacenter_id: 机房id
+        :param lease_deadline_ns: 租约的过期时间，time.monotonic_ns() 的值
+        :return:
+        """
+        self.check_worker(server_id, datacenter_id)
+        with self.lock:
+            self.server_id = server_id
+            self.datacenter_id = datacenter_id
+            self.lease_deadline_ns = lease_deadline_ns
 
-class SnowShort(Snow):
-    """
-    雪花算法生成全局自增唯一id
-    为了适应前段js显示，修改雪花算法，将显示位数缩小为53位
-    时间戳(41位)-工作机器id(6位)-序列号(6位)：最大支持64个workerId, 每毫秒生成64个序列号
-    """
+    def set_lease_deadline(self, lease_deadline_ns: int):
+        """
+        续期成功后延长租约的过期时间，租约丢失时设置为 0 立即停止生成id
+        :param lease_deadline_ns: 租约的过期时间，time.monotonic_ns() 的值
+        :return:
+        """
+        with self.lock:
+            self.lease_deadline_ns = lease_deadline_ns
+
+    @property
+    def lease_expired(self) -> bool:
+        return self.lease_deadline_ns is not None and time.monotonic_ns() >= self.lease_deadline_ns
+
+    @staticmethod
+    def get_timestamp() -> int:
+        return int(time.time() * 1000)
+
+    def reserve(self, count: int) -> tuple[int, int, int, int, int] | float:
+        """
+        在当前毫秒内预留一段连续的序号，机房id和机器id在锁内一起读取，与预留的序号属于同一个租约
+        :param count: 需要的id数量
+        :return: (时间戳, 起始序号, 预留数量, 机房id, 机器id)，序号已经用完时返回需要等待的秒数
+        """
+        with self.lock:
+            # 租约失效后同一组id可能已经被其他进程使用，继续生成会产生重复的id
+            if self.lease_expired:
+                raise WorkerLeaseExpired
+            # 在锁内获取时间戳，否则其他线程先获取到较新的时间戳时会被误判为时钟回拨
+            now_timestamp = self.get_timestamp()
+            # 时钟回拨
+            if now_timestamp < self.last_timestamp:
+                backward = self.last_timestamp - now_timestamp
+                if backward > self.max_backward_ms:
+                    self.rejected_count += 1
+                    logger.error(f'clock is moving backwards {backward}ms. Rejecting requests until {self.last_timestamp}')
+                    raise InvalidSystemClock
+                if not self.clock_backward:
+                    self.clock_backward = True
+                    self.rollback_count += 1
+                    logger.warning(f'clock is moving backwards {backward}ms, keep using timestamp {self.last_timestamp}')
+                self.max_rollback_ms = max(self.max_rollback_ms, backward)
+                # 回拨期间继续使用上次的时间戳，可以使用保留的序号；用完后等待回拨的时长，等待结束时时钟已经追上上次的时间戳
+                if self.sequence > self.sequence_mask:
+                    return (backward + 1) / 1000
+                limit = self.sequence_mask + 1
+            else:
+                self.clock_backward = False
+                if now_timestamp > self.last_timestamp:
+                    if now_timestamp >= self.layout.expire_timestamp:
+                        raise ValueError('雪花算法的时间戳已经用完')
+                    self.last_timestamp = now_timestamp
+                    self.sequence = 0
+
+                # 序号用完后等待下一毫秒
+                if self.sequence >= self.sequence_limit:
+                    return max((self.last_timestamp + 1) / 1000 - time.time(), 0.0)
+                limit = self.sequence_limit
+
+            first_sequence = self.sequence
+            count = min(count, limit - first_sequence)
+            self.sequence += count
+            return self.last_timestamp, first_sequence, count, self.datacenter_id, self.server_id
+
+    def record_stall(self, seconds: float):
+        with self.lock:
+            self.stall_seconds += seconds
+            if self.clock_backward:
+                self.rollback_stall_seconds += seconds
+
+    def make_ids(self, timestamp: int, first_sequence: int, count: int, datacenter_id: int, server_id: int) -> range:
+        """
+        将预留的序号转换为id，同一毫秒内的id是连续的
+        :param timestamp: 时间戳
+        :param first_sequence: 起始序号
+        :param count: 数量
+        :param datacenter_id: 预留序号时的机房id
+        :param server_id: 预留序号时的机器id
+        :return:
+        """
+        base = ((timestamp - self.tw_epoch) << self.timestamp_left_shift) | \
+               (datacenter_id << self.datacenter_id_shift) | \
+               (server_id << self.server_id_shift)
+        return range(base | first_sequence, (base | first_sequence) + count)
+
+    def get_ids(self, count: int) -> list[int]:
+        """
+        批量获取id，每个毫秒内预留一段连续的序号，序号用完后休眠到下一毫秒，不再空转
+        在事件循环中使用时应当使用 get_ids_async
+        :param count: 需要的id数量
+        :return:
+        """
+        ids = []
+        while len(ids) < count:
+            reserved = self.reserve(count - len(ids))
+            if isinstance(reserved, float):
+                start = time.monotonic()
+                time.sleep(reserved)
+                self.record_stall(time.monotonic() - start)
+                continue
+            ids.extend(self.make_ids(*reserved))
+        return ids
+
+    async def get_ids_async(self, count: int) -> list[int]:
+        """
+        批量获取id，序号用完后让出事件循环等待下一毫秒
+        :param count: 需要的id数量
+        :return:
+        """
+        ids = []
+        while len(ids) < count:
+            reserved = self.reserve(count - len(ids))
+            if isinstance(reserved, float):
+                start = time.monotonic()
+                await asyncio.sleep(reserved)
+                self.record_stall(time.monotonic() - start)
+                continue
+            ids.extend(self.make_ids(*reserved))
+        return ids
+
+    def get_id(self) -> int:
+        """
+        获取雪花算法生成的id
+        :return:
+        """
+        return self.get_ids(1)[0]
+
+    async def get_id_async(self) -> int:
+        return (await self.get_ids_async(1))[0]
+
+    def stats(self) -> dict:
+        return {
+            'datacenter_id': self.datacenter_id,
+            'server_id': self.server_id,
+            'lease_expired': self.lease_expired,
+            'max_backward_ms': self.max_backward_ms,
+            'reserved_sequences': self.sequence_mask + 1 - self.sequence_limit,
+            'clock_backward': self.clock_backward,
+            'rollback': self.rollback_count,
+            'max_rollback_ms': self.max_rollback_ms,
+            'rejected': self.rejected_count,
+            'stall_ms': round(self.stall_seconds * 1000, 3),
+            'rollback_stall_ms': round(self.rollback_stall_seconds * 1000, 3),
+        }
 
-    def __init__(self, server_id=0, datacenter_id=0, sequence=0):
-        # 53位ID的划分
-        server_id_bits = 4
-        datacenter_id_bits = 2
-        sequence_bits = 6
-        # 基准时间戳，人为规定为 2023/01/11 00:00:00
-        tw_epoch = 1673366400000
 
-        super().__init__(server_id, datacenter_id, sequence, server_id_bits, datacenter_id_bits, sequence_bits, tw_epoch)
+def create_snow() -> Snow:
+    layout = SNOW_PROFILES.get(settings.SNOWFLAKE_PROFILE)
+    if layout is None:
+        raise ValueError(f'不支持的雪花算法划分 {settings.SNOWFLAKE_PROFILE}，可选的划分：{", ".join(SNOW_PROFILES)}')
+    # 接口中的id都按照数字返回，超过 53 位的id在前端会丢失精度
+    if not layout.js_safe:
+        raise ValueError(
+            f'雪花算法划分 {settings.SNOWFLAKE_PROFILE} 生成 {layout.total_bits} 位的id，超过了前端可以精确表示的 {JS_SAFE_BITS} 位，'
+            f'可选的划分：{", ".join(name for name, item in SNOW_PROFILES.items() if item.js_safe)}'
+        )
+    return Snow.from_layout(
+        layout,
+        server_id=settings.SERVER_ID,
+        datacenter_id=settings.DATACENTER_ID,
+        max_backward_ms=settings.SNOWFLAKE_MAX_BACKWARD_MS,
+        reserved_sequences=settings.SNOWFLAKE_RESERVED_SEQUENCES
+    )
 
 
-snow = SnowShort(server_id=settings.SERVER_ID, datacenter_id=settings.DATACENTER_ID)
+snow = create_snow()
@@ -1,7 +1,7 @@
 import re
 import time
 from datetime import datetime
-from typing import Type, Any, Callable, Generator, Coroutine, Sequence, Optional
+from typing import Type, Any, Callable, Generator, Coroutine, Sequence, Optional, AsyncIterator
 
 from fastapi import Depends, Query, Body
 from fastapi.types import DecoratedCallable
@@ -20,7 +20,8 @@ from oracle.utils import is_superuser
 from watchtower import PayloadData, optional_signature_authentication, Response, SiteException
 from watchtower.settings import logger, settings
 from watchtower.status.global_status import StatusMap
-from watchtower.status.types.response import GetAllData, PaginationData, generate_response_model, Status
+from watchtower.status.types.exception import PrerenderedError
+from watchtower.status.types.response import GetAllData, PaginationData, generate_response_model, Status, FastJSONResponse
 
 Session = Callable[..., Generator[AsyncSession, Any, None]]
 
@@ -35,6 +36,14 @@ CreateFailed = generate_response_model("CreateFailed", StatusMap.CREATE_FAILED)
 UpdateFailed = generate_response_model("UpdateFailed", StatusMap.UPDATE_FAILED)
 DeleteFailed = generate_response_model("DeleteFailed", StatusMap.DELETE_FAILED)
 
+# 内容固定的错误响应，模块加载时编码一次
+ITEM_NOT_FOUND_ERROR = PrerenderedError(ITEM_NOT_FOUND_CODE, StatusMap.ITEM_NOT_FOUND)
+MULTIPLE_RESULTS_FOUND_ERROR = PrerenderedError(MULTIPLE_RESULTS_FOUND_CODE, StatusMap.MULTIPLE_RESULTS_FOUND)
+PRIMARY_KEY_EXISTED_ERROR = PrerenderedError(PRIMARY_KEY_EXISTED_CODE, StatusMap.PRIMARY_KEY_EXISTED)
+CREATE_FAILED_ERROR = PrerenderedError(CREATE_FAILED_CODE, StatusMap.CREATE_FAILED)
+UPDATE_FAILED_ERROR = PrerenderedError(UPDATE_FAILED_CODE, StatusMap.UPDATE_FAILED)
+DELETE_FAILED_ERROR = PrerenderedError(DELETE_FAILED_CODE, StatusMap.DELETE_FAILED)
+
 # 为其他请求预留响应模式
 ONLY_SUPERUSER_RESPONSE = {
     ONLY_SUPERUSER_CODE: {
@@ -192,6 +201,7 @@ ModelBase = sql_helper.model_base
 class SiteBaseModel(ModelBase):
     __abstract__ = True
 
+    # 接口创建数据时已经通过 snow.get_id_async 分配了id，默认值只用于初始化等直接使用 session 写入的数据
     id: Mapped[int] = mapped_column("id", BigInteger, primary_key=True, default=snow.get_id, comment="索引")
     # 如果是postgres数据库，需要先手动创建enum类型
     # CREATE TYPE ModelStatus AS ENUM ('active', 'inactive', 'frozen', 'obsolete');
@@ -201,6 +211,95 @@ class SiteBaseModel(ModelBase):
     update_time: Mapped[datetime] = mapped_column("update_time", DateTime, default=datetime.now, onupdate=datetime.now, comment="更新时间")
 
 
+def get_created_range_filter(
+        db_model: Type[SiteBaseModel],
+        created_after: datetime | None = None,
+        created_before: datetime | None = None,
+        by_id: bool = True
+) -> list:
+    """
+    将创建时间范围转换为主键范围，查询时使用主键索引，不需要扫描没有索引的 create_time 字段
+    只适用于主键由当前雪花算法生成的数据，其他数据（例如初始化时指定的id）需要使用 create_time 字段查询
+    :param db_model: 数据模型
+    :param created_after: 创建时间不早于该时间
+    :param created_before: 创建时间早于该时间
+    :param by_id: 是否转换为主键范围，为 False 时使用 create_time 字段
+    :return: 查询条件
+    """
+    conditions = []
+    if created_after is not None:
+        conditions.append(db_model.id >= snow.get_min_id(created_after) if by_id else db_model.create_time >= created_after)
+    if created_before is not None:
+        conditions.append(db_model.id < snow.get_min_id(created_before) if by_id else db_model.create_time < created_before)
+    return conditions
+
+
+async def iter_id_batches(
+        db_model: Type[SiteBaseModel],
+        created_after: datetime | None = None,
+        created_before: datetime | None = None,
+        batch_size: int = 1000,
+        conditions: list | None = None,
+        by_id: bool = True
+) -> AsyncIterator[list]:
+    """
+    按照主键顺序分批读取创建时间范围内的数据，用于归档等批量处理
+    每批使用 id > 上一批最大id 的条件，不使用 offset，每批都是主键的范围查询
+    :param db_model: 数据模型
+    :param created_after: 创建时间不早于该时间
+    :param created_before: 创建时间早于该时间
+    :param batch_size: 每批的数量
+    :param conditions: 其他查询条件
+    :param by_id: 创建时间范围是否转换为主键范围，见 get_created_range_filter
+    :return:
+    """
+    range_filter = get_created_range_filter(db_model, created_after, created_before, by_id)
+    last_id = None
+    while True:
+        statement = select(db_model).where(*range_filter, *(conditions or []))
+        if last_id is not None:
+            statement = statement.where(db_model.id > last_id)
+        statement = statement.order_by(db_model.id.asc()).limit(batch_size)
+
+        async with sql_helper.get_session().begin() as session:
+            rows = (await session.execute(statement)).scalars().all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+async def delete_created_before(
+        db_model: Type[SiteBaseModel],
+        created_before: datetime,
+        batch_size: int = 1000,
+        conditions: list | None = None,
+        by_id: bool = True
+) -> int:
+    """
+    按照主键范围分批删除指定时间之前创建的数据，用于归档后清理，每批一个事务，避免长时间锁表
+    :param db_model: 数据模型
+    :param created_before: 删除早于该时间创建的数据
+    :param batch_size: 每批的数量
+    :param conditions: 其他查询条件
+    :param by_id: 创建时间是否转换为主键范围，初始化时指定了id的数据需要设置为 False，否则会被当作最早创建的数据删除
+    :return: 删除的数量
+    """
+    range_filter = get_created_range_filter(db_model, created_before=created_before, by_id=by_id)
+    deleted = 0
+    while True:
+        async with sql_helper.get_session().begin() as session:
+            ids_statement = select(db_model.id).where(*range_filter, *(conditions or [])).order_by(db_model.id.asc()).limit(batch_size)
+            ids = (await session.execute(ids_statement)).scalars().all()
+            if ids:
+                await session.execute(delete(db_model).where(db_model.id.in_(ids)))
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+
+
 class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
     def __init__(
             self,
@@ -227,9 +326,15 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
             verbose_name: str = '',
             verbose_name_plural: str = '',
             delete_update_field: str = '',
+            created_range_by_id: bool = True,
+            fast_response: bool | None = None,
             **kwargs: Any
     ) -> None:
         self.db_model = db_model
+        # 列表数据已经按照 schema 的字段整理，直接编码为 JSON 返回，默认使用 FAST_RESPONSE_ENABLE
+        self.fast_response = settings.FAST_RESPONSE_ENABLE if fast_response is None else fast_response
+        # 按照创建时间查询时是否转换为主键范围，主键不是由雪花算法生成（例如初始化时指定的id）时需要设置为 False，使用 create_time 字段查询
+        self.created_range_by_id = created_range_by_id
         self.db_func = sql_helper.get_session
         self._primary_key: str = db_model.__table__.primary_key.columns.keys()[0]
         self._primary_key_type: type = get_pk_type(schema, self._primary_key)
@@ -244,6 +349,9 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
             self.verbose_name_plural = verbose_name_plural
 
         self.delete_update_field = delete_update_field
+        # 响应类型在创建路由时生成一次，请求时不再对泛型模型参数化
+        self.one_response_type = Response[schema]
+        self.list_response_type = Response[GetAllData]
 
         if not isinstance(get_all_route_params, dict):
             get_all_route_params = {}
@@ -344,6 +452,18 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                     description="id list",
                     example=[1, 2, 3]
                 ),
+                created_after: datetime | None = Query(
+                    default=None,
+                    title="created after",
+                    description="create time is not earlier than this time",
+                    example="2023-01-11T00:00:00"
+                ),
+                created_before: datetime | None = Query(
+                    default=None,
+                    title="created before",
+                    description="create time is earlier than this time",
+                    example="2023-01-12T00:00:00"
+                ),
                 payload: PayloadData | None = Depends(optional_signature_authentication)
         ) -> Response[GetAllData]:
             filters_dict = {}
@@ -357,18 +477,16 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
             if not orders:
                 orders = [getattr(self.db_model, self._primary_key).name]
 
-            all_records, count_records, pagination = await self._orm_get_all(pagination, filters_dict, orders, ids, payload)
+            created_range = self.created_range_filter(created_after, created_before)
+            all_records, count_records, pagination = await self._orm_get_all(pagination, filters_dict, orders, ids, payload, created_range)
 
             pagination_data = PaginationData(index=pagination.index, limit=pagination.limit, total=count_records, offset=pagination.offset)
-            data = GetAllData(items=all_records, pagination=pagination_data).dict()
-            response = Response[GetAllData](data=data)
-
-            return response
+            return self.encode_list(all_records, pagination_data)
 
         return route
 
     def _create(self, *args: Any, **kwargs: Any) -> RESPONSE_CALLABLE:
-        async def route(model: self.create_schema, payload: PayloadData | None = Depends(optional_signature_authentication)) -> Response[self.schema]:  # type: ignore
+        async def route(model: self.create_schema, payload: PayloadData | None = Depends(optional_signature_authentication)) -> self.one_response_type:  # type: ignore
             async with self.db_func().begin() as session:
                 try:
                     if hasattr(self, '_pre_create'):
@@ -385,6 +503,10 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                     if invalid:
                         raise ValidationError(f"字段{main_key}的值{main_value}不允许以_delete结尾")
 
+                    # 在请求中预先分配id，序号用完时让出事件循环等待，不使用 flush 时同步执行的字段默认值
+                    if db_model_data.get(self._primary_key) is None:
+                        db_model_data[self._primary_key] = await snow.get_id_async()
+
                     db_model: Model = self.db_model(**db_model_data)
                     session.add(db_model)
                     await session.flush()
@@ -398,8 +520,7 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                         value = result.group(1)
                         response = Response[dict](status=Status(StatusMap.PRIMARY_KEY_EXISTED.code, f"字段{key}的值{value}已存在"))
                         raise SiteException(status_code=PRIMARY_KEY_EXISTED_CODE, response=response) from None
-                    response = Response[dict](status=StatusMap.PRIMARY_KEY_EXISTED)
-                    raise SiteException(status_code=PRIMARY_KEY_EXISTED_CODE, response=response) from None
+                    raise PRIMARY_KEY_EXISTED_ERROR.exception() from None
                 except ValidationError as error:
                     validation_error_status = Status(StatusMap.DATA_VALIDATION_FAILED.code, error.args[0])
                     response = Response[dict](status=validation_error_status)
@@ -407,18 +528,13 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                 except Exception as error:
                     await session.rollback()
                     logger.error(f"create {self.db_model.__name__} error: {error}")
-                    response = Response[dict](status=StatusMap.CREATE_FAILED)
-                    raise SiteException(status_code=CREATE_FAILED_CODE, response=response) from None
-            response = Response[self.schema]()
+                    raise CREATE_FAILED_ERROR.exception() from None
             model = await self._orm_get_one(db_model.id, payload)
 
             if hasattr(self, '_post_create'):
                 model = await self._post_create(model)
 
-            # 这里会把 Model 类型自动转换为 schema 类型
-            # 直接使用 return Response[self.schema](data=db_model) 编辑器会发出警告，因此先赋值再返回
-            response.update(data=model)
-            return response
+            return self.encode_one(model)
 
         return route
 
@@ -447,21 +563,20 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
 
                     await session.commit()
 
+            if hasattr(self, '_post_delete_all'):
+                all_records = await self._post_delete_all(all_records)
+
             if count > 0:
                 pagination.limit = count
                 pagination.total = count
-            data = GetAllData(items=all_records, pagination=pagination).dict()
-            return Response[GetAllData](data=data)
+            return self.encode_list(all_records, PaginationData(**pagination.dict()))
 
         return route
 
     def _get_one(self, *args: Any, **kwargs: Any) -> RESPONSE_CALLABLE:
-        async def route(item_id: self._primary_key_type, payload: PayloadData | None = Depends(optional_signature_authentication)) -> Response[self.schema]:  # type: ignore
+        async def route(item_id: self._primary_key_type, payload: PayloadData | None = Depends(optional_signature_authentication)) -> self.one_response_type:  # type: ignore
             model = await self._orm_get_one(item_id, payload)
-
-            response = Response[self.schema]()
-            response.update(data=model)
-            return response
+            return self.encode_one(model)
 
         return route
 
@@ -470,7 +585,7 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                 item_id: self._primary_key_type,  # type: ignore
                 model: self.update_schema,  # type: ignore
                 payload: PayloadData | None = Depends(optional_signature_authentication)
-        ) -> Response[self.schema]:  # type: ignore
+        ) -> self.one_response_type:  # type: ignore
             # 只获取更新后的字段
             model = model.dict(exclude_unset=True, exclude={self._primary_key})
 
@@ -500,7 +615,7 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                             response = Response[dict](status=Status(StatusMap.PRIMARY_KEY_EXISTED.code, f"字段{key}的值{value}已存在"))
                             raise SiteException(status_code=PRIMARY_KEY_EXISTED_CODE, response=response) from None
                         logger.error(f"update {self.db_model.__name__} error: {error}")
-                        raise SiteException(status_code=UPDATE_FAILED_CODE, response=Response[dict](status=StatusMap.UPDATE_FAILED)) from None
+                        raise UPDATE_FAILED_ERROR.exception() from None
 
             db_model = await self._orm_get_one(item_id, payload)
             data = self.format_query_data(db_model)
@@ -508,14 +623,12 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
             if hasattr(self, '_post_update'):
                 data = await self._post_update(data)
 
-            response = Response[self.schema]()
-            response.update(data=data)
-            return response
+            return self.encode_one(data)
 
         return route
 
     def _delete_one(self, *args, **kwargs) -> RESPONSE_CALLABLE:
-        async def route(item_id: self._primary_key_type, payload: PayloadData | None = Depends(optional_signature_authentication)) -> Response[self.schema]:  # type: ignore
+        async def route(item_id: self._primary_key_type, payload: PayloadData | None = Depends(optional_signature_authentication)) -> self.one_response_type:  # type: ignore
             result = await self._orm_get_one(item_id, payload)
             data = self.format_query_data(result)
 
@@ -537,24 +650,44 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                 except Exception as error:
                     await session.rollback()
                     logger.error(f"delete {self.db_model.__name__} error: {error}")
-                    raise SiteException(status_code=DELETE_FAILED_CODE, response=Response[dict](status=StatusMap.DELETE_FAILED)) from None
+                    raise DELETE_FAILED_ERROR.exception() from None
 
             if hasattr(self, '_post_delete'):
                 data = await self._post_delete(data)
 
-            response = Response[self.schema]()
-            response.update(data=data)
-            return response
+            return self.encode_one(data)
 
         return route
 
+    def encode_one(self, data: Any) -> Response:
+        """
+        生成单条数据的响应，数据库模型由 FastAPI 按照 response_model 转换为 schema
+        :param data: 数据
+        :return:
+        """
+        response = self.one_response_type()
+        response.update(data=data)
+        return response
+
+    def encode_list(self, records: list, pagination: PaginationData) -> Response[GetAllData] | FastJSONResponse:
+        """
+        生成列表数据的响应，启用 fast_response 时直接编码为 JSON
+        :param records: 已经整理好的列表数据
+        :param pagination: 分页信息
+        :return:
+        """
+        if self.fast_response:
+            return self.list_response_type(data={"items": records, "pagination": pagination}).as_response()
+        return self.list_response_type(data=GetAllData(items=records, pagination=pagination).dict())
+
     async def _orm_get_all(
             self,
             pagination: PAGINATION = None,
             filters: dict[str, str] = None,
             orders: list[str] = None,
             ids: list[int] = None,
-            payload: PayloadData | None = None
+            payload: PayloadData | None = None,
+            conditions: list | None = None
     ) -> tuple[Sequence, int, PAGINATION]:
         if pagination is None:
             pagination = self.pagination()
@@ -566,6 +699,9 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
         orders_formatter = self._order_formatter(orders)
 
         all_statement, count_statement = await self._orm_get_all_statement(pagination, filters, orders_formatter, ids, payload)
+        if conditions:
+            all_statement = all_statement.where(*conditions)
+            count_statement = count_statement.where(*conditions)
 
         async with self.db_func().begin() as session:
             all_records = list()
@@ -608,11 +744,9 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
                 model = await session.execute(statement)
                 model = model.scalar_one()
             except MultipleResultsFound:
-                response = Response[dict](status=StatusMap.MULTIPLE_RESULTS_FOUND)
-                raise SiteException(status_code=MULTIPLE_RESULTS_FOUND_CODE, response=response) from None
+                raise MULTIPLE_RESULTS_FOUND_ERROR.exception() from None
             except NoResultFound:
-                response = Response[dict](status=StatusMap.ITEM_NOT_FOUND)
-                raise SiteException(status_code=ITEM_NOT_FOUND_CODE, response=response) from None
+                raise ITEM_NOT_FOUND_ERROR.exception() from None
         return model
 
     async def _orm_get_all_statement(
@@ -656,6 +790,15 @@ class SQLAlchemyCRUDRouter(CRUDGenerator[SCHEMA]):
         statement = update(self.db_model).where(getattr(self.db_model, self._primary_key) == item_id).values(**data)
         return statement
 
+    def created_range_filter(self, created_after: datetime | None, created_before: datetime | None) -> list:
+        """
+        创建时间范围的查询条件
+        :param created_after: 创建时间不早于该时间
+        :param created_before: 创建时间早于该时间
+        :return:
+        """
+        return get_created_range_filter(self.db_model, created_after, created_before, self.created_range_by_id and self._primary_key == 'id')
+
     def _get_columns(self) -> tuple[list, list]:
         common_columns = []
         foreign_key_columns = []
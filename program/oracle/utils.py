@@ -1,5 +1,4 @@
 from watchtower import PayloadData
-from watchtower.depends.cache.cache import cache as cache_client
 
 
 async def is_superuser(payload: PayloadData | None) -> bool:
@@ -10,12 +9,12 @@ async def is_superuser(payload: PayloadData | None) -> bool:
     if payload is None or not payload.data:
         return False
 
-    is_superuser_value = await cache_client.get_permission(payload.data.id, 'superuser')
-    is_superuser_value = is_superuser_value[0] if isinstance(is_superuser_value, list) else False
-    if isinstance(is_superuser_value, bool):
-        return is_superuser_value
-    else:
-        return False
+    # 验证权限时已经获取过
+    if payload._superuser is not None:
+        return payload._superuser
+
+    # 通过本地黑名单或者权限位图验证时没有查询缓存，使用 token 中签名的超级管理员标识，与验证权限时的判断一致
+    return payload.data.superuser
 
 
 def extend_tags_metadata(source: list = None, *args):
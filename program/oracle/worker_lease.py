@@ -0,0 +1,151 @@
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+
+from oracle.snowflake import Snow, snow
+from watchtower.depends.cache.cache import CacheSystem, cache, get_worker_lease_key
+from watchtower.settings import settings, logger
+
+# 释放后租约中的时间戳保留的时间，单位为秒
+LEASE_RELEASE_EXPIRE = 24 * 60 * 60
+
+
+class WorkerLeaseError(Exception):
+    """
+    没有空闲的机器id和机房id
+    """
+    pass
+
+
+class WorkerLease:
+    """
+    雪花算法的机器id和机房id租约，多个 worker 进程或者容器启动时各自从缓存中租用一组空闲的id
+    租约在缓存中的值为当前进程的标识，定时续期，进程退出时释放；进程异常退出后租约在过期时间之后才能被其他进程使用
+    续期和释放时在租约中记录已经使用的时间戳，其他进程租用后等待本机时钟超过该时间戳再生成id，机器之间的时钟偏差不会产生重复的id
+    续期失败（租约已经过期或者被其他进程租用）时重新租用一组id，租约丢失或者超过过期时间没有续期成功时，id生成器拒绝生成id，直到重新租用成功
+    """
+
+    def __init__(self, cache_client: CacheSystem, generator: Snow, ttl: int = 30):
+        """
+        :param cache_client: 缓存客户端
+        :param generator: 雪花算法id生成器
+        :param ttl: 租约的过期时间，单位为秒
+        """
+        self.cache_client = cache_client
+        self.generator = generator
+        self.ttl = ttl
+        self.ttl_ns = ttl * 1_000_000_000
+        self.heartbeat_seconds = max(ttl / 3, 1)
+        # 缓存中记录租用者，方便排查
+        self.token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+        self.slot: tuple[int, int] | None = None
+        self._task: asyncio.Task | None = None
+
+    def get_slots(self) -> list[tuple[int, int]]:
+        """
+        所有的 (机房id, 机器id)，从随机位置开始依次尝试，减少多个进程同时启动时的冲突
+        :return:
+        """
+        slots = [
+            (datacenter_id, server_id)
+            for datacenter_id in range(self.generator.max_datacenter_id + 1)
+            for server_id in range(self.generator.max_server_id + 1)
+        ]
+        offset = random.randrange(len(slots))
+        return slots[offset:] + slots[:offset]
+
+    async def acquire(self) -> tuple[int, int]:
+        """
+        租用一组空闲的id，并设置到id生成器中
+        :return: (机房id, 机器id)
+        """
+        for datacenter_id, server_id in self.get_slots():
+            key = get_worker_lease_key(datacenter_id, server_id)
+            # 租约的过期时间从发送命令之前开始计算，不会晚于缓存中的过期时间
+            start = time.monotonic_ns()
+            last_timestamp = await self.cache_client.acquire_lease(key, self.token, self.ttl)
+            if last_timestamp is None:
+                continue
+            # 上一个租用者的时钟可能比本机快，本机时钟超过上一个租用者使用的时间戳之后才能使用这组id，等待期间续期租约
+            while (wait := last_timestamp - self.generator.get_timestamp()) >= 0:
+                logger.warning(f'snowflake worker lease {(datacenter_id, server_id)} was used until {last_timestamp}, wait {wait + 1}ms')
+                await asyncio.sleep(min((wait + 1) / 1000, self.heartbeat_seconds))
+                start = time.monotonic_ns()
+                if not await self.cache_client.update_lease(key, self.token, last_timestamp, self.ttl):
+                    break
+            else:
+                self.generator.set_worker(server_id, datacenter_id, start + self.ttl_ns)
+                self.slot = (datacenter_id, server_id)
+                logger.info(f'snowflake worker lease acquired: datacenter_id={datacenter_id}, server_id={server_id}')
+                return self.slot
+        raise WorkerLeaseError('没有空闲的雪花算法机器id，运行的进程数量超过了id的数量')
+
+    async def renew(self) -> bool:
+        """
+        续期租约，成功后延长id生成器中租约的过期时间
+        :return: 租约是否仍然属于当前进程
+        """
+        if self.slot is None:
+            return False
+        start = time.monotonic_ns()
+        key = get_worker_lease_key(*self.slot)
+        if not await self.cache_client.update_lease(key, self.token, self.generator.last_timestamp, self.ttl):
+            return False
+        self.generator.set_lease_deadline(start + self.ttl_ns)
+        return True
+
+    async def release(self):
+        if self.slot is None:
+            return
+        # 释放之后其他进程可以立即租用这组id，先停止生成，记录的时间戳之后不会再使用
+        self.generator.set_lease_deadline(0)
+        try:
+            await self.cache_client.update_lease(
+                get_worker_lease_key(*self.slot), self.token, self.generator.last_timestamp, LEASE_RELEASE_EXPIRE, release=True
+            )
+        except Exception as e:
+            logger.error(f'release snowflake worker lease error: {e}')
+        self.slot = None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self.acquire()
+        self._task = asyncio.create_task(self._heartbeat_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.release()
+
+    async def _heartbeat_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                if not await self.renew():
+                    logger.warning(f'snowflake worker lease {self.slot} lost, acquire again')
+                    # 租约已经不属于当前进程，重新租用成功之前不能再生成id；续期出错时租约在过期时间之后自动失效
+                    self.generator.set_lease_deadline(0)
+                    await self.acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'renew snowflake worker lease error: {e}')
+
+
+def create_worker_lease() -> WorkerLease | None:
+    # 没有启用 redis 时只能单进程部署，使用配置的id
+    if not settings.SNOWFLAKE_LEASE_ENABLE or not settings.CACHE_REDIS_ENABLE:
+        return None
+    return WorkerLease(cache, snow, ttl=settings.SNOWFLAKE_LEASE_TTL)
+
+
+worker_lease = create_worker_lease()
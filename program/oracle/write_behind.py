@@ -0,0 +1,152 @@
+import asyncio
+from typing import Any
+
+from sqlalchemy import Table, bindparam, update
+
+from oracle.sqlalchemy import sql_helper
+from watchtower.settings import settings, logger
+
+
+class WriteBehind:
+    """
+    延迟写入缓冲区，用于登录信息、计数器等频繁更新但不要求立即落库的字段
+    更新先合并到内存中，按照时间间隔或者缓冲行数批量写入数据库，同一行多次更新只写入一次
+    进程异常退出时未刷新的数据会丢失，不能用于需要强一致的字段
+    """
+
+    def __init__(self, flush_milliseconds: int = 1000, max_rows: int = 500):
+        self.flush_seconds = flush_milliseconds / 1000
+        self.max_rows = max_rows
+        # 表 -> {主键: 覆盖写入的字段}
+        self.values: dict[Table, dict[Any, dict[str, Any]]] = {}
+        # 表 -> {主键: 累加写入的字段}
+        self.increments: dict[Table, dict[Any, dict[str, int]]] = {}
+        self.rows = 0
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def set(self, model, identify: Any, **values):
+        """
+        覆盖写入字段，同一行的同一字段保留最后一次的值
+        :param model: 数据模型
+        :param identify: 主键
+        :param values: 字段值
+        :return:
+        """
+        self._merge(self.values, model, identify, values, lambda old, new: new)
+
+    def incr(self, model, identify: Any, **amounts: int):
+        """
+        累加写入字段，刷新时执行 column = column + amount
+        :param model: 数据模型
+        :param identify: 主键
+        :param amounts: 字段增量
+        :return:
+        """
+        self._merge(self.increments, model, identify, amounts, lambda old, new: old + new)
+
+    def _merge(self, pending: dict, model, identify: Any, values: dict, merge):
+        rows = pending.setdefault(model.__table__, {})
+        row = rows.get(identify)
+        if row is None:
+            rows[identify] = row = {}
+            self.rows += 1
+        for key, value in values.items():
+            row[key] = merge(row[key], value) if key in row else value
+
+        if self.rows >= self.max_rows:
+            self._wakeup.set()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._flush_forever())
+
+    async def stop(self):
+        """
+        停止后台刷新，并写入所有未刷新的数据
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        将缓冲区中的数据批量写入数据库，相同字段的行使用一条 UPDATE 语句批量执行
+        写入失败时数据放回缓冲区，等待下一次刷新
+        :return:
+        """
+        async with self._lock:
+            values, increments = self.values, self.increments
+            if not values and not increments:
+                return
+            self.values, self.increments, self.rows = {}, {}, 0
+            self._wakeup.clear()
+
+            try:
+                async with sql_helper.get_session().begin() as session:
+                    for table, rows in values.items():
+                        for statement, params in self._statements(table, rows, increment=False):
+                            await session.execute(statement, params)
+                    for table, rows in increments.items():
+                        for statement, params in self._statements(table, rows, increment=True):
+                            await session.execute(statement, params)
+            except Exception as error:
+                logger.error(f"延迟写入数据失败，等待下次写入，错误原因为：{error}")
+                self._restore(values, increments)
+                # 数据库异常时等待下一个刷新周期，避免立即重试
+                self._wakeup.clear()
+
+    @staticmethod
+    def _statements(table: Table, rows: dict[Any, dict], increment: bool):
+        primary_key = list(table.primary_key.columns)[0]
+        # 按照更新的字段分组，每组生成一条 executemany 语句
+        groups: dict[tuple[str, ...], list[dict]] = {}
+        for identify, row in rows.items():
+            keys = tuple(sorted(row.keys()))
+            params = {f"b_{key}": row[key] for key in keys}
+            params["b_identify"] = identify
+            groups.setdefault(keys, []).append(params)
+
+        for keys, params in groups.items():
+            if increment:
+                values = {key: table.c[key] + bindparam(f"b_{key}") for key in keys}
+            else:
+                values = {key: bindparam(f"b_{key}") for key in keys}
+            yield update(table).where(primary_key == bindparam("b_identify")).values(values), params
+
+    def _restore(self, values: dict, increments: dict):
+        for table, rows in values.items():
+            current = self.values.setdefault(table, {})
+            for identify, row in rows.items():
+                # 刷新期间的新数据优先
+                current[identify] = {**row, **current.get(identify, {})}
+        for table, rows in increments.items():
+            current = self.increments.setdefault(table, {})
+            for identify, row in rows.items():
+                merged = current.setdefault(identify, {})
+                for key, amount in row.items():
+                    merged[key] = merged.get(key, 0) + amount
+        self.rows = sum(len(rows) for rows in self.values.values()) + sum(len(rows) for rows in self.increments.values())
+
+    async def _flush_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+write_behind = WriteBehind(flush_milliseconds=settings.WRITE_BEHIND_FLUSH_MILLISECONDS, max_rows=settings.WRITE_BEHIND_MAX_ROWS)
@@ -0,0 +1,5 @@
+import os
+
+# 模型和路由只在启用对应模块时定义，需要在导入项目模块之前设置
+os.environ.setdefault('AUTH_MODULE_ENABLE', 'true')
+os.environ.setdefault('ADMIN_MODULE_ENABLE', 'true')
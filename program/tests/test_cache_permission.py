@@ -0,0 +1,115 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from watchtower.depends.cache.cache import CacheSystem, get_permission_key
+from watchtower.depends.cache.local_cache import LocalCache
+
+fake_aioredis = pytest.importorskip('fakeredis.aioredis')
+
+USER_ID = 5
+PERMISSION = {'id': 10, 'url': '/api/admin/user', 'code': 'user_list'}
+
+
+def create_cache(local: bool) -> CacheSystem:
+    # 启用一级缓存时不使用脚本，分别测试两种读取方式
+    return CacheSystem(fake_aioredis.FakeRedis(decode_responses=True), local=LocalCache({'permission_': 5}) if local else None)
+
+
+@pytest.mark.parametrize('local', [False, True])
+def test_legacy_user_permission_is_used(local):
+    """
+    升级前写入的用户权限没有角色列表，在过期之前继续使用其中的请求方法权限
+    """
+    cache_client = create_cache(local)
+
+    async def main():
+        await cache_client.backend.hset(get_permission_key(str(USER_ID)), mapping={
+            'superuser': json.dumps([False]),
+            'GET': json.dumps([PERMISSION]),
+        })
+
+        authorization = await cache_client.get_authorization(USER_ID, 'GET')
+        assert authorization.permissions == [PERMISSION]
+        # 没有权限的请求方法没有存储
+        authorization = await cache_client.get_authorization(USER_ID, 'POST')
+        assert authorization.permissions == []
+        assert await cache_client.get_permission(USER_ID, ['superuser', 'GET', 'POST']) == [[False], [PERMISSION], []]
+
+        # 修改角色后使用角色权限
+        async def load_role_permissions(role_ids: list[int]) -> dict[int, dict[str, list[dict]]]:
+            return {role_id: {'GET': []} for role_id in role_ids}
+
+        cache_client.register_role_permission_loader(load_role_permissions)
+        await cache_client.update_permission_roles(USER_ID, [1])
+        authorization = await cache_client.get_authorization(USER_ID, 'GET')
+        assert authorization.permissions == []
+
+    asyncio.run(main())
+
+
+def test_missing_user_permission():
+    cache_client = create_cache(False)
+
+    async def main():
+        authorization = await cache_client.get_authorization(USER_ID, 'GET')
+        assert authorization.permissions is None
+        assert await cache_client.get_permission(USER_ID, 'GET') is None
+
+    asyncio.run(main())
+
+
+def test_concurrent_permission_catalog_versions():
+    """
+    同时更新权限目录时，缓存中的权限目录的版本号和权限顺序来自同一次更新
+    """
+    cache_client = create_cache(False)
+    backend_set = cache_client.backend.set
+    delays = random.Random(0)
+
+    async def delayed_set(*args, **kwargs):
+        # 写入前随机等待，让各次更新的写入顺序与增加版本号的顺序不同
+        await asyncio.sleep(delays.random() / 100)
+        return await backend_set(*args, **kwargs)
+
+    cache_client.backend.set = delayed_set
+
+    async def main():
+        id_lists = [list(range(index, index + 3)) for index in range(20)]
+        catalogs = await asyncio.gather(*(cache_client.set_permission_catalog(ids) for ids in id_lists))
+        ids_by_version = {catalog['version']: catalog['ids'] for catalog in catalogs}
+        assert len(ids_by_version) == len(id_lists)
+
+        stored = await cache_client.get_permission_catalog()
+        assert stored['version'] == max(ids_by_version)
+        assert stored['ids'] == ids_by_version[stored['version']]
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('local', [False, True])
+def test_large_role_id_permission(local):
+    """
+    角色id超过 2**53 时，验证权限的脚本中仍然能拼接出正确的角色权限key；升级前存储为数字的角色id仍然可以使用
+    """
+    cache_client = create_cache(local)
+    large_role = 2 ** 62 + 1
+
+    async def load_role_permissions(role_ids: list[int]) -> dict[int, dict[str, list[dict]]]:
+        return {role_id: {'GET': [PERMISSION] if role_id == large_role else []} for role_id in role_ids}
+
+    cache_client.register_role_permission_loader(load_role_permissions)
+
+    async def main():
+        await cache_client.set_permission(USER_ID, {'superuser': [False], 'roles': [str(large_role)]})
+        await cache_client.get_role_permissions([large_role], ['GET'])
+        assert (await cache_client.get_authorization(USER_ID, 'GET')).permissions == [PERMISSION]
+        assert await cache_client.get_permission(USER_ID, 'roles') == [large_role]
+
+        await cache_client.set_permission(USER_ID, {'superuser': [False], 'roles': [1, 2]})
+        assert (await cache_client.get_authorization(USER_ID, 'GET')).permissions == []
+        assert await cache_client.get_permission(USER_ID, 'roles') == [1, 2]
+
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from watchtower.depends.cache.backend.memory_backend import MemoryBackend
+from watchtower.depends.cache.cache import CacheSystem
+from watchtower.depends.cache.memoize import cached, get_cached_tag_key, invalidate_tags
+
+fake_aioredis = pytest.importorskip('fakeredis.aioredis')
+
+
+def create_backend(name: str):
+    if name == 'redis':
+        return fake_aioredis.FakeRedis(decode_responses=True)
+    return MemoryBackend()
+
+
+@pytest.mark.parametrize('backend', ['redis', 'memory'])
+def test_short_ttl_fill_keeps_tag_alive(backend):
+    """
+    过期时间较短的缓存不会缩短标签的过期时间，删除标签时仍然能删除过期时间较长的缓存
+    """
+    cache_client = CacheSystem(create_backend(backend))
+    calls = {'long': 0, 'short': 0}
+
+    @cached(ttl=300, key='long:{role_id}', tags=['role:{role_id}'], cache_client=cache_client)
+    async def get_long(role_id: int):
+        calls['long'] += 1
+        return calls['long']
+
+    @cached(ttl=1, key='short:{role_id}', tags=['role:{role_id}'], cache_client=cache_client)
+    async def get_short(role_id: int):
+        calls['short'] += 1
+        return calls['short']
+
+    async def main():
+        assert await get_long(1) == 1
+        assert await get_short(1) == 1
+        # 短的过期时间之后标签仍然存在
+        await asyncio.sleep(1.2)
+        assert await cache_client.set_members(get_cached_tag_key('role:1'))
+        assert await get_long(1) == 1
+
+        await invalidate_tags('role:1', cache_client=cache_client)
+        assert await get_long(1) == 2
+
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from apps.admin.views.role_handler import role as role_module
+from watchtower.depends.authorization.permission_catalog import PermissionCatalog
+from watchtower.depends.cache.cache import CacheSystem
+from watchtower.depends.cache.subscriber import CacheSubscriber
+
+fake_aioredis = pytest.importorskip('fakeredis.aioredis')
+
+ROLE_ID = 1
+PERMISSION = {'id': 10, 'method': 'GET', 'url': '/api/admin/user'}
+
+
+def test_deleted_role_permission_bitmap_is_refused(monkeypatch):
+    """
+    角色删除之前签发的 token 携带的权限位图，在角色删除之后不能再通过验证
+    """
+    cache_client = CacheSystem(fake_aioredis.FakeRedis(decode_responses=True))
+    catalog = PermissionCatalog(cache_client, CacheSubscriber(cache_client))
+    # 有效角色 -> 权限列表，删除角色后角色不再有效
+    active_roles = {ROLE_ID: [PERMISSION]}
+
+    async def load_permissions() -> list[dict]:
+        return [PERMISSION]
+
+    async def load_role_permissions(role_ids: list[int]) -> dict[int, dict[str, list[dict]]]:
+        return {role_id: {'GET': active_roles[role_id]} for role_id in role_ids if role_id in active_roles}
+
+    catalog.register_loader(load_permissions)
+    cache_client.register_role_permission_loader(load_role_permissions)
+    monkeypatch.setattr(role_module, 'cache_client', cache_client)
+    monkeypatch.setattr(role_module, 'permission_catalog', catalog)
+    monkeypatch.setattr(role_module, 'response_cache', None)
+
+    async def main():
+        await catalog.refresh()
+        claim = catalog.encode([PERMISSION['id']])
+        assert catalog.match(claim, 'GET', PERMISSION['url']) is True
+
+        # 角色已经在数据库中删除，调用删除后的处理
+        active_roles.pop(ROLE_ID)
+        await role_module.router._post_delete({'id': ROLE_ID})
+
+        # 旧版本的位图不再使用，回退到查询角色权限，已经删除的角色没有任何权限
+        assert catalog.match(claim, 'GET', PERMISSION['url']) is None
+        role_permissions = await cache_client.get_role_permissions([ROLE_ID], ['GET'])
+        assert role_permissions == {ROLE_ID: [None]}
+
+    asyncio.run(main())
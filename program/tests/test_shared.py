@@ -0,0 +1,26 @@
+import asyncio
+
+from watchtower.depends.cache.codec import JsonCodec
+from watchtower.depends.cache.shared import SharedStore
+
+
+def test_decoded_value_is_reused_until_replaced(tmp_path):
+    """
+    同一个版本的共享数据只解码一次，写入新版本后读取新的数据
+    """
+    store = SharedStore('test', str(tmp_path), JsonCodec())
+
+    async def main():
+        assert await store.put({'menu': [{'id': 1}]}) is True
+        assert await store.put({'menu': [{'id': 1}]}) is False
+        value = store.get('menu')
+        assert value == [{'id': 1}]
+        assert store.get('menu') is value
+
+        # 其他进程写入的新版本
+        other = SharedStore('test', str(tmp_path), JsonCodec())
+        await other.put({'menu': [{'id': 2}]})
+        assert store.get('menu') == [{'id': 2}]
+        assert store.get('missing') is None
+
+    asyncio.run(main())
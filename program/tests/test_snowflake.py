@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from oracle.snowflake import SNOW_PROFILES, InvalidSystemClock, Snow, create_snow
+from watchtower.settings import settings
+
+
+def test_clock_backward_within_tolerance(monkeypatch):
+    """
+    系统时间回拨不超过容忍值时继续使用上次的时间戳生成不重复的id，超过时拒绝生成
+    """
+    now = [time.time()]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    generator = Snow.from_layout(SNOW_PROFILES['js_safe'], max_backward_ms=10, reserved_sequences=2)
+    ids = generator.get_ids(3)
+    last_timestamp = generator.last_timestamp
+
+    # 回拨 5 毫秒，使用保留的序号继续生成
+    now[0] -= 0.005
+    ids.extend(generator.get_ids(2))
+    assert len(set(ids)) == len(ids)
+    assert generator.decode(ids[-1]).timestamp == last_timestamp
+    assert generator.stats()['rollback'] == 1
+
+    # 回拨超过 10 毫秒
+    now[0] -= 0.01
+    with pytest.raises(InvalidSystemClock):
+        generator.get_ids(1)
+    assert generator.stats()['rejected'] == 1
+
+
+@pytest.mark.parametrize('profile', ['high_throughput', 'many_nodes'])
+def test_profile_beyond_js_safe_is_rejected(monkeypatch, profile):
+    """
+    接口中的id按照数字返回，不能使用超过 53 位的划分
+    """
+    monkeypatch.setattr(settings, 'SNOWFLAKE_PROFILE', profile)
+    with pytest.raises(ValueError):
+        create_snow()
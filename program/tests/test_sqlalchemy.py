@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from apps.admin.models import OperationRecord
+from oracle.snowflake import snow
+from oracle.sqlalchemy import delete_created_before, iter_id_batches, sql_helper
+
+pytest.importorskip('aiosqlite')
+
+NOW = datetime.now().replace(microsecond=0)
+
+
+def create_record(record_id: int, create_time: datetime) -> OperationRecord:
+    return OperationRecord(
+        id=record_id, user_id=1, username='admin', name='admin', login_ip='127.0.0.1', uri='/api/admin/user', data='',
+        create_time=create_time
+    )
+
+
+@pytest.fixture
+def records(monkeypatch):
+    """
+    5 天前到今天每天创建的 5 条操作记录，以及初始化时指定 id 为 1 的 1 条记录
+    """
+    engine = create_async_engine('sqlite+aiosqlite://')
+    monkeypatch.setattr(sql_helper, 'session', async_sessionmaker(engine, expire_on_commit=False))
+
+    async def init():
+        async with engine.begin() as conn:
+            await conn.run_sync(OperationRecord.metadata.create_all, tables=[OperationRecord.__table__])
+        async with sql_helper.get_session().begin() as session:
+            session.add(create_record(1, NOW))
+            for days in range(5, 0, -1):
+                create_time = NOW - timedelta(days=days)
+                session.add(create_record(snow.get_min_id(create_time) + 1, create_time))
+
+    asyncio.run(init())
+    return engine
+
+
+def test_iter_id_batches(records):
+    """
+    分批读取创建时间范围内的数据，按照主键顺序，不重复不遗漏
+    """
+
+    async def main():
+        batches = []
+        async for rows in iter_id_batches(OperationRecord, created_after=NOW - timedelta(days=4), created_before=NOW, batch_size=2):
+            batches.append([row.create_time for row in rows])
+        assert batches == [
+            [NOW - timedelta(days=4), NOW - timedelta(days=3)],
+            [NOW - timedelta(days=2), NOW - timedelta(days=1)],
+        ]
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('by_id, remaining', [(True, 2), (False, 3)])
+def test_delete_created_before(records, by_id, remaining):
+    """
+    分批删除指定时间之前创建的数据；按照 create_time 删除时，初始化时指定了id的数据不会被当作最早创建的数据删除
+    """
+
+    async def main():
+        deleted = await delete_created_before(OperationRecord, NOW - timedelta(days=2), batch_size=2, by_id=by_id)
+        async with sql_helper.get_session().begin() as session:
+            ids = (await session.execute(select(OperationRecord.id))).scalars().all()
+        assert len(ids) == remaining
+        assert deleted == 6 - remaining
+        assert (1 in ids) is not by_id
+
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from oracle.snowflake import SNOW_PROFILES, Snow, WorkerLeaseExpired
+from oracle.worker_lease import WorkerLease
+from watchtower.depends.cache.cache import CacheSystem, get_worker_lease_key
+
+fake_aioredis = pytest.importorskip('fakeredis.aioredis')
+
+
+def create_lease(ttl: int = 30) -> tuple[CacheSystem, WorkerLease]:
+    cache_client = CacheSystem(fake_aioredis.FakeRedis(decode_responses=True))
+    lease = WorkerLease(cache_client, Snow.from_layout(SNOW_PROFILES['js_safe']), ttl=ttl)
+    lease.heartbeat_seconds = 0.01
+    return cache_client, lease
+
+
+def test_lost_lease_stops_id_generation():
+    """
+    租约被其他进程租用后停止生成id，直到重新租用到空闲的id
+    """
+    cache_client, lease = create_lease()
+    generator = lease.generator
+
+    async def main():
+        await lease.start()
+        assert generator.get_ids(3)
+
+        # 其他进程租用了当前进程的id以及其他所有的id
+        slots = lease.get_slots()
+        for datacenter_id, server_id in slots:
+            await cache_client.set(get_worker_lease_key(datacenter_id, server_id), 'other', 30)
+        await asyncio.sleep(0.1)
+        with pytest.raises(WorkerLeaseExpired):
+            generator.get_ids(1)
+
+        # 释放一组id后重新租用成功，使用新的id继续生成
+        datacenter_id, server_id = slots[0]
+        await cache_client.delete(get_worker_lease_key(datacenter_id, server_id))
+        await asyncio.sleep(0.1)
+        assert lease.slot == (datacenter_id, server_id)
+        snow_id = generator.decode(generator.get_ids(1)[0])
+        assert (snow_id.datacenter_id, snow_id.server_id) == (datacenter_id, server_id)
+
+        await lease.stop()
+        with pytest.raises(WorkerLeaseExpired):
+            generator.get_ids(1)
+
+    asyncio.run(main())
+
+
+def test_unrenewed_lease_expires(monkeypatch):
+    """
+    缓存不可用时无法续期，超过租约的过期时间后停止生成id
+    """
+    cache_client, lease = create_lease(ttl=1)
+
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError
+
+    async def main():
+        await lease.start()
+        monkeypatch.setattr(cache_client, 'update_lease', unavailable)
+        # 过期之前仍然可以生成
+        assert lease.generator.get_ids(1)
+        await asyncio.sleep(1.1)
+        with pytest.raises(WorkerLeaseExpired):
+            lease.generator.get_ids(1)
+        await lease.stop()
+
+    asyncio.run(main())
+
+
+def test_released_lease_hands_over_timestamp():
+    """
+    释放租约时记录已经使用的时间戳，时钟较慢的进程租用后等待本机时钟超过该时间戳再生成id
+    """
+    cache_client, lease = create_lease()
+    generator = lease.generator
+
+    async def main():
+        # 除了一组id之外都被其他进程租用，空闲的一组id被时钟快 300 毫秒的进程使用后释放
+        slots = lease.get_slots()
+        for datacenter_id, server_id in slots[1:]:
+            await cache_client.set(get_worker_lease_key(datacenter_id, server_id), 'other', 30)
+        used_timestamp = generator.get_timestamp() + 300
+        await cache_client.set(get_worker_lease_key(*slots[0]), f'{used_timestamp}|', 30)
+
+        await lease.start()
+        assert generator.decode(generator.get_ids(1)[0]).timestamp > used_timestamp
+
+        await lease.stop()
+        value = await cache_client.get(get_worker_lease_key(*slots[0]))
+        assert value == f'{generator.last_timestamp}|'
+
+        # 释放后的租约可以被其他进程租用
+        assert await cache_client.acquire_lease(get_worker_lease_key(*slots[0]), 'other', 30) == generator.last_timestamp
+
+    asyncio.run(main())
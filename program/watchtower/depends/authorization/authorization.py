@@ -1,3 +1,4 @@
+import asyncio
 import json
 import re
 from calendar import timegm
@@ -10,8 +11,11 @@ from jose import jwt
 from passlib.context import CryptContext
 from pydantic import ValidationError
 
+from watchtower.depends.authorization.fallback import authorization_fallback
+from watchtower.depends.authorization.permission_catalog import permission_catalog
+from watchtower.depends.authorization.revocation import revocation_set
 from watchtower.depends.authorization.types import PayloadData, TokenType
-from watchtower.depends.cache.cache import CacheSystem, cache
+from watchtower.depends.cache.cache import CacheSystem, Authorization, cache
 from watchtower.settings import settings, logger
 from watchtower.status.global_status import StatusMap
 from watchtower.status.types.exception import SiteException
@@ -36,12 +40,31 @@ def get_authorization_exception(status_item: Status, headers: dict | None = None
 password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+async def get_authorization(cache_client: CacheSystem, identify: int, method: str, with_blacklist: bool = True) -> Authorization:
+    """
+    获取验证权限需要的数据，缓存不可用时从数据库加载，降级期间不检查缓存中的黑名单
+    :param cache_client: 缓存客户端
+    :param identify: 用户id
+    :param method: 请求方法
+    :param with_blacklist: 是否获取黑名单
+    :return:
+    """
+    try:
+        return await cache_client.get_authorization(identify, method, with_blacklist=with_blacklist)
+    except SiteException:
+        if not authorization_fallback.ready:
+            raise
+    logger.warning(f'cache unavailable, load authorization of user {identify} from database')
+    return await authorization_fallback.get_authorization(identify, method)
+
+
+# bcrypt 计算耗时较长，放到线程中执行，避免阻塞事件循环
 async def get_password_hash(password):
-    return password_context.hash(password)
+    return await asyncio.to_thread(password_context.hash, password)
 
 
 async def verify_password(plain_password, hashed_password):
-    return password_context.verify(plain_password, hashed_password)
+    return await asyncio.to_thread(password_context.verify, plain_password, hashed_password)
 
 
 async def create_access_token(payload: PayloadData, expires_delta: timedelta = None, subject: TokenType = TokenType.TOKEN) -> str:
@@ -94,6 +117,7 @@ async def signature_authentication(
     :return: payload 信息
     """
     credentials_exception_headers = None
+    authorization = None
     if security_scopes.scopes:
         authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
         credentials_exception_headers = {'WWW-Authenticate': authenticate_value}
@@ -102,11 +126,18 @@ async def signature_authentication(
         payload = PayloadData.parse_obj(payload)
         if payload.data and payload.data.id:
             # 如果有黑名单记录查看是否符合条件，符合条件则不允许登录
-            blacklist = await cache_client.get_blacklist(payload.data.id)
-            if blacklist:
-                blacklist = PayloadData.parse_obj(json.loads(blacklist))
-                if blacklist.nbf > payload.iat:
+            # 本地黑名单加载完成后直接使用本地数据，否则查询缓存，同时获取权限数据
+            if revocation_set.ready:
+                if revocation_set.is_revoked(payload.data.id, int(payload.iat)):
                     raise jwt.ExpiredSignatureError("token已经在黑名单中了")
+            else:
+                authorization = await get_authorization(cache_client, payload.data.id, request.method.upper())
+                payload._superuser = authorization.superuser
+                blacklist = authorization.blacklist
+                if blacklist:
+                    blacklist = PayloadData.parse_obj(json.loads(blacklist))
+                    if blacklist.nbf > payload.iat:
+                        raise jwt.ExpiredSignatureError("token已经在黑名单中了")
         else:
             logger.info(f"jwt数据有问题 => {payload}/{token}")
             raise get_authorization_exception(status_item=StatusMap.INVALIDATE_CREDENTIALS, headers=credentials_exception_headers)
@@ -143,10 +174,21 @@ async def signature_authentication(
         if re.match(url_reg, path):
             return payload
 
-    # 获取权限缓存
-    permissions = await cache_client.get_permission(payload.data.id, method)
-
-    for permission in permissions:
+    # token中携带的权限位图版本有效时，直接使用位图验证，不再查询缓存
+    if payload.perm:
+        allowed = permission_catalog.match(payload.perm, method, path)
+        if allowed is not None:
+            if allowed:
+                return payload
+            response = GenericBaseResponse[dict](status=StatusMap.FORBIDDEN)
+            raise SiteException(status_code=status.HTTP_403_FORBIDDEN, response=response)
+
+    # 获取权限缓存，黑名单、是否是超级管理员和请求方法的权限一次获取
+    if authorization is None:
+        authorization = await get_authorization(cache_client, payload.data.id, method, with_blacklist=False)
+        payload._superuser = authorization.superuser
+
+    for permission in authorization.permissions or []:
         url_reg = f"^{permission.get('url')}$"
 
         if re.match(url_reg, path):
@@ -0,0 +1,119 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Awaitable
+
+from watchtower.depends.cache.cache import CacheSystem, Authorization, cache
+from watchtower.settings import settings, logger
+
+# 从数据库加载用户的方法，返回 (是否是超级管理员, 角色id列表)，用户不存在时返回 None
+USER_LOADER = Callable[[int], Awaitable[tuple[bool, list[int]] | None]]
+
+
+class AuthorizationFallback:
+    """
+    缓存不可用时的权限验证，从数据库加载用户角色和角色权限，并在进程内缓存较短的时间
+    降级期间无法读取缓存中的黑名单，只能使用已经加载的本地黑名单
+    角色权限的加载方法与缓存使用的相同，由 cache_client.register_role_permission_loader 注册
+    """
+
+    def __init__(self, cache_client: CacheSystem, ttl: int = 10, max_size: int = 10000):
+        """
+        :param cache_client: 缓存客户端
+        :param ttl: 加载结果在进程内的缓存时间，单位为秒
+        :param max_size: 最多缓存的用户和角色数量
+        """
+        self.cache_client = cache_client
+        self.ttl = ttl
+        self.max_size = max_size
+        self.user_loader: USER_LOADER | None = None
+        # user_id -> (过期时间, 是否是超级管理员, 角色id列表)
+        self.users: OrderedDict[int, tuple[float, bool, list[int]]] = OrderedDict()
+        # role_id -> (过期时间, {method: list[{ 'id': int, 'url': str, 'code': str}]})
+        self.roles: OrderedDict[int, tuple[float, dict[str, list[dict]]]] = OrderedDict()
+        self.fallback_count = 0
+        self.load_count = 0
+        self.error_count = 0
+
+    def register_user_loader(self, loader: USER_LOADER):
+        self.user_loader = loader
+
+    @property
+    def ready(self) -> bool:
+        return self.user_loader is not None and self.cache_client.role_permission_loader is not None
+
+    def _get(self, entries: OrderedDict, key: int):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            entries.pop(key, None)
+            return None
+        entries.move_to_end(key)
+        return entry
+
+    def _put(self, entries: OrderedDict, key: int, *values):
+        entries[key] = (time.monotonic() + self.ttl, *values)
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    async def get_authorization(self, identify: int, method: str) -> Authorization:
+        """
+        从数据库获取验证权限需要的数据，格式与 CacheSystem.get_authorization 相同
+        :param identify: 用户id
+        :param method: 请求方法
+        :return:
+        """
+        self.fallback_count += 1
+        try:
+            user = self._get(self.users, identify)
+            if user is None:
+                self.load_count += 1
+                loaded = await self.user_loader(identify)
+                if loaded is None:
+                    return Authorization()
+                self._put(self.users, identify, *loaded)
+                superuser, roles = loaded
+            else:
+                _, superuser, roles = user
+
+            role_permissions, missing = {}, []
+            for role in roles:
+                entry = self._get(self.roles, role)
+                if entry is None:
+                    missing.append(role)
+                else:
+                    role_permissions[role] = entry[1]
+            if missing:
+                self.load_count += 1
+                loaded = await self.cache_client.role_permission_loader(missing)
+                for role in missing:
+                    role_permissions[role] = loaded.get(role, {})
+                    self._put(self.roles, role, role_permissions[role])
+        except Exception as e:
+            self.error_count += 1
+            logger.error(f'load authorization of user {identify} from database error: {e}')
+            raise
+
+        # 多个角色可能拥有相同的权限，按照权限id去重
+        merged = {}
+        for role in roles:
+            for permission in role_permissions[role].get(method, []):
+                merged[permission['id']] = permission
+        return Authorization(superuser=superuser, permissions=list(merged.values()))
+
+    def clear(self):
+        self.users.clear()
+        self.roles.clear()
+
+    def stats(self) -> dict:
+        return {
+            'fallback': self.fallback_count,
+            'load': self.load_count,
+            'error': self.error_count,
+            'users': len(self.users),
+            'roles': len(self.roles),
+        }
+
+
+authorization_fallback = AuthorizationFallback(cache, ttl=settings.AUTHORIZATION_FALLBACK_TTL, max_size=settings.AUTHORIZATION_FALLBACK_MAX_SIZE)
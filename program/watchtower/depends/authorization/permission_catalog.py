@@ -0,0 +1,215 @@
+import asyncio
+import base64
+import re
+from functools import lru_cache
+from typing import Callable, Awaitable
+
+from watchtower.depends.cache.cache import CacheSystem, cache
+from watchtower.depends.cache.shared import SharedStore, shared_store
+from watchtower.depends.cache.subscriber import CacheSubscriber, subscriber
+from watchtower.settings import settings, logger
+
+PERMISSION_CATALOG_CHANNEL = 'permission_catalog_channel'
+# 共享数据中权限目录的key，数据为 {'version': int, 'permissions': list[dict]}
+SHARED_CATALOG_KEY = 'permission_catalog'
+
+# 加载全部有效权限的方法，返回 list[{ 'id': int, 'method': str, 'url': str}]
+CATALOG_LOADER = Callable[[], Awaitable[list[dict]]]
+
+
+@lru_cache(maxsize=4096)
+def decode_bitmap(claim: str) -> tuple[int, int]:
+    """
+    解析token中的权限位图，格式为 {version}.{base64url(bitmap)}
+    :param claim: token 中的权限位图
+    :return: 版本号、位图
+    """
+    version, bitmap = claim.split('.', 1)
+    bitmap = base64.urlsafe_b64decode(bitmap + '=' * (-len(bitmap) % 4))
+    return int(version), int.from_bytes(bitmap, 'little')
+
+
+class PermissionCatalog:
+    """
+    进程内的权限目录，记录 权限在位图中的位置 -> 路由匹配规则
+    权限目录的版本号和权限顺序存储在缓存中，保证所有进程对同一个版本的位图解析一致
+    权限或者角色权限发生变化时更新版本号，旧版本的位图不再使用，回退到查询缓存
+    """
+
+    def __init__(
+            self,
+            cache_client: CacheSystem,
+            cache_subscriber: CacheSubscriber,
+            reconcile_seconds: int = 60,
+            enable: bool = True,
+            shared: SharedStore | None = None
+    ):
+        self.cache_client = cache_client
+        # 同一台主机上的进程共享同一个版本的权限，只有第一个进程从数据库加载
+        self.shared = shared
+        self.enable = enable
+        self.cache_subscriber = cache_subscriber
+        self.reconcile_seconds = reconcile_seconds
+        self.loader: CATALOG_LOADER | None = None
+        self.version: int | None = None
+        # 权限id -> 位图中的位置
+        self.positions: dict[int, int] = {}
+        # 请求方法 -> [(位图中的位置, url匹配规则)]
+        self.matchers: dict[str, list[tuple[int, re.Pattern]]] = {}
+        self._task: asyncio.Task | None = None
+
+        self.cache_subscriber.register(PERMISSION_CATALOG_CHANNEL, self._on_message)
+
+    def register_loader(self, loader: CATALOG_LOADER):
+        self.loader = loader
+
+    @property
+    def ready(self) -> bool:
+        return self.version is not None
+
+    def encode(self, permission_ids: list[int]) -> str | None:
+        """
+        将用户的权限id编码为位图
+        :param permission_ids: 用户拥有的权限id
+        :return: 目录中没有全部权限时返回 None，此时不使用位图
+        """
+        if not self.ready:
+            return None
+
+        bitmap = 0
+        for permission_id in permission_ids:
+            position = self.positions.get(permission_id)
+            if position is None:
+                return None
+            bitmap |= 1 << position
+
+        bitmap = bitmap.to_bytes((bitmap.bit_length() + 7) // 8 or 1, 'little')
+        return f"{self.version}.{base64.urlsafe_b64encode(bitmap).decode().rstrip('=')}"
+
+    def match(self, claim: str, method: str, path: str) -> bool | None:
+        """
+        使用位图验证访问权限
+        :param claim: token 中的权限位图
+        :param method: 请求方法
+        :param path: 请求路径
+        :return: 位图版本和当前目录不一致时返回 None，需要回退到查询缓存
+        """
+        try:
+            version, bitmap = decode_bitmap(claim)
+        except ValueError:
+            return None
+        if version != self.version:
+            return None
+
+        for position, url_reg in self.matchers.get(method, []):
+            if bitmap >> position & 1 and url_reg.match(path):
+                return True
+        return False
+
+    def get_shared_permissions(self, catalog: dict | None) -> list[dict] | None:
+        """
+        从共享数据中获取与权限目录版本一致的权限
+        :param catalog: 缓存中的权限目录
+        :return: 没有共享数据或者版本不一致时返回 None
+        """
+        if self.shared is None or catalog is None:
+            return None
+        shared = self.shared.get(SHARED_CATALOG_KEY)
+        if not isinstance(shared, dict) or shared.get('version') != catalog['version']:
+            return None
+        return shared['permissions']
+
+    async def put_shared_permissions(self, catalog: dict, permissions: list[dict]):
+        if self.shared is None:
+            return
+        try:
+            await self.shared.put({SHARED_CATALOG_KEY: {'version': catalog['version'], 'permissions': permissions}})
+        except Exception as e:
+            logger.error(f'write shared permission catalog error: {e}')
+
+    async def refresh(self):
+        """
+        从缓存中加载权限目录，缓存中没有时使用数据库中的权限生成
+        :return:
+        """
+        if self.loader is None:
+            return
+
+        catalog = await self.cache_client.get_permission_catalog()
+        if catalog is not None and catalog['version'] == self.version:
+            return
+
+        permissions = self.get_shared_permissions(catalog)
+        if permissions is None:
+            permissions = await self.loader()
+            if catalog is None:
+                catalog = await self.cache_client.set_permission_catalog(sorted(permission['id'] for permission in permissions))
+            await self.put_shared_permissions(catalog, permissions)
+
+        permission_map = {permission['id']: permission for permission in permissions}
+        positions = {}
+        matchers = {}
+        for position, permission_id in enumerate(catalog['ids']):
+            positions[permission_id] = position
+            permission = permission_map.get(permission_id)
+            # 已经删除的权限保留位置，但是不再匹配任何路由
+            if permission is None:
+                continue
+            matchers.setdefault(permission['method'], []).append((position, re.compile(f"^{permission['url']}$")))
+
+        self.positions = positions
+        self.matchers = matchers
+        self.version = catalog['version']
+
+    async def bump(self):
+        """
+        权限或者角色权限发生变化后调用，生成新版本的权限目录并通知其他进程
+        :return:
+        """
+        if not self.enable or self.loader is None:
+            return
+
+        permissions = await self.loader()
+        catalog = await self.cache_client.set_permission_catalog(sorted(permission['id'] for permission in permissions))
+        await self.put_shared_permissions(catalog, permissions)
+        await self.cache_client.publish(PERMISSION_CATALOG_CHANNEL, str(catalog['version']))
+        await self.refresh()
+
+    async def start(self):
+        if not self.enable or self.loader is None:
+            return
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f'load permission catalog error: {e}')
+        self._task = asyncio.create_task(self._reconcile_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reconcile_forever(self):
+        while True:
+            await asyncio.sleep(self.reconcile_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f'reconcile permission catalog error: {e}')
+
+    async def _on_message(self, data: str):
+        if int(data) != self.version:
+            await self.refresh()
+
+
+permission_catalog = PermissionCatalog(
+    cache,
+    subscriber,
+    reconcile_seconds=settings.PERMISSION_CATALOG_RECONCILE_SECONDS,
+    enable=settings.TOKEN_PERMISSION_BITMAP_ENABLE,
+    shared=shared_store
+)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from calendar import timegm
+from datetime import datetime
+
+from watchtower.depends.authorization.types import PayloadData
+from watchtower.depends.cache.cache import CacheSystem, cache
+from watchtower.depends.cache.subscriber import CacheSubscriber, subscriber
+from watchtower.settings import settings, logger
+
+BLACKLIST_CHANNEL = 'blacklist_channel'
+
+
+def get_timestamp() -> int:
+    return timegm(datetime.utcnow().utctimetuple())
+
+
+class RevocationSet:
+    """
+    进程内的黑名单集合，记录 user_id -> (nbf, exp)
+    启动时从缓存中加载，之后通过订阅频道增量更新，并定时与缓存对账，弥补订阅断开期间丢失的消息
+    """
+
+    def __init__(self, cache_client: CacheSystem, cache_subscriber: CacheSubscriber, reconcile_seconds: int = 60):
+        self.cache_client = cache_client
+        self.cache_subscriber = cache_subscriber
+        self.reconcile_seconds = reconcile_seconds
+        self.revoked: dict[int, tuple[int, int]] = {}
+        # 首次加载成功之后才能使用本地黑名单，否则回退到查询缓存
+        self.ready = False
+        self._task: asyncio.Task | None = None
+
+        self.cache_subscriber.register(BLACKLIST_CHANNEL, self._on_message)
+
+    def is_revoked(self, identify: int, iat: int) -> bool:
+        """
+        判断token是否已经在黑名单中
+        :param identify: 用户id
+        :param iat: token签发时间
+        :return:
+        """
+        record = self.revoked.get(identify)
+        if record is None:
+            return False
+
+        nbf, exp = record
+        if exp <= get_timestamp():
+            self.revoked.pop(identify, None)
+            return False
+        return nbf > iat
+
+    def add(self, identify: int, nbf: int, exp: int):
+        record = self.revoked.get(identify)
+        # 同一个用户多次登出，保留最新的生效时间
+        if record is None or record[0] < nbf:
+            self.revoked[identify] = (nbf, exp)
+
+    async def revoke(self, payload: PayloadData, expire: int, cache_client: CacheSystem | None = None):
+        """
+        登出时将用户加入黑名单，并通知其他进程
+        :param payload: token 负载数据
+        :param expire: 黑名单的有效时长，单位为秒
+        :param cache_client: 缓存客户端，传入批量执行对象时和调用方的其他命令一起执行
+        :return:
+        """
+        identify, nbf = payload.data.id, int(payload.nbf)
+        exp = get_timestamp() + expire
+
+        async with (cache_client or self.cache_client).pipeline() as pipe:
+            await pipe.set_blacklist(identify=identify, value=payload.json(), expire=expire)
+            await pipe.set_blacklist_index(identify, nbf, exp)
+            await pipe.publish(BLACKLIST_CHANNEL, json.dumps({'id': identify, 'nbf': nbf, 'exp': exp}))
+        self.add(identify, nbf, exp)
+
+    async def reconcile(self):
+        """
+        与缓存中的黑名单索引对账，同时清理过期的索引数据
+        :return:
+        """
+        now = get_timestamp()
+        index = await self.cache_client.get_blacklist_index()
+
+        revoked = {}
+        for identify, record in index.items():
+            if record['exp'] <= now:
+                await self.cache_client.delete_blacklist_index(identify)
+                continue
+            revoked[int(identify)] = (record['nbf'], record['exp'])
+
+        # 对账期间通过订阅收到的记录不能被覆盖
+        for identify, (nbf, exp) in self.revoked.items():
+            if exp > now and (identify not in revoked or revoked[identify][0] < nbf):
+                revoked[identify] = (nbf, exp)
+
+        self.revoked = revoked
+        self.ready = True
+
+    async def start(self):
+        try:
+            await self.reconcile()
+        except Exception as e:
+            logger.error(f'load blacklist error: {e}')
+        self._task = asyncio.create_task(self._reconcile_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reconcile_forever(self):
+        while True:
+            await asyncio.sleep(self.reconcile_seconds)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f'reconcile blacklist error: {e}')
+
+    def _on_message(self, data: str):
+        record = json.loads(data)
+        self.add(int(record['id']), record['nbf'], record['exp'])
+
+
+revocation_set = RevocationSet(cache, subscriber, reconcile_seconds=settings.BLACKLIST_RECONCILE_SECONDS)
@@ -1,6 +1,6 @@
 import enum
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 class TokenType(enum.Enum):
@@ -34,6 +34,8 @@ class PayloadData(BaseModel):
     jti：JWT ID用于标识该JWT
     scopes:
     data: 自定义字段
+    perm: 权限位图，格式为 {权限目录版本}.{base64url(位图)}
+    _superuser: 验证权限时从缓存中获取的是否是超级管理员，同一个请求中不再重复查询
     """
     iss: str | None = None
     sub: str | None = None
@@ -46,3 +48,5 @@ class PayloadData(BaseModel):
     scopes: list[str] = []
     # PayloadDataUserInfo 类型的 dict
     data: PayloadDataUserInfo | None = None
+    perm: str | None = None
+    _superuser: bool | None = PrivateAttr(default=None)
@@ -0,0 +1,3 @@
+from watchtower.depends.cache.memoize import cached, invalidate_tags
+
+__all__ = ['cached', 'invalidate_tags']
@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from watchtower.settings import settings
+
+
+class WrongTypeError(TypeError):
+    """
+    对 key 执行了与数据类型不符的操作，与 redis 的 WRONGTYPE 错误一致
+    """
+    pass
+
+
+def to_seconds(expire: int | timedelta | None) -> float | None:
+    if expire is None:
+        return None
+    if isinstance(expire, timedelta):
+        return expire.total_seconds()
+    return expire
+
+
+def to_str(value) -> str | bytes:
+    # 与 redis decode_responses=True 的行为一致，所有值都以字符串的形式返回，二进制编码的数据原样保存
+    if isinstance(value, bytes):
+        return value
+    return str(value)
+
+
+class MemoryPubSub:
+    """
+    进程内的订阅对象，接口与 redis.asyncio.client.PubSub 中使用到的部分一致
+    """
+
+    def __init__(self, backend: 'MemoryBackend'):
+        self.backend = backend
+        self.channels: set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self.channels.add(channel)
+            self.backend.subscribers.setdefault(channel, set()).add(self)
+            await self.queue.put({'type': 'subscribe', 'channel': channel, 'data': len(self.channels)})
+
+    async def listen(self):
+        while self.channels:
+            yield await self.queue.get()
+
+    async def reset(self):
+        for channel in self.channels:
+            self.backend.subscribers.get(channel, set()).discard(self)
+        self.channels.clear()
+
+
+class MemoryPipeline:
+    """
+    进程内的批量执行对象，接口与 redis.asyncio.client.Pipeline 中使用到的部分一致
+    命令先放入队列，execute 时依次执行，执行期间不会让出事件循环，因此是原子的
+    """
+
+    def __init__(self, backend: 'MemoryBackend'):
+        self.backend = backend
+        self.commands: list[tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        # 校验命令是否存在
+        getattr(self.backend, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def __await__(self):
+        return self._self().__await__()
+
+    async def _self(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.reset()
+
+    async def execute(self) -> list:
+        commands, self.commands = self.commands, []
+        return [await getattr(self.backend, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+    async def reset(self):
+        self.commands = []
+
+
+class MemoryBackend:
+    """
+    进程内的缓存后端，用于没有 redis 的单进程部署和性能测试
+    实现 CacheSystem 使用到的 redis 命令，支持过期时间，超过内存限制时淘汰最久未使用的 key
+    数据只在当前进程内有效，多进程部署时各个进程之间不共享数据，也收不到其他进程发布的消息
+    """
+
+    def __init__(self, max_memory: int = 64 * 1024 * 1024):
+        """
+        :param max_memory: 最大内存，单位为字节，按照 key 和 value 的字符串长度估算
+        """
+        self.max_memory = max_memory
+        self.memory = 0
+        # key -> str | bytes | dict[str, str | bytes] | set[str]，按照访问顺序排列
+        self.data: OrderedDict[str, str | dict[str, str]] = OrderedDict()
+        # key -> 过期时间
+        self.expires: dict[str, float] = {}
+        # (过期时间, key) 小顶堆，用于主动清理过期的 key
+        self.expire_heap: list[tuple[float, str]] = []
+        self.subscribers: dict[str, set[MemoryPubSub]] = {}
+
+    @staticmethod
+    def sizeof(key: str, value: str | dict[str, str] | set[str]) -> int:
+        if isinstance(value, dict):
+            return len(key) + sum(len(field) + len(item) for field, item in value.items())
+        if isinstance(value, set):
+            return len(key) + sum(len(member) for member in value)
+        return len(key) + len(value)
+
+    def _alive(self, key: str) -> bool:
+        expire_at = self.expires.get(key)
+        if expire_at is not None and expire_at <= time.monotonic():
+            self._remove(key)
+            return False
+        return key in self.data
+
+    def _lookup(self, key: str, kind: type):
+        if not self._alive(key):
+            return None
+        value = self.data[key]
+        if not isinstance(value, kind):
+            raise WrongTypeError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        self.data.move_to_end(key)
+        return value
+
+    def _store(self, key: str, value: str | dict[str, str]):
+        if key in self.data:
+            self.memory -= self.sizeof(key, self.data[key])
+        self.data[key] = value
+        self.data.move_to_end(key)
+        self.memory += self.sizeof(key, value)
+        self._evict()
+
+    def _remove(self, key: str) -> bool:
+        self.expires.pop(key, None)
+        value = self.data.pop(key, None)
+        if value is None:
+            return False
+        self.memory -= self.sizeof(key, value)
+        return True
+
+    def _set_expire(self, key: str, expire: float | None):
+        if expire is None:
+            self.expires.pop(key, None)
+            return
+        expire_at = time.monotonic() + expire
+        self.expires[key] = expire_at
+        heapq.heappush(self.expire_heap, (expire_at, key))
+
+    def _evict(self):
+        # 先清理已经过期的 key，内存仍然不足时淘汰最久未使用的 key
+        now = time.monotonic()
+        while self.expire_heap and self.expire_heap[0][0] <= now:
+            expire_at, key = heapq.heappop(self.expire_heap)
+            # 过期时间被修改过的 key 以 expires 中的为准
+            if self.expires.get(key) == expire_at:
+                self._remove(key)
+        while self.memory > self.max_memory and len(self.data) > 1:
+            self._remove(next(iter(self.data)))
+
+    async def get(self, key: str) -> str | bytes | None:
+        return self._lookup(key, (str, bytes))
+
+    async def set(self, key: str, value, ex: int | timedelta | None = None, nx: bool = False) -> bool | None:
+        if nx and self._alive(key):
+            return None
+        self._store(key, to_str(value))
+        self._set_expire(key, to_seconds(ex))
+        return True
+
+    async def expire(self, key: str, expire: int | timedelta, nx: bool = False, gt: bool = False) -> bool:
+        """
+        与 redis 的 EXPIRE 相同，nx 只在没有过期时间时设置，gt 只在新的过期时间更晚时设置，没有过期时间的 key 视为永不过期
+        """
+        if not self._alive(key):
+            return False
+        expire = to_seconds(expire)
+        current = self.expires.get(key)
+        if nx and current is not None:
+            return False
+        if gt and (current is None or time.monotonic() + expire <= current):
+            return False
+        self._set_expire(key, expire)
+        return True
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        value = int(self._lookup(key, (str, bytes)) or 0) + amount
+        self._store(key, str(value))
+        return value
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._remove(key) for key in keys if self._alive(key))
+
+    async def hget(self, key: str, field: str) -> str | None:
+        return (self._lookup(key, dict) or {}).get(field)
+
+    async def hmget(self, key: str, fields: list[str]) -> list[str | None]:
+        value = self._lookup(key, dict) or {}
+        return [value.get(field) for field in fields]
+
+    async def hmset(self, key: str, mapping: dict) -> bool:
+        value = dict(self._lookup(key, dict) or {})
+        value.update({to_str(field): to_str(item) for field, item in mapping.items()})
+        self._store(key, value)
+        return True
+
+    async def hdel(self, key: str, *fields: str) -> int:
+        value = self._lookup(key, dict)
+        if value is None:
+            return 0
+        value = dict(value)
+        count = sum(value.pop(field, None) is not None for field in fields)
+        if value:
+            self._store(key, value)
+        else:
+            self._remove(key)
+        return count
+
+    async def hgetall(self, key: str) -> dict[str, str]:
+        return dict(self._lookup(key, dict) or {})
+
+    async def sadd(self, key: str, *members) -> int:
+        value = set(self._lookup(key, set) or set())
+        count = len(value)
+        value.update(to_str(member) for member in members)
+        self._store(key, value)
+        return len(value) - count
+
+    async def smembers(self, key: str) -> 'set[str]':
+        return set(self._lookup(key, set) or set())
+
+    async def publish(self, channel: str, message) -> int:
+        subscribers = self.subscribers.get(channel, set())
+        for pubsub in subscribers:
+            pubsub.queue.put_nowait({'type': 'message', 'channel': channel, 'data': to_str(message)})
+        return len(subscribers)
+
+    def pubsub(self) -> MemoryPubSub:
+        return MemoryPubSub(self)
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return MemoryPipeline(self)
+
+    def stats(self) -> dict:
+        return {'keys': len(self.data), 'memory': self.memory, 'max_memory': self.max_memory}
+
+
+def get_memory() -> MemoryBackend:
+    return MemoryBackend(max_memory=settings.CACHE_MEMORY_MAX_BYTES)
@@ -11,7 +11,14 @@ def create_conn_pool() -> aioredis.ConnectionPool:
             redis_auth = ''
 
         redis_url = f"redis://{redis_auth}{settings.CACHE_REDIS_HOST}:{settings.CACHE_REDIS_PORT}/{settings.CACHE_REDIS_DB}"
-        return aioredis.ConnectionPool.from_url(redis_url, max_connections=100, decode_responses=True, encoding=settings.CACHE_REDIS_CHARSET)
+        return aioredis.ConnectionPool.from_url(
+            redis_url,
+            max_connections=settings.CACHE_REDIS_MAX_CONNECTIONS,
+            decode_responses=settings.CACHE_REDIS_DECODE_RESPONSES,
+            encoding=settings.CACHE_REDIS_CHARSET,
+            # 只限制建立连接的时间，命令的超时由熔断器控制，订阅连接需要长时间阻塞读取
+            socket_connect_timeout=settings.CACHE_REDIS_CONNECT_TIMEOUT
+        )
 
 
 pool = create_conn_pool()
@@ -19,3 +26,17 @@ pool = create_conn_pool()
 
 def get_redis() -> aioredis.Redis:
     return aioredis.Redis(connection_pool=pool)
+
+
+def get_pool_stats() -> dict | None:
+    """
+    连接池的使用情况，in_use 接近 max_connections 时需要增加连接数或者排查慢命令
+    :return:
+    """
+    if pool is None:
+        return None
+    return {
+        'max_connections': pool.max_connections,
+        'in_use': len(pool._in_use_connections),
+        'available': len(pool._available_connections),
+    }
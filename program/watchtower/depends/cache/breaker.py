@@ -0,0 +1,116 @@
+import asyncio
+import inspect
+import time
+from typing import Awaitable
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断器打开期间拒绝执行的命令
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    缓存命令的熔断器，每个命令都有超时时间，连续失败达到阈值后打开
+    打开期间直接拒绝所有命令，不再等待超时；经过恢复时间后只放行一个探测命令，成功后关闭，失败后重新打开
+    """
+
+    def __init__(self, timeout: float, failure_threshold: int = 5, recovery_seconds: float = 10):
+        """
+        :param timeout: 单个命令的超时时间，单位为秒，为 0 时不限制
+        :param failure_threshold: 连续失败多少次后打开
+        :param recovery_seconds: 打开多长时间后尝试恢复，单位为秒
+        """
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # 半开状态下是否已经有探测命令在执行
+        self.probing = False
+        self.opened_count = 0
+        self.rejected_count = 0
+        self.timeout_count = 0
+
+    def allow(self) -> bool:
+        """
+        是否允许执行命令，打开状态经过恢复时间后转为半开，并放行一个探测命令
+        :return:
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_seconds:
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened_count += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    async def call(self, awaitable: Awaitable):
+        """
+        通过熔断器执行命令
+        :param awaitable: 缓存命令
+        :return: 命令的返回值，熔断器打开时抛出 CircuitOpenError，超时时抛出 asyncio.TimeoutError
+        """
+        if not self.allow():
+            self.rejected_count += 1
+            # 没有执行的协程需要关闭，否则会有未 await 的警告
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            raise CircuitOpenError(f'cache circuit breaker is {self.state}')
+
+        try:
+            if self.timeout > 0:
+                result = await asyncio.wait_for(awaitable, self.timeout)
+            else:
+                result = await awaitable
+        except asyncio.TimeoutError:
+            self.timeout_count += 1
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except asyncio.CancelledError:
+            # 请求被取消不代表缓存不可用，释放探测机会
+            self.probing = False
+            raise
+        self.record_success()
+        return result
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != CLOSED
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened': self.opened_count,
+            'rejected': self.rejected_count,
+            'timeout': self.timeout_count,
+        }
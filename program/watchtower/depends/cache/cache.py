@@ -1,9 +1,19 @@
+import asyncio
 import json
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Callable, Awaitable, AsyncIterator
 
 from fastapi import status
 
+from watchtower.depends.cache.backend.memory_backend import get_memory
 from watchtower.depends.cache.backend.redis_backend import get_redis
-from watchtower.settings import logger
+from watchtower.depends.cache.breaker import CircuitBreaker
+from watchtower.depends.cache.codec import Codec, JsonCodec, JSON_TAG, get_codec, loads, pack_permissions, unpack_permissions
+from watchtower.depends.cache.local_cache import LocalCache, LOCAL_CACHE_CHANNEL, WHOLE_VALUE
+from watchtower.depends.cache.metrics import CacheMetrics
+from watchtower.settings import settings, logger
 from watchtower.status.global_status import StatusMap
 from watchtower.status.types.exception import SiteException
 from watchtower.status.types.response import GenericBaseResponse
@@ -14,14 +24,194 @@ CACHE_SYSTEM_EXCEPTION = SiteException(
 )
 
 
+# 用户权限中只存储是否是超级管理员和角色列表，具体的权限存储在角色权限中
+# 用户权限固定使用 JSON 编码，AUTHORIZATION_SCRIPT 中需要解析角色列表
+# 升级前写入的用户权限没有角色列表，请求方法对应的权限直接存储在用户权限中，没有权限的请求方法不存储，在过期之前继续使用
+PERMISSION_SUPERUSER_FIELD = 'superuser'
+PERMISSION_ROLES_FIELD = 'roles'
+
+# 缓存类别，key中包含类别的版本号，增加版本号后整个类别的旧key都不会再被读取，等待过期即可，不需要扫描删除
+GENERATION_CHANNEL = 'cache_generation_channel'
+PERMISSION_FAMILY = 'permission'
+ROLE_PERMISSION_FAMILY = 'role_permission'
+MENU_FAMILY = 'menu'
+
+# 加载角色权限的方法，返回 {role_id: {method: list[{ 'id': int, 'url': str, 'code': str}]}}
+ROLE_PERMISSION_LOADER = Callable[[list[int]], Awaitable[dict[int, dict[str, list[dict]]]]]
+
+
+# 一次请求获取黑名单、是否是超级管理员、用户角色、升级前写入的请求方法权限以及各个角色在请求方法下的权限
+# KEYS: 黑名单key、用户权限key
+# ARGV: 请求方法、角色权限key前缀、是否获取黑名单、角色权限key的版本号后缀
+# 角色权限的key由用户角色拼接得到，没有在KEYS中声明，不能用于redis集群
+AUTHORIZATION_SCRIPT = """
+local blacklist = false
+if ARGV[3] == '1' then
+    blacklist = redis.call('GET', KEYS[1])
+end
+local user = redis.call('HMGET', KEYS[2], 'superuser', 'roles', ARGV[1])
+local result = {blacklist, user[1], user[2], user[3]}
+if user[2] then
+    for _, role in ipairs(cjson.decode(user[2])) do
+        -- 角色id存储为字符串，直接拼接；升级前存储的数字角色id转换为整数格式
+        if type(role) == 'number' then
+            role = string.format('%d', role)
+        end
+        result[#result + 1] = redis.call('HGET', ARGV[2] .. role .. ARGV[4], ARGV[1])
+    end
+end
+return result
+"""
+
+
+# 值与传入的值相同时才删除，用于释放锁，防止删除其他进程在锁过期后重新获取的锁
+DELETE_IF_EQUAL_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 雪花算法机器id的租约，值为 "上次使用的时间戳|租用者"，释放后租用者为空，时间戳保留给下一个租用者
+# 租用：没有租约或者租约已经释放时写入租用者，返回上一个租用者写入的时间戳，租约属于其他租用者时返回 nil
+# KEYS: 租约key
+# ARGV: 租用者、过期时间
+ACQUIRE_LEASE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+local timestamp = '0'
+if value then
+    local index = string.find(value, '|', 1, true)
+    if not index or index < #value then
+        return false
+    end
+    timestamp = string.sub(value, 1, index - 1)
+end
+redis.call('SET', KEYS[1], timestamp .. '|' .. ARGV[1], 'EX', ARGV[2])
+return timestamp
+"""
+
+# 续期或者释放：租约属于传入的租用者时写入较晚的时间戳，释放时清空租用者，防止修改其他进程在租约过期后重新获取的租约
+# KEYS: 租约key
+# ARGV: 租用者、使用的时间戳、过期时间、写入的租用者
+UPDATE_LEASE_SCRIPT = """
+local owner = '|' .. ARGV[1]
+local value = redis.call('GET', KEYS[1])
+if not value or string.sub(value, -#owner) ~= owner then
+    return 0
+end
+local timestamp = math.max(tonumber(string.sub(value, 1, #value - #owner)), tonumber(ARGV[2]))
+redis.call('SET', KEYS[1], string.format('%d', timestamp) .. '|' .. ARGV[4], 'EX', ARGV[3])
+return 1
+"""
+
+# 增加权限目录的版本号并写入权限目录，两个命令原子执行，同时更新权限目录时版本号和权限顺序不会错配
+# KEYS: 版本号key、权限目录key
+# ARGV: 权限目录中版本号之前的部分、版本号之后的部分，权限目录固定使用 JSON 编码
+SET_PERMISSION_CATALOG_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('SET', KEYS[2], ARGV[1] .. version .. ARGV[2])
+return version
+"""
+
+# 只延长过期时间，key 没有过期时间时设置，已有的过期时间更晚时不修改
+EXTEND_EXPIRE_SCRIPT = """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl >= tonumber(ARGV[1]) then
+    return 0
+end
+return redis.call('EXPIRE', KEYS[1], ARGV[1])
+"""
+
+
+@dataclass
+class Authorization:
+    """
+    验证权限需要的缓存数据
+    blacklist: 黑名单记录，没有获取或者不存在时为 None
+    superuser: 是否是超级管理员
+    permissions: 请求方法对应的权限，用户权限不存在时为 None
+    """
+    blacklist: str | None = None
+    superuser: bool = False
+    permissions: list[dict] | None = None
+
+
 def get_permission_key(identify: str) -> str:
     return f'permission_{identify}'
 
 
+def get_role_permission_key(identify: str) -> str:
+    return f'role_permission_{identify}'
+
+
 def get_blacklist_key(identify: str) -> str:
     return f'blacklist_{identify}'
 
 
+def get_blacklist_index_key() -> str:
+    return 'blacklist_index'
+
+
+def get_permission_catalog_key() -> str:
+    return 'permission_catalog'
+
+
+def get_permission_catalog_version_key() -> str:
+    return 'permission_catalog_version'
+
+
+def get_generation_key(family: str) -> str:
+    return f'generation_{family}'
+
+
+def get_generation_suffix(generation: int) -> str:
+    # 版本号为 0 时使用原有的key，升级前写入的缓存仍然有效
+    return f'@{generation}' if generation else ''
+
+
+def with_generation(key: str, generation: int) -> str:
+    return f'{key}{get_generation_suffix(generation)}'
+
+
+def get_lock_key(key: str) -> str:
+    return f'lock_{key}'
+
+
+def get_worker_lease_key(datacenter_id: int, server_id: int) -> str:
+    return f'worker_lease_{datacenter_id}_{server_id}'
+
+
+def parse_worker_lease(value: str | bytes | None) -> tuple[int, str]:
+    """
+    解析租约的值
+    :param value: 缓存中租约的值
+    :return: (上次使用的时间戳, 租用者)，租约已经释放时租用者为空
+    """
+    if value is None:
+        return 0, ''
+    if isinstance(value, bytes):
+        value = value.decode()
+    if '|' not in value:
+        # 升级前写入的租约只有租用者
+        return 0, value
+    timestamp, owner = value.split('|', 1)
+    return int(timestamp), owner
+
+
+def dump_permission_roles(roles: list[int]) -> str:
+    """
+    用户权限中的角色列表，角色id存储为字符串，脚本中 cjson 把数字解码为浮点数，超过 2**53 的id会丢失精度
+    :param roles: 角色id列表
+    :return:
+    """
+    return json.dumps([str(role) for role in roles])
+
+
+def load_permission_roles(value: str | bytes) -> list[int]:
+    # 兼容升级前存储为数字的角色id
+    return [int(role) for role in json.loads(value)]
+
+
 def get_menu_key(identify: str = None) -> str:
     if identify is None:
         return 'global_menu'
@@ -29,60 +219,371 @@ def get_menu_key(identify: str = None) -> str:
 
 
 class CacheSystem:
-    def __init__(self, backend):
+    def __init__(
+            self,
+            backend,
+            local: LocalCache | None = None,
+            codec: Codec | None = None,
+            generation_ttl: float = 5,
+            breaker: CircuitBreaker | None = None,
+            metrics: CacheMetrics | None = None
+    ):
+        """
+        :param backend: 缓存后端
+        :param local: 进程内的一级缓存
+        :param codec: 结构化数据的编码方式
+        :param generation_ttl: 类别版本号在进程内的缓存时间，单位为秒，订阅断开期间最多在该时间内使用旧的版本号
+        :param breaker: 熔断器，为 None 时不限制命令的执行时间
+        :param metrics: 缓存命令的统计，为 None 时不统计
+        """
         self.backend = backend
+        self.breaker = breaker
+        self.metrics = metrics
+        # 权限列表、菜单等结构化数据的编码方式，读取时支持所有编码方式
+        self.codec = codec or JsonCodec()
+        # 进程内的一级缓存，为 None 时所有读取都直接访问 backend
+        self.local = local
+        self.role_permission_loader: ROLE_PERMISSION_LOADER | None = None
+        self.scripts: dict[str, object] = {}
+        self.generation_ttl = generation_ttl
+        # family -> (过期时间, 版本号)
+        self.generations: dict[str, tuple[float, int]] = {}
+        # 每次收到版本号变化的消息都会增加，读取版本号期间收到消息时不缓存读取结果，防止缓存旧的版本号
+        self.generation_epoch = 0
 
     def __call__(self):
         return self
 
+    async def call(self, awaitable: Awaitable, operation: str = '', key: str | None = None, payload=None):
+        """
+        执行缓存命令，有熔断器时通过熔断器执行，超时或者熔断器打开时抛出异常，由各个方法统一转换为 CACHE_SYSTEM_EXCEPTION
+        :param awaitable: 缓存命令
+        :param operation: 命令名称，用于统计
+        :param key: 命令操作的key，用于统计
+        :param payload: 写入的数据，用于统计
+        :return:
+        """
+        if self.breaker is not None:
+            awaitable = self.breaker.call(awaitable)
+        if self.metrics is None:
+            return await awaitable
+
+        start = time.perf_counter()
+        try:
+            result = await awaitable
+        except Exception:
+            self.metrics.record_error(operation, key)
+            raise
+        self.metrics.record(operation, key, time.perf_counter() - start, result, payload)
+        return result
+
+    def get_script(self, source: str):
+        """
+        获取注册到 backend 的脚本，脚本使用 EVALSHA 执行，backend 变化后重新注册
+        :param source: 脚本内容
+        :return: 不支持脚本的 backend 返回 None
+        """
+        if not hasattr(self.backend, 'register_script'):
+            return None
+        script = self.scripts.get(source)
+        if script is None or script.registered_client is not self.backend:
+            script = self.scripts[source] = self.backend.register_script(source)
+        return script
+
+    async def invalidate_local(self, key: str):
+        """
+        key 发生变化后删除本进程的一级缓存，并通知其他进程删除
+        :param key: 发生变化的key
+        :return:
+        """
+        if self.local is None or self.local.family(key) is None:
+            return
+        self.local.invalidate(key)
+        try:
+            await self.call(self.backend.publish(LOCAL_CACHE_CHANNEL, key), 'publish')
+        except Exception as e:
+            # 数据已经写入成功，通知失败时其他进程最多在过期时间内读取到旧数据
+            logger.warning(f'publish local cache invalidation error: {e}')
+
+    async def get_generation(self, family: str) -> int:
+        """
+        获取缓存类别的版本号，版本号在进程内缓存 generation_ttl 秒，其他进程增加版本号后通过订阅频道通知
+        :param family: 缓存类别
+        :return:
+        """
+        cached = self.generations.get(family)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        epoch = self.generation_epoch
+        try:
+            generation = int(await self.call(self.backend.get(get_generation_key(family)), 'get', get_generation_key(family)) or 0)
+        except Exception as e:
+            logger.error(f'get cache generation error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        if epoch == self.generation_epoch:
+            self.generations[family] = (time.monotonic() + self.generation_ttl, generation)
+        return generation
+
+    async def get_family_key(self, family: str, key: str) -> str:
+        """
+        获取包含类别版本号的key
+        :param family: 缓存类别
+        :param key: 不包含版本号的key
+        :return:
+        """
+        return with_generation(key, await self.get_generation(family))
+
+    async def bump_generation(self, family: str):
+        """
+        增加缓存类别的版本号，使整个类别的缓存失效，并通知其他进程
+        :param family: 缓存类别
+        :return:
+        """
+        generation = await self.incr(get_generation_key(family))
+        await self.publish(GENERATION_CHANNEL, family)
+        self.on_generation_message(family)
+        return generation
+
+    def on_generation_message(self, family: str):
+        self.generation_epoch += 1
+        self.generations.pop(family, None)
+
     async def set_expire(self, key: str, expire: int):
         try:
-            return await self.backend.expire(key, expire)
+            return await self.call(self.backend.expire(key, expire), 'expire', key)
         except Exception as e:
             logger.error(f'set expire error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
 
+    async def extend_expire(self, key: str, expire: int):
+        """
+        延长过期时间，新的过期时间早于已有的过期时间时不修改
+        :param key: 缓存的key
+        :param expire: 过期时间，单位为秒
+        :return:
+        """
+        script = self.get_script(EXTEND_EXPIRE_SCRIPT)
+        try:
+            if script is not None:
+                return await self.call(script(keys=[key], args=[expire]), 'expire', key)
+            # 进程内缓存的 EXPIRE 支持 NX 和 GT
+            await self.call(self.backend.expire(key, expire, nx=True), 'expire', key)
+            return await self.call(self.backend.expire(key, expire, gt=True), 'expire', key)
+        except Exception as e:
+            logger.error(f'extend expire error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+
     async def get(self, key: str):
+        if self.local is not None:
+            hit, values = self.local.get(key, [WHOLE_VALUE])
+            if hit:
+                return values[0]
+            generation = self.local.generation
         try:
-            return await self.backend.get(key)
+            value = await self.call(self.backend.get(key), 'get', key)
         except Exception as e:
             logger.error(f'get cache error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
+        if self.local is not None:
+            self.local.put(key, {WHOLE_VALUE: value}, generation)
+        return value
 
     async def set(self, key: str, value: str, expire: int | None = None):
         try:
-            return await self.backend.set(key, value, expire)
+            data = await self.call(self.backend.set(key, value, expire), 'set', key, value)
         except Exception as e:
             logger.error(f'set cache error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
+        await self.invalidate_local(key)
+        return data
 
-    async def delete(self, key: str):
+    async def set_nx(self, key: str, value: str, expire: int) -> bool:
+        """
+        key 不存在时才写入，用于获取锁
+        :param key: 缓存的key
+        :param value: 写入的值
+        :param expire: 过期时间，单位为秒
+        :return: 是否写入成功
+        """
         try:
-            return await self.backend.delete(key)
+            data = await self.call(self.backend.set(key, value, ex=expire, nx=True), 'set_nx', key, value)
         except Exception as e:
-            logger.error(f'delete cache error: {e}')
+            logger.error(f'set nx cache error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
+        if data:
+            await self.invalidate_local(key)
+        return bool(data)
 
-    async def hash_get(self, key: str, field: str):
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        """
+        key 的值与传入的值相同时才删除
+        :param key: 缓存的key
+        :param value: 期望的值
+        :return: 是否删除
+        """
+        script = self.get_script(DELETE_IF_EQUAL_SCRIPT)
+        try:
+            if script is not None:
+                data = await self.call(script(keys=[key], args=[value]), 'delete_if_equal', key)
+            else:
+                current = await self.call(self.backend.get(key), 'get', key)
+                if isinstance(current, bytes):
+                    current = current.decode()
+                data = await self.call(self.backend.delete(key), 'delete', key) if current == value else 0
+        except Exception as e:
+            logger.error(f'delete if equal cache error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        if data:
+            await self.invalidate_local(key)
+        return bool(data)
+
+    async def acquire_lease(self, key: str, owner: str, expire: int) -> int | None:
+        """
+        租用没有被其他租用者持有的租约
+        :param key: 租约的key
+        :param owner: 租用者
+        :param expire: 过期时间，单位为秒
+        :return: 租用成功时返回上一个租用者使用的时间戳，没有记录时为 0；租约属于其他租用者时返回 None
+        """
+        script = self.get_script(ACQUIRE_LEASE_SCRIPT)
         try:
-            return await self.backend.hget(key, field)
+            if script is not None:
+                data = await self.call(script(keys=[key], args=[owner, expire]), 'acquire_lease', key)
+                return None if data is None else int(data)
+            timestamp, current = parse_worker_lease(await self.call(self.backend.get(key), 'get', key))
+            if current:
+                return None
+            await self.call(self.backend.set(key, f'{timestamp}|{owner}', ex=expire), 'set', key)
+            return timestamp
         except Exception as e:
-            logger.error(f'hash get cache error: {e}')
+            logger.error(f'acquire lease cache error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
 
+    async def update_lease(self, key: str, owner: str, timestamp: int, expire: int, release: bool = False) -> bool:
+        """
+        租约属于传入的租用者时续期或者释放，同时记录使用过的最晚的时间戳
+        :param key: 租约的key
+        :param owner: 租用者
+        :param timestamp: 当前租用者使用的时间戳
+        :param expire: 过期时间，单位为秒，释放时为时间戳保留的时间
+        :param release: 是否释放租约
+        :return: 租约是否属于传入的租用者
+        """
+        new_owner = '' if release else owner
+        script = self.get_script(UPDATE_LEASE_SCRIPT)
+        try:
+            if script is not None:
+                data = await self.call(
+                    script(keys=[key], args=[owner, timestamp, expire, new_owner]), 'update_lease', key
+                )
+                return bool(data)
+            last_timestamp, current = parse_worker_lease(await self.call(self.backend.get(key), 'get', key))
+            if current != owner:
+                return False
+            value = f'{max(last_timestamp, timestamp)}|{new_owner}'
+            await self.call(self.backend.set(key, value, ex=expire), 'set', key)
+            return True
+        except Exception as e:
+            logger.error(f'update lease cache error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        try:
+            data = await self.call(self.backend.incr(key, amount), 'incr', key)
+        except Exception as e:
+            logger.error(f'incr cache error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        await self.invalidate_local(key)
+        return data
+
+    async def delete(self, key: str):
+        try:
+            data = await self.call(self.backend.delete(key), 'delete', key)
+        except Exception as e:
+            logger.error(f'delete cache error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        await self.invalidate_local(key)
+        return data
+
+    async def hash_get(self, key: str, field: str):
+        return (await self.hash_multi_get(key, [field]))[0]
+
     async def hash_multi_set(self, key: str, mapping: dict):
         try:
-            return await self.backend.hmset(key, mapping)
+            data = await self.call(self.backend.hmset(key, mapping), 'hmset', key, mapping)
         except Exception as e:
             logger.error(f'hash multi set cache error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
+        await self.invalidate_local(key)
+        return data
 
     async def hash_multi_get(self, key: str, fields: list):
+        if self.local is not None:
+            hit, values = self.local.get(key, fields)
+            if hit:
+                return values
+            generation = self.local.generation
         try:
-            return await self.backend.hmget(key, fields)
+            values = await self.call(self.backend.hmget(key, fields), 'hmget', key)
         except Exception as e:
             logger.error(f'hash multi get cache error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
+        if self.local is not None:
+            self.local.put(key, dict(zip(fields, values)), generation)
+        return values
+
+    async def hash_get_all(self, key: str) -> dict:
+        try:
+            return await self.call(self.backend.hgetall(key), 'hgetall', key)
+        except Exception as e:
+            logger.error(f'hash get all cache error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+
+    async def set_add(self, key: str, *members: str) -> int:
+        try:
+            data = await self.call(self.backend.sadd(key, *members), 'sadd', key, members)
+        except Exception as e:
+            logger.error(f'set add cache error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        await self.invalidate_local(key)
+        return data
+
+    async def set_members(self, key: str) -> 'set[str]':
+        try:
+            members = await self.call(self.backend.smembers(key), 'smembers', key)
+        except Exception as e:
+            logger.error(f'set members cache error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        return {member.decode() if isinstance(member, bytes) else member for member in members}
+
+    async def publish(self, channel: str, message: str):
+        try:
+            return await self.call(self.backend.publish(channel, message), 'publish')
+        except Exception as e:
+            logger.error(f'publish message error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+
+    @asynccontextmanager
+    async def pipeline(self) -> AsyncIterator['CachePipeline']:
+        """
+        批量执行写入命令，退出时使用一次请求以事务的方式执行，中途发生异常时丢弃所有命令
+            async with cache.pipeline() as pipe:
+                await pipe.delete(key)
+                await pipe.set(key, value)
+        :return:
+        """
+        async with self.backend.pipeline(transaction=True) as pipe:
+            cache_pipeline = CachePipeline(self, pipe)
+            yield cache_pipeline
+            await cache_pipeline.execute()
+
+    def pubsub(self):
+        """
+        获取订阅对象，订阅对象会独占一个连接，使用完成后需要关闭
+        :return:
+        """
+        return self.backend.pubsub()
 
     async def hash_delete(self, key: str, field: str | None = None):
         """
@@ -94,10 +595,14 @@ class CacheSystem:
         try:
             if field is None:
                 return await self.delete(key)
-            return await self.backend.hdel(key, field)
+            data = await self.call(self.backend.hdel(key, field), 'hdel', key)
+        except SiteException:
+            raise
         except Exception as e:
             logger.error(f'hash delete cache error: {e}')
             raise CACHE_SYSTEM_EXCEPTION from e
+        await self.invalidate_local(key)
+        return data
 
     # ##### 纯自定义，和项目耦合 #####
     async def set_permission(self, identify: int | str, permissions: dict, expire: int = 60, encode: bool = True):
@@ -107,31 +612,198 @@ class CacheSystem:
         if encode:
             permissions = {k: json.dumps(v) for k, v in permissions.items()}
 
-        permission_key = get_permission_key(str(identify))
-        # 先删除原有的key，保证数据一致性，并且重新设置过期时间
-        await self.hash_delete(permission_key)
-        data = await self.hash_multi_set(permission_key, permissions)
-        await self.set_expire(permission_key, expire)
-        return data
+        permission_key = await self.get_family_key(PERMISSION_FAMILY, get_permission_key(str(identify)))
+        # 先删除原有的key，保证数据一致性，并且重新设置过期时间，在同一个事务中执行，不会读取到空数据
+        async with self.pipeline() as pipe:
+            await pipe.hash_delete(permission_key)
+            await pipe.hash_multi_set(permission_key, permissions)
+            await pipe.set_expire(permission_key, expire)
+        return True
 
     async def get_permission(self, identify: int | str, fields: list | str, decode: bool = True):
+        """
+        获取用户权限，请求方法对应的权限为用户所有角色权限的并集
+        :param identify: 用户id
+        :param fields: 需要获取的字段，请求方法或者 superuser
+        :param decode: 是否进行解码
+        :return: 用户权限不存在时返回 None
+        """
         if not fields:
             return None
 
-        if isinstance(fields, str):
-            permissions = await self.hash_get(get_permission_key(str(identify)), fields)
-            if decode and permissions:
-                permissions = json.loads(permissions)
-        else:
-            permissions = await self.hash_multi_get(get_permission_key(str(identify)), fields)
-            if decode and permissions:
-                permissions = [json.loads(p) if p else None for p in permissions]
+        is_single = isinstance(fields, str)
+        if is_single:
+            fields = [fields]
+
+        permission_key = await self.get_family_key(PERMISSION_FAMILY, get_permission_key(str(identify)))
+        values = await self.hash_multi_get(permission_key, [PERMISSION_ROLES_FIELD, PERMISSION_SUPERUSER_FIELD, *fields])
+        roles, superuser, values = values[0], values[1], values[2:]
+        if roles is None:
+            if superuser is None:
+                return None if is_single else [None] * len(fields)
+            permissions = self.get_legacy_permissions(fields, values, decode)
+            return permissions[0] if is_single else permissions
+
+        roles = load_permission_roles(roles)
+        method_fields = [field for field in fields if field not in (PERMISSION_SUPERUSER_FIELD, PERMISSION_ROLES_FIELD)]
+        role_permissions = await self.get_role_permissions(roles, method_fields) if method_fields else {}
+
+        permissions = []
+        for field, value in zip(fields, values):
+            if field in method_fields:
+                # 多个角色可能拥有相同的权限，按照权限id去重
+                merged = {}
+                for role in roles:
+                    for permission in role_permissions[role][method_fields.index(field)] or []:
+                        merged[permission['id']] = permission
+                value = list(merged.values())
+                if not decode:
+                    value = json.dumps(value)
+            elif decode and field == PERMISSION_ROLES_FIELD:
+                value = roles
+            elif decode and value:
+                value = json.loads(value)
+            permissions.append(value)
 
         # permissions 是一个 list[{ 'id': int, 'url': str, 'code': str}] 格式的数据
+        return permissions[0] if is_single else permissions
+
+    @staticmethod
+    def get_legacy_permissions(fields: list[str], values: list, decode: bool = True) -> list:
+        """
+        升级前写入的用户权限，请求方法对应的权限直接存储在用户权限中
+        :param fields: 需要获取的字段，请求方法或者 superuser
+        :param values: 用户权限中 fields 对应的值
+        :param decode: 是否进行解码
+        :return:
+        """
+        permissions = []
+        for field, value in zip(fields, values):
+            # 没有权限的请求方法没有存储
+            if value is None and field not in (PERMISSION_SUPERUSER_FIELD, PERMISSION_ROLES_FIELD):
+                value = json.dumps([])
+            if decode and value:
+                value = loads(value)
+            permissions.append(value)
         return permissions
 
+    async def get_authorization(self, identify: int | str, method: str, with_blacklist: bool = True) -> Authorization:
+        """
+        获取验证权限需要的所有数据，支持脚本时只使用一次请求
+        启用一级缓存时不使用脚本，分别读取以便命中一级缓存
+        :param identify: 用户id
+        :param method: 请求方法
+        :param with_blacklist: 是否获取黑名单
+        :return:
+        """
+        permission_key = await self.get_family_key(PERMISSION_FAMILY, get_permission_key(str(identify)))
+        role_generation = await self.get_generation(ROLE_PERMISSION_FAMILY)
+        script = self.get_script(AUTHORIZATION_SCRIPT) if self.local is None else None
+        if script is not None:
+            try:
+                result = await self.call(script(
+                    keys=[get_blacklist_key(str(identify)), permission_key],
+                    args=[method, get_role_permission_key(''), '1' if with_blacklist else '0', get_generation_suffix(role_generation)]
+                ), 'script', permission_key)
+            except Exception as e:
+                logger.error(f'get authorization error: {e}')
+                raise CACHE_SYSTEM_EXCEPTION from e
+            blacklist, superuser, roles, legacy = result[:4]
+            roles = load_permission_roles(roles) if roles else None
+            role_values = dict(zip(roles or [], result[4:]))
+        else:
+            blacklist = await self.get_blacklist(identify) if with_blacklist else None
+            superuser, roles, legacy = await self.hash_multi_get(permission_key, [PERMISSION_SUPERUSER_FIELD, PERMISSION_ROLES_FIELD, method])
+            roles = load_permission_roles(roles) if roles else None
+            role_values = {}
+
+        authorization = Authorization(blacklist=blacklist or None, superuser=bool(superuser and json.loads(superuser)[0]))
+        if roles is None:
+            # 升级前写入的用户权限直接使用其中的请求方法权限，不需要重新登录
+            if superuser:
+                authorization.permissions = unpack_permissions(loads(legacy)) if legacy else []
+            return authorization
+
+        # 脚本中没有获取到的角色权限通过 get_role_permissions 获取，缓存中不存在时会从数据库中加载
+        role_permissions = {role: [unpack_permissions(loads(value))] for role, value in role_values.items() if value}
+        missing = [role for role in roles if role not in role_permissions]
+        if missing:
+            role_permissions.update(await self.get_role_permissions(missing, [method]))
+
+        merged = {}
+        for role in roles:
+            for permission in role_permissions[role][0] or []:
+                merged[permission['id']] = permission
+        authorization.permissions = list(merged.values())
+        return authorization
+
+    async def update_permission_roles(self, identify: int | str, roles: list[int]):
+        """
+        用户角色变化后更新缓存中的角色列表，用户权限不存在时不做处理
+        :param identify: 用户id
+        :param roles: 角色id列表
+        :return:
+        """
+        permission_key = await self.get_family_key(PERMISSION_FAMILY, get_permission_key(str(identify)))
+        if await self.hash_get(permission_key, PERMISSION_SUPERUSER_FIELD) is None:
+            return None
+        # 升级前写入的用户权限写入角色列表后，不再使用其中旧的请求方法权限
+        return await self.hash_multi_set(permission_key, {PERMISSION_ROLES_FIELD: dump_permission_roles(roles)})
+
+    def register_role_permission_loader(self, loader: ROLE_PERMISSION_LOADER):
+        self.role_permission_loader = loader
+
+    async def set_role_permission(self, identify: int | str, permissions: dict[str, list], expire: int = 7 * 24 * 3600):
+        """
+        设置角色权限，所有请求方法都需要存储，空权限存储为空列表，用来区分角色权限是否已经缓存
+        :param identify: 角色id
+        :param permissions: 角色权限，{method: list[{ 'id': int, 'url': str, 'code': str}]}
+        :param expire: 过期时间
+        :return:
+        """
+        role_permission_key = await self.get_family_key(ROLE_PERMISSION_FAMILY, get_role_permission_key(str(identify)))
+        async with self.pipeline() as pipe:
+            await pipe.hash_delete(role_permission_key)
+            await pipe.hash_multi_set(role_permission_key, {k: self.codec.dumps(pack_permissions(v)) for k, v in permissions.items()})
+            await pipe.set_expire(role_permission_key, expire)
+        return True
+
+    async def get_role_permissions(self, roles: list[int], fields: list[str]) -> dict[int, list[list | None]]:
+        """
+        获取多个角色的权限，缓存中不存在的角色权限通过加载方法获取并写入缓存
+        :param roles: 角色id列表
+        :param fields: 请求方法列表
+        :return: {role_id: [fields 对应的权限列表]}
+        """
+        generation = await self.get_generation(ROLE_PERMISSION_FAMILY)
+        values = await asyncio.gather(*(self.hash_multi_get(with_generation(get_role_permission_key(str(role)), generation), fields) for role in roles))
+        role_permissions = {role: [unpack_permissions(loads(v)) if v else None for v in value] for role, value in zip(roles, values)}
+
+        missing = [role for role, value in zip(roles, values) if all(v is None for v in value)]
+        if missing and self.role_permission_loader is not None:
+            loaded = await self.role_permission_loader(missing)
+            for role in missing:
+                permissions = loaded.get(role, {})
+                if permissions:
+                    await self.set_role_permission(role, permissions)
+                role_permissions[role] = [permissions.get(field) for field in fields]
+
+        return role_permissions
+
+    async def delete_role_permission(self, roles: list[int]):
+        """
+        角色权限发生变化后删除角色权限缓存，下次使用时重新加载
+        所有角色的权限都发生变化时使用 bump_generation(ROLE_PERMISSION_FAMILY)
+        :param roles: 角色id列表
+        :return:
+        """
+        generation = await self.get_generation(ROLE_PERMISSION_FAMILY)
+        async with self.pipeline() as pipe:
+            for role in roles:
+                await pipe.hash_delete(with_generation(get_role_permission_key(str(role)), generation))
+
     async def delete_permission(self, identify: int | str):
-        return await self.hash_delete(get_permission_key(str(identify)))
+        return await self.hash_delete(await self.get_family_key(PERMISSION_FAMILY, get_permission_key(str(identify))))
 
     async def set_blacklist(self, identify: int | str, value: str, expire: int = 60):
         return await self.set(get_blacklist_key(str(identify)), value, expire)
@@ -142,18 +814,170 @@ class CacheSystem:
     async def delete_blacklist(self, identify: int | str):
         return await self.delete(get_blacklist_key(str(identify)))
 
+    async def set_blacklist_index(self, identify: int | str, nbf: int, exp: int):
+        """
+        黑名单索引，记录所有黑名单用户的生效时间和过期时间，供各个进程加载本地黑名单使用
+        :param identify: 用户id
+        :param nbf: 黑名单生效时间，在此之前签发的token都不可用
+        :param exp: 黑名单过期时间戳
+        :return:
+        """
+        return await self.hash_multi_set(get_blacklist_index_key(), {str(identify): json.dumps({'nbf': nbf, 'exp': exp})})
+
+    async def get_blacklist_index(self) -> dict[str, dict]:
+        index = await self.hash_get_all(get_blacklist_index_key())
+        # 连接池没有使用 decode_responses 时 field 为 bytes
+        return {identify.decode() if isinstance(identify, bytes) else identify: json.loads(value) for identify, value in index.items()}
+
+    async def delete_blacklist_index(self, identify: int | str):
+        return await self.hash_delete(get_blacklist_index_key(), str(identify))
+
+    async def get_permission_catalog(self) -> dict | None:
+        """
+        权限目录，格式为 {'version': int, 'ids': list[int]}，ids 的顺序即为权限位图中的位置
+        :return:
+        """
+        catalog = await self.get(get_permission_catalog_key())
+        if catalog:
+            catalog = loads(catalog)
+        return catalog
+
+    async def set_permission_catalog(self, ids: list[int]) -> dict:
+        """
+        生成新版本的权限目录，版本号存储在权限目录中，读取时版本号和权限顺序始终一致
+        :param ids: 权限id列表
+        :return:
+        """
+        script = self.get_script(SET_PERMISSION_CATALOG_SCRIPT)
+        if script is None:
+            # 不支持脚本的是进程内的缓存，两个命令之间不会有其他进程写入
+            version = await self.incr(get_permission_catalog_version_key())
+            catalog = {'version': version, 'ids': ids}
+            await self.set(get_permission_catalog_key(), self.codec.dumps(catalog))
+            return catalog
+
+        catalog_key = get_permission_catalog_key()
+        try:
+            version = await self.call(script(
+                keys=[get_permission_catalog_version_key(), catalog_key],
+                args=[JSON_TAG + '{"version":', ',"ids":' + json.dumps(ids, separators=(',', ':')) + '}']
+            ), 'set_permission_catalog', catalog_key)
+        except Exception as e:
+            logger.error(f'set permission catalog error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        await self.invalidate_local(catalog_key)
+        return {'version': int(version), 'ids': ids}
+
     async def get_menu(self, identify: int | str = None, decode: bool = True):
-        menu = await self.get(get_menu_key(None if identify is None else str(identify)))
+        menu = await self.get(await self.get_family_key(MENU_FAMILY, get_menu_key(None if identify is None else str(identify))))
         if decode and menu:
-            menu = json.loads(menu)
+            menu = loads(menu)
         return menu
 
     async def set_menu(self, identify: int | str = None, value: str = '', encode: bool = True):
         if encode:
-            value = json.dumps(value)
-
-        return await self.set(get_menu_key(None if identify is None else str(identify)), value, expire=7 * 24 * 3600)
-
-
-# TODO 目前只有redis，后续可以扩展
-cache = CacheSystem(get_redis())
+            value = self.codec.dumps(value)
+
+        menu_key = await self.get_family_key(MENU_FAMILY, get_menu_key(None if identify is None else str(identify)))
+        async with self.pipeline() as pipe:
+            await pipe.set(menu_key, value, expire=7 * 24 * 3600)
+        return True
+
+
+class CachePipeline(CacheSystem):
+    """
+    批量执行的缓存客户端，复用 CacheSystem 的写入方法，命令在 CacheSystem.pipeline 退出时统一执行
+    只能用于写入，读取方法的返回值在执行之前没有意义
+    """
+
+    def __init__(self, cache_client: CacheSystem, pipe):
+        # 命令只是放入队列，不经过熔断器，执行时再通过原客户端的熔断器
+        super().__init__(pipe, local=cache_client.local, codec=cache_client.codec)
+        self.cache_client = cache_client
+        self.invalidated_keys: list[str] = []
+
+    async def get_generation(self, family: str) -> int:
+        # 批量执行中无法读取，使用原客户端获取版本号
+        return await self.cache_client.get_generation(family)
+
+    @asynccontextmanager
+    async def pipeline(self) -> AsyncIterator['CachePipeline']:
+        # 已经在批量执行中，嵌套调用时直接使用当前的批量执行对象
+        yield self
+
+    async def invalidate_local(self, key: str):
+        # 失效通知和写入命令在同一个事务中发送，本进程的一级缓存在执行成功后再删除
+        if self.local is None or self.local.family(key) is None:
+            return
+        self.invalidated_keys.append(key)
+        await self.backend.publish(LOCAL_CACHE_CHANNEL, key)
+
+    async def execute(self):
+        try:
+            result = await self.cache_client.call(self.backend.execute(), 'pipeline')
+        except Exception as e:
+            logger.error(f'execute pipeline error: {e}')
+            raise CACHE_SYSTEM_EXCEPTION from e
+        for key in self.invalidated_keys:
+            self.local.invalidate(key)
+        self.invalidated_keys = []
+        return result
+
+
+def create_local_cache() -> LocalCache | None:
+    if not settings.CACHE_LOCAL_ENABLE:
+        return None
+    policies = {
+        'global_menu': settings.CACHE_LOCAL_MENU_TTL,
+        'menu_': settings.CACHE_LOCAL_MENU_TTL,
+        'permission_': settings.CACHE_LOCAL_PERMISSION_TTL,
+        'role_permission_': settings.CACHE_LOCAL_PERMISSION_TTL,
+        'blacklist_': settings.CACHE_LOCAL_BLACKLIST_TTL,
+    }
+    return LocalCache(policies, max_size=settings.CACHE_LOCAL_MAX_SIZE)
+
+
+def get_backend():
+    # 没有启用 redis 时使用进程内缓存，只适用于单进程部署
+    if settings.CACHE_REDIS_ENABLE:
+        return get_redis()
+    return get_memory()
+
+
+def create_metrics() -> CacheMetrics | None:
+    if not settings.METRICS_ENABLE:
+        return None
+    # 按照 key 的前缀统计，与各个 get_*_key 方法生成的 key 对应
+    families = [
+        'permission_', 'role_permission_', 'blacklist_', 'blacklist_index', 'permission_catalog', 'permission_catalog_version',
+        'global_menu', 'menu_', 'generation_', 'lock_', 'cached_', 'cached_tag_', 'worker_lease_',
+    ]
+    return CacheMetrics(families, hot_keys=settings.CACHE_METRICS_HOT_KEYS)
+
+
+def create_breaker() -> CircuitBreaker | None:
+    # 进程内缓存不会阻塞，不需要熔断
+    if not settings.CACHE_REDIS_ENABLE:
+        return None
+    return CircuitBreaker(
+        timeout=settings.CACHE_TIMEOUT_MILLISECONDS / 1000,
+        failure_threshold=settings.CACHE_BREAKER_FAILURE_THRESHOLD,
+        recovery_seconds=settings.CACHE_BREAKER_RECOVERY_SECONDS
+    )
+
+
+def create_codec() -> Codec:
+    codec = get_codec(settings.CACHE_CODEC)
+    if codec.binary and settings.CACHE_REDIS_ENABLE and settings.CACHE_REDIS_DECODE_RESPONSES:
+        raise ValueError(f'缓存编码方式 {codec.name} 生成的是二进制数据，需要设置 CACHE_REDIS_DECODE_RESPONSES=false')
+    return codec
+
+
+cache = CacheSystem(
+    get_backend(),
+    local=create_local_cache(),
+    codec=create_codec(),
+    generation_ttl=settings.CACHE_GENERATION_TTL,
+    breaker=create_breaker(),
+    metrics=create_metrics()
+)
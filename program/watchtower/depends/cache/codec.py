@@ -0,0 +1,130 @@
+import json
+from abc import abstractmethod, ABC
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 编码后的数据以 \0 + 格式 + 版本号 开头，读取时根据标记选择解码方法，没有标记的数据按照 JSON 解码
+# 上线新的编码方式时先让所有进程都能解码新的格式，再切换写入使用的编码方式
+TAG_PREFIX = '\0'
+JSON_TAG = '\0j1'
+MSGPACK_TAG = '\0m1'
+
+
+class Codec(ABC):
+    """
+    缓存数据的编码方式
+    binary 为 True 的编码方式生成的是 bytes，redis 连接池不能使用 decode_responses
+    """
+    name = ''
+    tag = ''
+    binary = False
+
+    @abstractmethod
+    def encode(self, value) -> str | bytes:
+        raise NotImplementedError
+
+    def dumps(self, value) -> str | bytes:
+        if self.binary:
+            return self.tag.encode() + self.encode(value)
+        return self.tag + self.encode(value)
+
+
+class JsonCodec(Codec):
+    name = 'json'
+    tag = JSON_TAG
+
+    def encode(self, value) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class OrjsonCodec(Codec):
+    """
+    和 JsonCodec 生成相同格式的数据，两者可以混用
+    """
+    name = 'orjson'
+    tag = JSON_TAG
+
+    def __init__(self):
+        if orjson is None:
+            raise ValueError('使用 orjson 编码需要安装 orjson')
+
+    def encode(self, value) -> str:
+        return orjson.dumps(value).decode()
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+    tag = MSGPACK_TAG
+    binary = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise ValueError('使用 msgpack 编码需要安装 msgpack')
+
+    def encode(self, value) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+
+
+def json_loads(value: str | bytes):
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def loads(value: str | bytes | None):
+    """
+    解码缓存数据，支持所有编码方式写入的数据
+    :param value: 缓存中读取的数据
+    :return:
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, bytes):
+        if value.startswith(MSGPACK_TAG.encode()):
+            if msgpack is None:
+                raise ValueError('解码 msgpack 数据需要安装 msgpack')
+            return msgpack.unpackb(value[len(MSGPACK_TAG):], raw=False)
+        if value.startswith(JSON_TAG.encode()):
+            return json_loads(value[len(JSON_TAG):])
+        return json_loads(value)
+
+    if value.startswith(JSON_TAG):
+        return json_loads(value[len(JSON_TAG):])
+    if value.startswith(TAG_PREFIX):
+        raise ValueError(f'不支持的缓存数据格式：{value[:3]!r}')
+    return json_loads(value)
+
+
+def get_codec(name: str) -> Codec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f'不支持的缓存编码方式：{name}，可选值为 {", ".join(CODECS)}')
+    return codec()
+
+
+def pack_permissions(permissions: list[dict]) -> list[list]:
+    """
+    权限列表的紧凑格式，每个权限只保存 [id, url, code]，不重复存储字段名
+    :param permissions: list[{ 'id': int, 'url': str, 'code': str}]
+    :return:
+    """
+    return [[permission['id'], permission['url'], permission['code']] for permission in permissions]
+
+
+def unpack_permissions(permissions: list | None) -> list[dict] | None:
+    if permissions is None:
+        return None
+    # 兼容旧版本写入的 list[dict] 格式
+    return [permission if isinstance(permission, dict) else {'id': permission[0], 'url': permission[1], 'code': permission[2]} for permission in permissions]
@@ -0,0 +1,160 @@
+import asyncio
+import inspect
+import time
+import uuid
+from typing import Callable, Awaitable, Any
+
+from watchtower.depends.cache.cache import CacheSystem, get_lock_key
+from watchtower.depends.cache.codec import loads
+from watchtower.settings import logger
+
+# 从数据库等数据源加载缓存数据的方法
+FILL_LOADER = Callable[[], Awaitable[Any]]
+
+
+class CacheFill:
+    """
+    代价较高的缓存填充，防止缓存失效时大量请求同时从数据源加载
+    进程内同一时间只有一个加载任务，多个进程之间使用缓存锁，没有获取到锁的进程等待其他进程写入缓存
+    缓存数据分为软过期和硬过期：软过期之后继续返回旧数据，同时在后台刷新；硬过期之后缓存被删除，需要等待加载
+    """
+
+    def __init__(
+            self,
+            cache_client: CacheSystem,
+            key: str,
+            loader: FILL_LOADER,
+            soft_ttl: int,
+            hard_ttl: int,
+            lock_seconds: int = 10,
+            poll_seconds: float = 0.05,
+            family: str | None = None,
+            on_fill: Callable[[Any], Any] | None = None
+    ):
+        """
+        :param cache_client: 缓存客户端
+        :param key: 缓存的key
+        :param loader: 加载数据的方法
+        :param soft_ttl: 软过期时间，单位为秒
+        :param hard_ttl: 硬过期时间，单位为秒，即缓存的过期时间
+        :param lock_seconds: 锁的过期时间，也是等待其他进程加载的最长时间
+        :param poll_seconds: 等待其他进程加载时查询缓存的间隔
+        :param family: 缓存类别，key中包含类别的版本号，增加版本号后重新加载
+        :param on_fill: 从数据源加载并写入缓存后的回调，参数为加载的数据，可以是异步方法
+        """
+        self.cache_client = cache_client
+        self.key = key
+        self.loader = loader
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.lock_seconds = lock_seconds
+        self.poll_seconds = poll_seconds
+        self.family = family
+        self.on_fill = on_fill
+        self._inflight: asyncio.Task | None = None
+        self._refresh_task: asyncio.Task | None = None
+        # 后台刷新期间数据发生变化，需要在当前刷新完成后再刷新一次
+        self._dirty = False
+
+    async def get(self, refresh: bool = False):
+        """
+        获取缓存数据
+        :param refresh: 是否强制从数据源重新加载
+        :return:
+        """
+        if not refresh:
+            cached = await self.read()
+            if cached is not None:
+                value, soft_expire = cached
+                if soft_expire <= time.time():
+                    self.refresh_in_background()
+                return value
+
+        # 同一个进程内的请求共享同一个加载任务，请求被取消时不影响加载任务
+        if refresh or self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self.fill(force=refresh))
+        return await asyncio.shield(self._inflight)
+
+    def refresh_in_background(self, force: bool = False):
+        """
+        在后台刷新缓存，刷新期间继续返回旧数据
+        :param force: 数据源已经发生变化，必须重新加载，不能跳过
+        :return:
+        """
+        if force:
+            self._dirty = True
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+
+    async def get_key(self) -> str:
+        if self.family is None:
+            return self.key
+        return await self.cache_client.get_family_key(self.family, self.key)
+
+    async def read(self) -> tuple[Any, float] | None:
+        """
+        读取缓存数据
+        :return: 数据和软过期时间，缓存不存在或者格式不正确时返回 None
+        """
+        cached = loads(await self.cache_client.get(await self.get_key()))
+        if not isinstance(cached, dict) or 'soft_expire' not in cached:
+            return None
+        return cached['value'], cached['soft_expire']
+
+    async def write(self, value):
+        cached = {'value': value, 'soft_expire': time.time() + self.soft_ttl}
+        await self.cache_client.set(await self.get_key(), self.cache_client.codec.dumps(cached), expire=self.hard_ttl)
+        if self.on_fill is not None:
+            try:
+                result = self.on_fill(value)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f'on fill cache {self.key} error: {e}')
+
+    async def fill(self, force: bool = False, wait: bool = True):
+        """
+        从数据源加载数据并写入缓存
+        :param force: 数据源已经发生变化，不使用锁，直接加载
+        :param wait: 没有获取到锁时是否等待其他进程写入缓存
+        :return: 加载的数据，没有获取到锁并且不等待时返回 None
+        """
+        if force:
+            value = await self.loader()
+            await self.write(value)
+            return value
+
+        lock_key, token = get_lock_key(await self.get_key()), uuid.uuid4().hex
+        if await self.cache_client.set_nx(lock_key, token, self.lock_seconds):
+            try:
+                value = await self.loader()
+                await self.write(value)
+                return value
+            finally:
+                await self.cache_client.delete_if_equal(lock_key, token)
+
+        if not wait:
+            return None
+
+        deadline = time.monotonic() + self.lock_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_seconds)
+            cached = await self.read()
+            if cached is not None:
+                return cached[0]
+
+        # 其他进程加载超时，自行加载
+        logger.warning(f'wait cache fill of {self.key} timeout, load from source')
+        value = await self.loader()
+        await self.write(value)
+        return value
+
+    async def _refresh(self):
+        try:
+            while True:
+                force, self._dirty = self._dirty, False
+                await self.fill(force=force, wait=False)
+                if not self._dirty:
+                    break
+        except Exception as e:
+            logger.error(f'refresh cache {self.key} error: {e}')
@@ -0,0 +1,123 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+LOCAL_CACHE_CHANNEL = 'local_cache_channel'
+
+# 整个key的缓存值使用的字段名，hash表使用各自的field
+WHOLE_VALUE = object()
+
+
+class LocalCache:
+    """
+    进程内的一级缓存，放在redis之前，只缓存读多写少的key
+    按照key的前缀划分为不同的类别，每个类别使用不同的过期时间，过期时间为0的类别不缓存
+    写入时删除本进程的缓存并通过订阅频道通知其他进程，订阅断开期间最多读取到过期时间内的旧数据
+    """
+
+    def __init__(self, policies: dict[str, int], max_size: int = 10000):
+        """
+        :param policies: key前缀 -> 过期时间，单位为秒
+        :param max_size: 最多缓存的key数量，超出后淘汰最久未使用的key
+        """
+        # 前缀较长的类别优先匹配，例如 role_permission_ 不能匹配为 permission_
+        self.policies = sorted(((prefix, ttl) for prefix, ttl in policies.items() if ttl > 0), key=lambda item: len(item[0]), reverse=True)
+        self.max_size = max_size
+        # key -> (过期时间, {field: value})
+        self.entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # 每次失效都会增加，读取redis期间key发生过失效时不写入本地缓存，防止写入旧数据
+        self.generation = 0
+        # key -> 最近一次失效时的 generation，只保留最近的 max_size 个
+        self.invalidated: OrderedDict[str, int] = OrderedDict()
+        # 已经从 invalidated 中淘汰的最大 generation，早于它开始的读取都不写入本地缓存
+        self.trimmed_generation = 0
+        self.hits: dict[str, int] = {prefix: 0 for prefix, _ in self.policies}
+        self.misses: dict[str, int] = {prefix: 0 for prefix, _ in self.policies}
+
+    def family(self, key: str) -> str | None:
+        """
+        获取key所属的类别
+        :param key: 缓存的key
+        :return: 不需要缓存的key返回 None
+        """
+        for prefix, _ in self.policies:
+            if key.startswith(prefix):
+                return prefix
+        return None
+
+    def get(self, key: str, fields: list) -> tuple[bool, list]:
+        """
+        从本地缓存中读取
+        :param key: 缓存的key
+        :param fields: 需要读取的字段，读取整个key时为 [WHOLE_VALUE]
+        :return: 是否命中，命中时返回字段对应的值
+        """
+        family = self.family(key)
+        if family is None:
+            return False, []
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            expire_at, values = entry
+            if expire_at <= time.monotonic():
+                self.entries.pop(key, None)
+            elif all(field in values for field in fields):
+                self.entries.move_to_end(key)
+                self.hits[family] += 1
+                return True, [values.get(field) for field in fields]
+
+        self.misses[family] += 1
+        return False, []
+
+    def put(self, key: str, values: dict, generation: int):
+        """
+        写入本地缓存
+        :param key: 缓存的key
+        :param values: {field: value}
+        :param generation: 读取redis之前的失效次数
+        :return:
+        """
+        family = self.family(key)
+        if family is None or generation < self.trimmed_generation or self.invalidated.get(key, 0) > generation:
+            return
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            entry[1].update(values)
+            self.entries.move_to_end(key)
+            return
+
+        ttl = next(ttl for prefix, ttl in self.policies if prefix == family)
+        self.entries[key] = (time.monotonic() + ttl, values)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        """
+        删除本地缓存，也作为订阅频道的处理函数
+        :param key: 缓存的key
+        :return:
+        """
+        self.generation += 1
+        self.entries.pop(key, None)
+        self.invalidated[key] = self.generation
+        self.invalidated.move_to_end(key)
+        if len(self.invalidated) > self.max_size:
+            _, self.trimmed_generation = self.invalidated.popitem(last=False)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.invalidated.clear()
+        self.trimmed_generation = self.generation
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """
+        各个类别的命中次数和命中率
+        :return:
+        """
+        stats = {}
+        for prefix, _ in self.policies:
+            hits, misses = self.hits[prefix], self.misses[prefix]
+            stats[prefix] = {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses) if hits + misses else 0.0}
+        return stats
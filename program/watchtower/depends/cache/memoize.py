@@ -0,0 +1,193 @@
+import functools
+import hashlib
+import inspect
+import time
+from collections import OrderedDict
+from typing import Callable, Any
+
+from watchtower.depends.cache.cache import CacheSystem, cache
+from watchtower.depends.cache.codec import loads
+from watchtower.depends.cache.subscriber import subscriber
+from watchtower.settings import logger
+from watchtower.status.types.exception import SiteException
+
+CACHED_TAG_CHANNEL = 'cached_tag_channel'
+
+# 缓存的key或者标签，可以是格式化字符串（使用函数参数格式化），也可以是接收函数参数的方法
+KEY_BUILDER = str | Callable[..., str]
+
+
+def get_cached_key(key: str) -> str:
+    return f'cached_{key}'
+
+
+def get_cached_tag_key(tag: str) -> str:
+    return f'cached_tag_{tag}'
+
+
+class CachedLocal:
+    """
+    被装饰方法的进程内缓存，记录标签对应的key，收到标签失效的消息后删除
+    """
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (过期时间, 标签, 值)
+        self.entries: OrderedDict[str, tuple[float, list[str], Any]] = OrderedDict()
+        self.tag_keys: dict[str, set[str]] = {}
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            self.remove(key)
+            return False, None
+        self.entries.move_to_end(key)
+        return True, entry[2]
+
+    def put(self, key: str, tags: list[str], value):
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, tags, value)
+        for tag in tags:
+            self.tag_keys.setdefault(tag, set()).add(key)
+        if len(self.entries) > self.max_size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self.tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    self.tag_keys.pop(tag)
+
+    def invalidate_tag(self, tag: str):
+        for key in list(self.tag_keys.get(tag, ())):
+            self.remove(key)
+
+
+# 所有使用了进程内缓存的被装饰方法，标签失效时逐个删除
+local_caches: list[CachedLocal] = []
+
+
+def on_tag_message(tag: str):
+    for local_cache in local_caches:
+        local_cache.invalidate_tag(tag)
+
+
+subscriber.register(CACHED_TAG_CHANNEL, on_tag_message)
+
+
+def build(builder: KEY_BUILDER, args: tuple, kwargs: dict, arguments: dict) -> str:
+    if callable(builder):
+        return builder(*args, **kwargs)
+    return builder.format(**arguments)
+
+
+def cached(
+        ttl: int = 60,
+        key: KEY_BUILDER | None = None,
+        tags: list[KEY_BUILDER] | None = None,
+        local_ttl: int = 0,
+        local_max_size: int = 1000,
+        family: str | None = None,
+        cache_client: CacheSystem = cache
+):
+    """
+    缓存异步方法的返回值，返回值需要能被缓存编码方式序列化
+        @cached(ttl=300, key='role_users:{role_id}', tags=['role:{role_id}'])
+        async def get_role_users(role_id: int): ...
+
+        await invalidate_tags('role:1')
+    缓存读取失败时直接调用被装饰的方法，不影响业务
+    :param ttl: 缓存的过期时间，单位为秒
+    :param key: 缓存的key，为 None 时使用方法名和参数生成
+    :param tags: 缓存的标签，使用 invalidate_tags 删除标签下的所有缓存
+    :param local_ttl: 进程内缓存的过期时间，为 0 时不使用进程内缓存
+    :param local_max_size: 进程内缓存的最大数量
+    :param family: 缓存类别，key中包含类别的版本号，使用 cache_client.bump_generation 使整个类别的缓存失效
+    :param cache_client: 缓存客户端
+    :return:
+    """
+    tags = tags or []
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        local_cache = None
+        if local_ttl > 0:
+            local_cache = CachedLocal(local_ttl, local_max_size)
+            local_caches.append(local_cache)
+
+        def build_key(args: tuple, kwargs: dict, arguments: dict) -> str:
+            if key is not None:
+                return build(key, args, kwargs, arguments)
+            digest = hashlib.sha1(repr(sorted(arguments.items())).encode()).hexdigest()
+            return f'{func.__module__}.{func.__qualname__}:{digest}'
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            cache_key = get_cached_key(build_key(args, kwargs, arguments))
+            if family is not None:
+                try:
+                    cache_key = await cache_client.get_family_key(family, cache_key)
+                except SiteException:
+                    return await func(*args, **kwargs)
+
+            if local_cache is not None:
+                hit, value = local_cache.get(cache_key)
+                if hit:
+                    return value
+
+            try:
+                cached_value = loads(await cache_client.get(cache_key))
+            except SiteException:
+                cached_value = None
+            # 使用 dict 包装返回值，区分返回值为 None 和缓存不存在
+            if isinstance(cached_value, dict) and 'value' in cached_value:
+                value = cached_value['value']
+            else:
+                value = await func(*args, **kwargs)
+                value_tags = [build(tag, args, kwargs, arguments) for tag in tags]
+                try:
+                    async with cache_client.pipeline() as pipe:
+                        await pipe.set(cache_key, cache_client.codec.dumps({'value': value}), expire=ttl)
+                        for tag in value_tags:
+                            tag_key = get_cached_tag_key(tag)
+                            await pipe.set_add(tag_key, cache_key)
+                            # 标签的过期时间不能早于其中任何一个key，否则删除标签时会遗漏还没有过期的key
+                            await pipe.extend_expire(tag_key, ttl)
+                except SiteException:
+                    logger.warning(f'cache result of {func.__qualname__} failed')
+                    return value
+
+            if local_cache is not None:
+                local_cache.put(cache_key, [build(tag, args, kwargs, arguments) for tag in tags], value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+async def invalidate_tags(*tags: str, cache_client: CacheSystem = cache):
+    """
+    删除标签下的所有缓存，并通知所有进程删除进程内缓存
+    :param tags: 标签
+    :param cache_client: 缓存客户端
+    :return:
+    """
+    keys = {tag: await cache_client.set_members(get_cached_tag_key(tag)) for tag in tags}
+    async with cache_client.pipeline() as pipe:
+        for tag, tag_keys in keys.items():
+            for key in tag_keys:
+                await pipe.delete(key)
+            await pipe.delete(get_cached_tag_key(tag))
+            await pipe.publish(CACHED_TAG_CHANNEL, tag)
@@ -0,0 +1,150 @@
+import bisect
+from collections import Counter
+
+# 延迟分布的上界，单位为毫秒，超过最后一个上界的计入 +Inf
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+# 读取命令，根据返回值统计命中率和读取的数据量
+READ_OPERATIONS = {'get', 'hmget', 'hgetall', 'smembers', 'script'}
+
+
+def sizeof(value) -> int:
+    """
+    估算缓存数据的大小，字符串按照字符数计算
+    :param value: 缓存命令的参数或者返回值
+    :return:
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(sizeof(field) + sizeof(item) for field, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(sizeof(item) for item in value)
+    return len(str(value))
+
+
+def is_hit(value) -> bool:
+    if isinstance(value, (list, tuple)):
+        return any(item is not None for item in value)
+    if isinstance(value, (dict, set)):
+        return len(value) > 0
+    return value is not None
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, milliseconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, milliseconds)] += 1
+        self.count += 1
+        self.sum += milliseconds
+
+    def snapshot(self) -> dict:
+        # 与 prometheus 一致，每个上界的数量包含小于它的所有数量
+        buckets, total = {}, 0
+        for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), self.counts):
+            total += count
+            buckets[str(bound)] = total
+        return {'count': self.count, 'sum_ms': round(self.sum, 3), 'buckets': buckets}
+
+
+class FamilyMetrics:
+    def __init__(self):
+        self.latency: dict[str, Histogram] = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def snapshot(self) -> dict:
+        reads = self.hits + self.misses
+        return {
+            'latency': {operation: histogram.snapshot() for operation, histogram in self.latency.items()},
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / reads if reads else 0.0,
+            'errors': self.errors,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+
+
+class CacheMetrics:
+    """
+    缓存命令的统计，按照key的类别记录各个命令的延迟分布、命中率、写入和读取的数据量，以及访问最多的key
+    只统计当前进程，批量执行的命令作为一个 pipeline 命令统计
+    """
+
+    def __init__(self, families: list[str], hot_keys: int = 20):
+        """
+        :param families: key的前缀，前缀较长的优先匹配，没有匹配的key归为 other
+        :param hot_keys: 统计访问最多的key的数量
+        """
+        self.families = sorted(families, key=len, reverse=True)
+        self.hot_keys = hot_keys
+        self.metrics: dict[str, FamilyMetrics] = {}
+        # 只保留访问次数较多的部分key，超出容量后淘汰访问较少的一半
+        self.key_counter: Counter = Counter()
+        self.key_capacity = max(hot_keys * 50, 1000)
+
+    def family(self, key: str | None, operation: str) -> str:
+        if key is None:
+            return operation
+        for prefix in self.families:
+            if key.startswith(prefix):
+                return prefix
+        return 'other'
+
+    def _get(self, family: str) -> FamilyMetrics:
+        metrics = self.metrics.get(family)
+        if metrics is None:
+            metrics = self.metrics[family] = FamilyMetrics()
+        return metrics
+
+    def record(self, operation: str, key: str | None, seconds: float, result=None, payload=None):
+        """
+        记录一次成功的缓存命令
+        :param operation: 命令名称
+        :param key: 命令操作的key，没有key的命令为 None
+        :param seconds: 命令的执行时间
+        :param result: 命令的返回值，读取命令用来统计命中率和读取的数据量
+        :param payload: 写入命令写入的数据
+        :return:
+        """
+        metrics = self._get(self.family(key, operation))
+        histogram = metrics.latency.get(operation)
+        if histogram is None:
+            histogram = metrics.latency[operation] = Histogram()
+        histogram.observe(seconds * 1000)
+
+        if operation in READ_OPERATIONS:
+            if is_hit(result):
+                metrics.hits += 1
+            else:
+                metrics.misses += 1
+            metrics.bytes_out += sizeof(result)
+        if payload is not None:
+            metrics.bytes_in += sizeof(payload)
+
+        if key is not None:
+            self.key_counter[key] += 1
+            if len(self.key_counter) > self.key_capacity:
+                self.key_counter = Counter(dict(self.key_counter.most_common(self.key_capacity // 2)))
+
+    def record_error(self, operation: str, key: str | None):
+        self._get(self.family(key, operation)).errors += 1
+
+    def snapshot(self) -> dict:
+        return {
+            'families': {family: metrics.snapshot() for family, metrics in self.metrics.items()},
+            'hot_keys': self.key_counter.most_common(self.hot_keys),
+        }
+
+    def reset(self):
+        self.metrics.clear()
+        self.key_counter.clear()
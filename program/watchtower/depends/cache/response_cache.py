@@ -0,0 +1,160 @@
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from watchtower.depends.cache.cache import CacheSystem, cache
+from watchtower.middleware.compression import COMPRESSION_PROFILES, compress, get_route_profile, negotiate
+from watchtower.settings import settings
+
+# 生成响应内容的方法，返回编码后的 JSON
+RESPONSE_RENDER = Callable[[], Awaitable[bytes]]
+
+# 各个接口在响应缓存中的名称，数据发生变化的地方使用名称使接口的响应失效
+MENU_RESPONSE = 'menu'
+LOAD_DATA_RESPONSE = 'load_data'
+
+
+def get_response_family(name: str) -> str:
+    """
+    接口响应使用的缓存类别，类别的版本号即为接口数据的版本，不对应缓存中的数据
+    :param name: 接口名称
+    :return:
+    """
+    return f'response_{name}'
+
+
+class CachedBody:
+    """
+    编码后的响应内容，各种压缩方式的内容在第一次使用时压缩并保存，之后的请求直接返回
+    """
+    __slots__ = ('body', 'encoded', 'expire_at')
+
+    def __init__(self, body: bytes, expire_at: float = float('inf')):
+        """
+        :param body: 编码后的响应内容
+        :param expire_at: 过期时间，time.monotonic() 的值
+        """
+        self.body = body
+        self.encoded: dict[str, bytes] = {}
+        self.expire_at = expire_at
+
+    def get_encoded(self, encoding: str) -> bytes:
+        """
+        获取压缩后的内容，同一个内容的每种压缩方式只压缩一次
+        :param encoding: 压缩方式
+        :return:
+        """
+        encoded = self.encoded.get(encoding)
+        if encoded is None:
+            encoded = compress(self.body, encoding, COMPRESSION_PROFILES[settings.COMPRESSION_CACHED_PROFILE][encoding])
+            self.encoded[encoding] = encoded
+        return encoded
+
+    def response(self, request: Request | None = None, status_code: int = 200, media_type: str = 'application/json') -> Response:
+        """
+        生成响应，按照客户端支持的方式返回预先压缩的内容，压缩中间件不会再次压缩
+        :param request: 当前请求，用于选择压缩方式
+        :param status_code: 状态码
+        :param media_type: 内容类型
+        :return:
+        """
+        encoding = None
+        if settings.COMPRESSION_ENABLE and request is not None and len(self.body) >= settings.COMPRESSION_MINIMUM_SIZE:
+            if get_route_profile(request.url.path) is not None:
+                encoding = negotiate(request.headers.get('accept-encoding', ''))
+        if encoding is None:
+            return Response(self.body, status_code=status_code, media_type=media_type)
+        headers = {'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+        return Response(self.get_encoded(encoding), status_code=status_code, headers=headers, media_type=media_type)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(encoded) for encoded in self.encoded.values())
+
+
+class ResponseCache:
+    """
+    进程内的响应内容缓存，用于菜单、加载数据等读多写少、结果只取决于数据版本和用户类别的接口，命中时不再查询、整理、编码和压缩数据
+    key 为 (接口名称, 接口数据的版本, 用户类别)，接口数据的版本保存在缓存类别的版本号中，数据变化后调用 invalidate 增加版本号并通知所有进程
+    生成期间版本发生变化时内容写入旧版本，不会再被读取；没有通过接口修改的数据最多在过期时间之后生效
+    """
+
+    def __init__(self, cache_client: CacheSystem, max_size: int = 1024, ttl: int = 60):
+        """
+        :param cache_client: 缓存客户端，用于读取和增加接口数据的版本
+        :param max_size: 最多缓存的响应数量，超出后淘汰最久未使用的响应
+        :param ttl: 响应内容的过期时间，单位为秒
+        """
+        self.cache_client = cache_client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[tuple, CachedBody] = OrderedDict()
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+
+    async def version(self, name: str) -> int:
+        return await self.cache_client.get_generation(get_response_family(name))
+
+    async def invalidate(self, name: str):
+        """
+        接口数据发生变化，所有进程中该接口已经缓存的响应都不再使用
+        :param name: 接口名称
+        :return:
+        """
+        await self.cache_client.bump_generation(get_response_family(name))
+
+    async def get_or_render(self, name: str, variant: Hashable, render: RESPONSE_RENDER) -> CachedBody:
+        """
+        获取缓存的响应内容，不存在或者已经过期时生成并缓存
+        :param name: 接口名称
+        :param variant: 用户类别以及接口依赖的其他数据版本，结果相同的请求使用相同的值
+        :param render: 生成响应内容的方法
+        :return:
+        """
+        # 在生成之前读取版本，生成期间数据发生变化时内容写入旧版本
+        try:
+            key = (name, await self.version(name), variant)
+        except Exception:
+            # 无法读取版本时不能判断缓存的内容是否仍然有效，直接生成
+            return CachedBody(await render(), 0.0)
+        entry = self.entries.get(key)
+        if entry is not None and entry.expire_at > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits[name] = self.hits.get(name, 0) + 1
+            return entry
+
+        self.misses[name] = self.misses.get(name, 0) + 1
+        body = await render()
+        entry = CachedBody(body, time.monotonic() + self.ttl)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        """
+        各个接口的命中次数和命中率，以及缓存的响应数量和字节数
+        :return:
+        """
+        names = {}
+        for name in self.hits.keys() | self.misses.keys():
+            hits, misses = self.hits.get(name, 0), self.misses.get(name, 0)
+            names[name] = {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses) if hits + misses else 0.0}
+        return {
+            'entries': len(self.entries),
+            'bytes': sum(entry.size for entry in self.entries.values()),
+            'names': names,
+        }
+
+
+def create_response_cache() -> ResponseCache | None:
+    if not settings.CACHE_RESPONSE_ENABLE:
+        return None
+    return ResponseCache(cache, max_size=settings.CACHE_RESPONSE_MAX_SIZE, ttl=settings.CACHE_RESPONSE_TTL)
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,309 @@
+import asyncio
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Callable, Awaitable, Any
+
+from watchtower.depends.cache.cache import cache
+from watchtower.depends.cache.codec import Codec, loads
+from watchtower.settings import settings, logger
+
+# 文件头：标记、格式版本号、是否已被替换、数据版本号、索引长度
+# 索引为 JSON 格式的 {key: [偏移, 长度]}，数据按照索引顺序紧跟在索引之后
+HEADER = struct.Struct('<4sHBxQI')
+MAGIC = b'BYSH'
+LAYOUT_VERSION = 1
+# 是否已被替换的标记在文件中的偏移，写入新版本后将旧版本的标记改为 1，读取的进程看到标记后重新打开文件
+SUPERSEDED_OFFSET = 6
+
+# 从缓存或者数据库加载共享数据的方法
+SHARED_LOADER = Callable[[], Awaitable[Any]]
+
+
+class SharedSnapshot:
+    """
+    共享内存中的一个版本，写入后不再修改（除了是否已被替换的标记），所有进程以只读方式映射同一份数据
+    """
+
+    def __init__(self, path: str):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            self.mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, layout_version, _, self.generation, index_length = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or layout_version != LAYOUT_VERSION:
+            raise ValueError(f'不支持的共享缓存文件格式：{path}')
+        self.view = memoryview(self.mm)
+        self.index: dict[str, list[int]] = json.loads(bytes(self.view[HEADER.size:HEADER.size + index_length]))
+        self.size = size
+        # 版本写入后不再修改，解码后的数据在这个版本被替换之前一直有效，每个进程只解码一次
+        self.decoded: dict[str, Any] = {}
+
+    @property
+    def superseded(self) -> bool:
+        return self.mm[SUPERSEDED_OFFSET] == 1
+
+    def get_bytes(self, key: str) -> memoryview | None:
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.view[offset:offset + length]
+
+    def items(self) -> dict[str, bytes]:
+        return {key: bytes(self.view[offset:offset + length]) for key, (offset, length) in self.index.items()}
+
+
+def write_snapshot(path: str, generation: int, values: dict[str, bytes]):
+    """
+    写入新版本的共享数据，先写入临时文件再替换，读取的进程不会看到写了一半的数据
+    :param path: 文件路径
+    :param generation: 数据版本号
+    :param values: {key: 编码后的数据}
+    :return:
+    """
+    # 索引中的偏移依赖索引本身的长度，先按照占位偏移计算长度，偏移的位数不足时重新计算
+    offsets, index_length = {}, 0
+    while True:
+        offset = HEADER.size + index_length
+        for key, value in values.items():
+            offsets[key] = [offset, len(value)]
+            offset += len(value)
+        index = json.dumps(offsets, separators=(',', ':')).encode()
+        if len(index) == index_length:
+            break
+        index_length = len(index)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, LAYOUT_VERSION, 0, generation, len(index)))
+        file.write(index)
+        for value in values.values():
+            file.write(value)
+
+    old_fd = None
+    try:
+        old_fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        pass
+    os.replace(tmp_path, path)
+    if old_fd is not None:
+        os.pwrite(old_fd, b'\x01', SUPERSEDED_OFFSET)
+        os.close(old_fd)
+
+
+class SharedStore:
+    """
+    同一台主机上所有 worker 进程共享的只读缓存，用于菜单、权限目录等读多写少的数据
+    数据存储在 /dev/shm 中的文件里，每次写入生成一个新的不可变版本，读取时直接使用内存映射，不经过 redis，也不在每个进程中各保存一份
+    任何进程都可以写入，写入之间使用文件锁互斥；每台主机上只有一个进程作为刷新进程，定时从数据源加载已注册的数据
+    """
+
+    def __init__(self, name: str, directory: str, codec: Codec, refresh_seconds: int = 5, retry_seconds: float = 1):
+        """
+        :param name: 共享缓存的名称，同一台主机上的不同项目需要使用不同的名称
+        :param directory: 文件目录，应当使用内存文件系统
+        :param codec: 数据的编码方式
+        :param refresh_seconds: 刷新进程从数据源加载数据的间隔，单位为秒，也是其他主机修改数据后最长的生效时间
+        :param retry_seconds: 文件不存在时重新检查的间隔，单位为秒
+        """
+        self.path = os.path.join(directory, f'{name}.shm')
+        self.codec = codec
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.loaders: dict[str, SHARED_LOADER] = {}
+        self.snapshot: SharedSnapshot | None = None
+        self._retry_at = 0.0
+        self._leader_fd: int | None = None
+        self._task: asyncio.Task | None = None
+
+    def register(self, key: str, loader: SHARED_LOADER):
+        """
+        注册由刷新进程定时加载的数据
+        :param key: 数据的key
+        :param loader: 加载数据的方法
+        :return:
+        """
+        self.loaders[key] = loader
+
+    def current(self, force: bool = False) -> SharedSnapshot | None:
+        """
+        获取当前版本，当前版本已被替换时重新映射
+        :param force: 文件不存在时是否忽略重新检查的间隔，写入时需要读取最新的版本
+        :return: 还没有写入过数据时返回 None
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and not snapshot.superseded:
+            return snapshot
+        if snapshot is None and not force and time.monotonic() < self._retry_at:
+            return None
+        try:
+            # 旧版本的内存映射在没有引用之后自动释放
+            self.snapshot = SharedSnapshot(self.path)
+        except FileNotFoundError:
+            self.snapshot = None
+            self._retry_at = time.monotonic() + self.retry_seconds
+        except Exception as e:
+            logger.error(f'open shared cache {self.path} error: {e}')
+            self.snapshot = None
+            self._retry_at = time.monotonic() + self.retry_seconds
+        return self.snapshot
+
+    def get_bytes(self, key: str) -> memoryview | None:
+        """
+        获取编码后的数据，不复制内存
+        :param key: 数据的key
+        :return:
+        """
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        return snapshot.get_bytes(key)
+
+    def get(self, key: str):
+        """
+        获取解码后的数据，同一个版本的数据只解码一次，返回的数据被所有调用者共享，不能修改
+        :param key: 数据的key
+        :return: 数据不存在时返回 None
+        """
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        if key in snapshot.decoded:
+            return snapshot.decoded[key]
+        value = snapshot.get_bytes(key)
+        if value is None:
+            return None
+        value = snapshot.decoded[key] = loads(bytes(value))
+        return value
+
+    async def put(self, values: dict[str, Any]) -> bool:
+        """
+        写入数据，文件锁和文件读写会阻塞，在线程中执行，不阻塞事件循环
+        :param values: {key: 数据}
+        :return: 是否写入了新版本
+        """
+        return await asyncio.to_thread(self.write, values)
+
+    def write(self, values: dict[str, Any]) -> bool:
+        """
+        写入数据，与当前版本合并后生成新版本，数据没有变化时不写入
+        :param values: {key: 数据}
+        :return: 是否写入了新版本
+        """
+        encoded = {}
+        for key, value in values.items():
+            value = self.codec.dumps(value)
+            encoded[key] = value.encode() if isinstance(value, str) else value
+
+        with open(f'{self.path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # 持有锁之后读取最新的版本，其他进程可能刚刚写入了新版本
+            snapshot = self.current(force=True)
+            current = snapshot.items() if snapshot is not None else {}
+            if all(current.get(key) == value for key, value in encoded.items()):
+                return False
+            current.update(encoded)
+            write_snapshot(self.path, (snapshot.generation if snapshot is not None else 0) + 1, current)
+        self.current(force=True)
+        return True
+
+    @property
+    def generation(self) -> int | None:
+        """
+        当前版本号，每次写入都会增加，还没有写入过数据时为 None
+        """
+        snapshot = self.current()
+        return snapshot.generation if snapshot is not None else None
+
+    @property
+    def leader(self) -> bool:
+        return self._leader_fd is not None
+
+    def try_lead(self) -> bool:
+        """
+        尝试成为刷新进程，刷新进程退出后文件锁自动释放，其他进程在下一次尝试时接替
+        :return:
+        """
+        if self._leader_fd is not None:
+            return True
+        fd = os.open(f'{self.path}.leader', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._leader_fd = fd
+        return True
+
+    async def refresh(self):
+        """
+        从数据源加载所有已注册的数据并写入
+        :return:
+        """
+        values = {}
+        for key, loader in self.loaders.items():
+            try:
+                values[key] = await loader()
+            except Exception as e:
+                logger.error(f'load shared cache {key} error: {e}')
+        if values:
+            await self.put(values)
+
+    async def start(self):
+        if self._task is not None or not self.loaders:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._leader_fd is not None:
+            os.close(self._leader_fd)
+            self._leader_fd = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self.try_lead():
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'refresh shared cache error: {e}')
+            await asyncio.sleep(self.refresh_seconds)
+
+    def stats(self) -> dict:
+        snapshot = self.current()
+        return {
+            'path': self.path,
+            'leader': self.leader,
+            'generation': snapshot.generation if snapshot is not None else None,
+            'size': snapshot.size if snapshot is not None else 0,
+            'keys': list(snapshot.index) if snapshot is not None else [],
+        }
+
+
+def create_shared_store() -> SharedStore | None:
+    if not settings.CACHE_SHARED_ENABLE:
+        return None
+    directory = settings.CACHE_SHARED_DIR
+    if not os.path.isdir(directory):
+        directory = tempfile.gettempdir()
+        logger.warning(f'shared cache directory {settings.CACHE_SHARED_DIR} not exists, use {directory}')
+    return SharedStore(settings.CACHE_SHARED_NAME or settings.SITE_NAME, directory, cache.codec, refresh_seconds=settings.CACHE_SHARED_REFRESH_SECONDS)
+
+
+shared_store = create_shared_store()
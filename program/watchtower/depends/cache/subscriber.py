@@ -0,0 +1,98 @@
+import asyncio
+from typing import Callable, Awaitable
+
+from watchtower.depends.cache.cache import CacheSystem, cache, GENERATION_CHANNEL
+from watchtower.depends.cache.local_cache import LOCAL_CACHE_CHANNEL
+from watchtower.settings import logger
+
+MESSAGE_HANDLER = Callable[[str], Awaitable[None] | None]
+
+
+class CacheSubscriber:
+    """
+    缓存订阅器，每个进程只使用一个订阅连接，按照频道分发消息
+    连接断开后会自动重连，重连期间丢失的消息需要各个使用方自行对账
+    """
+
+    def __init__(self, cache_client: CacheSystem, retry_seconds: float = 1.0, max_retry_seconds: float = 30.0):
+        self.cache_client = cache_client
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.handlers: dict[str, list[MESSAGE_HANDLER]] = {}
+        self._task: asyncio.Task | None = None
+
+    def register(self, channel: str, handler: MESSAGE_HANDLER):
+        """
+        注册频道处理函数，需要在 start 之前注册
+        :param channel: 频道名称
+        :param handler: 处理函数，参数为消息内容
+        :return:
+        """
+        self.handlers.setdefault(channel, []).append(handler)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.handlers or self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        retry_seconds = self.retry_seconds
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.cache_client.pubsub()
+                await pubsub.subscribe(*self.handlers.keys())
+                retry_seconds = self.retry_seconds
+                async for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    await self._dispatch(message['channel'], message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'cache subscriber error, retry after {retry_seconds}s: {e}')
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.reset()
+                    except Exception as e:
+                        logger.warning(f'close pubsub error: {e}')
+
+            await asyncio.sleep(retry_seconds)
+            retry_seconds = min(retry_seconds * 2, self.max_retry_seconds)
+
+    async def _dispatch(self, channel: str | bytes, data: str | bytes):
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        if isinstance(data, bytes):
+            data = data.decode()
+
+        for handler in self.handlers.get(channel, []):
+            try:
+                result = handler(data)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f'handle message of channel {channel} error: {e}')
+
+
+subscriber = CacheSubscriber(cache)
+# 其他进程增加缓存类别的版本号后删除本进程缓存的版本号
+subscriber.register(GENERATION_CHANNEL, cache.on_generation_message)
+# 其他进程修改缓存后删除本进程的一级缓存
+if cache.local is not None:
+    subscriber.register(LOCAL_CACHE_CHANNEL, cache.local.invalidate)
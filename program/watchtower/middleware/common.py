@@ -2,6 +2,9 @@ from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 
+from watchtower.middleware.compression import CompressionMiddleware
+from watchtower.settings import settings
+
 # from server.server import app
 
 # 不安全url强制跳转安全url
@@ -10,7 +13,10 @@ from fastapi.middleware.gzip import GZipMiddleware
 # minimum_size - 不压缩小宇这个字节数的响应，默认 500
 # app.add_middleware(GZipMiddleware, )
 
-middleware = [{
-    "middleware_class": GZipMiddleware,
-    "minimum_size": 1000
-}]
+# 按照客户端支持的方式压缩响应，代替只支持 gzip 的 GZipMiddleware
+middleware = []
+if settings.COMPRESSION_ENABLE:
+    middleware.append({
+        "middleware_class": CompressionMiddleware,
+        "minimum_size": settings.COMPRESSION_MINIMUM_SIZE
+    })
@@ -0,0 +1,205 @@
+import zlib
+from functools import lru_cache
+from typing import Callable, NoReturn
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from watchtower.settings import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 各个压缩等级在不同压缩方式下的参数
+# 缓存的响应只压缩一次，使用 best；br 11 和 zstd 19 以上压缩时间成倍增加，体积只减少很少，因此没有使用最高等级
+COMPRESSION_PROFILES = {
+    'fast': {'zstd': 1, 'br': 1, 'gzip': 1},
+    'default': {'zstd': 3, 'br': 5, 'gzip': 6},
+    'best': {'zstd': 15, 'br': 9, 'gzip': 9},
+}
+
+# 可以使用的压缩方式，客户端权重相同时按照该顺序选择
+AVAILABLE_ENCODINGS = tuple(
+    encoding for encoding, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib)) if module is not None
+)
+
+# 已经压缩过的内容类型，再次压缩只会浪费CPU
+COMPRESSED_CONTENT_TYPES = (
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/avif', 'video/', 'audio/', 'font/woff',
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/zstd', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/pdf', 'text/event-stream',
+)
+
+# 按照路径前缀指定的压缩等级，前缀较长的优先匹配
+ROUTE_PROFILES = sorted(settings.COMPRESSION_ROUTE_PROFILES.items(), key=lambda item: len(item[0]), reverse=True)
+
+
+class Compressor:
+    """
+    流式压缩，compress 返回已经可以发送的数据，finish 返回剩余的数据
+    """
+
+    def __init__(self, encoding: str, level: int):
+        """
+        :param encoding: 压缩方式
+        :param level: 压缩方式对应的压缩等级
+        """
+        if encoding == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self.compress: Callable[[bytes], bytes] = compressor.compress
+            self.finish: Callable[[], bytes] = compressor.flush
+        elif encoding == 'br':
+            compressor = brotli.Compressor(quality=level)
+            self.compress = compressor.process
+            self.finish = compressor.finish
+        else:
+            # wbits 加 16 时输出 gzip 格式
+            compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            self.compress = compressor.compress
+            self.finish = compressor.flush
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    compressor = Compressor(encoding, level)
+    return compressor.compress(body) + compressor.finish()
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: str) -> str | None:
+    """
+    按照客户端的 Accept-Encoding 选择压缩方式，客户端的请求头种类很少，结果缓存
+    :param accept_encoding: 请求头 Accept-Encoding
+    :return: 不压缩时返回 None
+    """
+    weights = {}
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.partition(';')
+        name, weight = name.strip(), 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        if name == '*':
+            for encoding in AVAILABLE_ENCODINGS:
+                weights.setdefault(encoding, weight)
+        elif name in AVAILABLE_ENCODINGS:
+            weights[name] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in AVAILABLE_ENCODINGS:
+        if weights.get(encoding, 0.0) > best_weight:
+            best, best_weight = encoding, weights[encoding]
+    return best
+
+
+def get_route_profile(path: str) -> str | None:
+    """
+    获取路径使用的压缩等级，没有匹配的前缀时使用 COMPRESSION_PROFILE
+    :param path: 请求路径
+    :return: 不压缩（压缩等级为 off）时返回 None
+    """
+    for prefix, profile in ROUTE_PROFILES:
+        if path.startswith(prefix):
+            return profile if profile in COMPRESSION_PROFILES else None
+    return settings.COMPRESSION_PROFILE
+
+
+class CompressionMiddleware:
+    """
+    按照客户端支持的方式压缩响应，安装了 zstandard、brotli 时优先使用 zstd、br，否则使用 gzip
+    已经设置了 Content-Encoding（例如缓存中预先压缩的响应）、已经是压缩格式或者小于 minimum_size 的响应不压缩
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1000) -> None:
+        """
+        :param app: ASGI 应用
+        :param minimum_size: 不压缩小于这个字节数的响应
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+            profile = get_route_profile(scope["path"]) if encoding is not None else None
+            if profile is not None:
+                responder = CompressionResponder(self.app, self.minimum_size, encoding, COMPRESSION_PROFILES[profile][encoding])
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    """
+    与 starlette 的 GZipResponder 相同的处理流程，支持多种压缩方式
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int, encoding: str, level: int) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoding = encoding
+        self.level = level
+        self.send: Send = unattached_send
+        self.initial_message: Message = {}
+        self.started = False
+        self.bypass = False
+        self.compressor: Compressor | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    async def send_with_compression(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # 确定如何修改响应头之后再发送
+            self.initial_message = message
+            headers = Headers(raw=self.initial_message["headers"])
+            self.bypass = "content-encoding" in headers or headers.get("content-type", "").startswith(COMPRESSED_CONTENT_TYPES)
+        elif message_type == "http.response.body" and self.bypass:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+        elif message_type == "http.response.body" and not self.started:
+            self.started = True
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+
+            self.compressor = Compressor(self.encoding, self.level)
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                message["body"] = self.compressor.compress(body)
+            else:
+                message["body"] = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(message["body"]))
+
+            await self.send(self.initial_message)
+            await self.send(message)
+        elif message_type == "http.response.body":
+            body = message.get("body", b"")
+            body = self.compressor.compress(body)
+            if not message.get("more_body", False):
+                body += self.compressor.finish()
+            message["body"] = body
+            await self.send(message)
+
+
+async def unattached_send(message: Message) -> NoReturn:
+    raise RuntimeError("send awaitable not set")
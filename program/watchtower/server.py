@@ -3,9 +3,10 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
+from watchtower.depends.cache.response_cache import CachedBody
 from watchtower.global_router import routers, tags_metadata
 from watchtower.middleware.middlewares import middlewares
 from watchtower.settings import settings, logger
@@ -98,6 +99,30 @@ def custom_openapi():
 
 app.openapi = custom_openapi
 
+
+def cache_openapi_route():
+    """
+    OpenAPI 文档生成之后不再变化，代替 FastAPI 每次请求都重新编码和压缩的路由，只编码一次，每种压缩方式只压缩一次
+    :return:
+    """
+    cached: list[CachedBody] = []
+
+    async def openapi(request: Request) -> Response:
+        if not cached:
+            root_path = request.scope.get("root_path", "").rstrip("/")
+            server_urls = {server.get("url") for server in app.servers}
+            if root_path and app.root_path_in_servers and root_path not in server_urls:
+                app.servers.insert(0, {"url": root_path})
+            cached.append(CachedBody(JSONResponse(app.openapi()).body))
+        return cached[0].response(request)
+
+    app.router.routes = [route for route in app.router.routes if getattr(route, "path", None) != app.openapi_url]
+    app.add_route(app.openapi_url, openapi, include_in_schema=False)
+
+
+if app.openapi_url:
+    cache_openapi_route()
+
 # 自定义静态文件路径
 if settings.STATIC_URL and settings.STATIC_PATH:
     app.mount(settings.STATIC_URL, StaticFiles(directory=settings.STATIC_PATH), name="static")
@@ -135,6 +160,9 @@ async def shutdown_event():
 
 @app.exception_handler(SiteException)
 async def unicorn_site_exception_handle(_: Request, exc: SiteException):
+    # 内容固定的错误响应已经编码，直接返回
+    if exc.body is not None:
+        return Response(content=exc.body, status_code=exc.status_code, headers=exc.headers, media_type="application/json")
     return JSONResponse(
         status_code=exc.status_code,
         content=jsonable_encoder(exc.response),
@@ -11,7 +11,7 @@ from watchtower.settings.logger_config import get_logging_dict, ColorFormatter
 BASE_DIR = Path(__file__).parent.parent.parent
 PROJECT_NAME = BASE_DIR.name
 SITE_NAME = PROJECT_NAME
-# TODO 目前写死，后期修改为主机名、MAC地址hash计算
+# 雪花算法的机器id和机房id，启用 redis 时在启动时租用空闲的id，此处的值只在没有租用时使用
 SERVER_ID = 0
 DATACENTER_ID = 0
 STATIC_URL = "/static"
@@ -51,6 +51,37 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     # 全局路由前缀
     URL_PREFIX: str = ''
+    # 列表等已经是响应格式的数据直接编码为 JSON 返回，跳过 FastAPI 按照 response_model 的校验和转换
+    FAST_RESPONSE_ENABLE: bool = True
+
+    """
+    响应压缩设置
+    """
+    # 是否压缩响应，按照客户端的 Accept-Encoding 选择 zstd、br 或者 gzip，没有安装 zstandard、brotli 时只使用 gzip
+    COMPRESSION_ENABLE: bool = True
+    # 不压缩小于这个字节数的响应
+    COMPRESSION_MINIMUM_SIZE: int = 1000
+    # 响应使用的压缩等级：fast、default、best，off 表示不压缩，见 watchtower.middleware.compression.COMPRESSION_PROFILES
+    COMPRESSION_PROFILE: str = 'default'
+    # 按照路径前缀指定压缩等级，例如 {"/api/admin/operation_record": "fast", "/api/files": "off"}
+    COMPRESSION_ROUTE_PROFILES: dict[str, str] = {}
+    # 缓存的响应只压缩一次，使用较高的压缩等级
+    COMPRESSION_CACHED_PROFILE: str = 'best'
+
+    """
+    雪花算法设置
+    """
+    # 雪花算法id的位数划分：js_safe、js_safe_bulk，见 oracle.snowflake.SNOW_PROFILES
+    # 只能使用不超过53位的划分，前端js可以直接显示；63位的划分生成的id在接口中会丢失精度
+    SNOWFLAKE_PROFILE: str = 'js_safe'
+    # 容忍的时钟回拨毫秒数，回拨不超过该值时等待时钟追上而不是拒绝生成，为 0 时不容忍
+    SNOWFLAKE_MAX_BACKWARD_MS: int = 10
+    # 每毫秒保留给时钟回拨期间使用的序号数量，回拨较小时不需要等待，但是正常情况下每毫秒可以生成的id数量相应减少
+    SNOWFLAKE_RESERVED_SEQUENCES: int = 0
+    # 是否在启动时从 redis 租用雪花算法的机器id和机房id，多个 worker 进程或者容器不会使用相同的id，没有启用 redis 时不租用
+    SNOWFLAKE_LEASE_ENABLE: bool = True
+    # 租约的过期时间，单位为秒，每隔三分之一的时间续期一次
+    SNOWFLAKE_LEASE_TTL: int = 30
 
     """
     跨域配置
@@ -112,6 +143,7 @@ class Settings(BaseSettings):
         ],
         'POST': [
             '/api/login',
+            '/api/logout',
             '/api/refresh'
         ]
     }
@@ -134,6 +166,10 @@ class Settings(BaseSettings):
     # DB_TIMEZONE: str = 'Asia/Shanghai'
     # 是否进行真实删除，为 False 时进行软删除，只修改名称以及状态
     REAL_DELETE: bool = False
+    # 延迟写入的刷新间隔，单位为毫秒，用于登录信息等频繁更新的字段
+    WRITE_BEHIND_FLUSH_MILLISECONDS: int = 1000
+    # 延迟写入的缓冲行数，达到该行数时立即刷新
+    WRITE_BEHIND_MAX_ROWS: int = 500
 
     """
     redis设置
@@ -145,6 +181,64 @@ class Settings(BaseSettings):
     CACHE_REDIS_CHARSET: str = 'utf-8'
     CACHE_REDIS_USERNAME: str = ''
     CACHE_REDIS_PASSWORD: str = ''
+    # redis 连接池的最大连接数
+    CACHE_REDIS_MAX_CONNECTIONS: int = 100
+    # 使用二进制的缓存编码方式时需要设置为 False，所有进程都修改之后再切换编码方式
+    CACHE_REDIS_DECODE_RESPONSES: bool = True
+    # 权限列表、菜单等结构化数据的缓存编码方式，可选值为 json、orjson、msgpack，读取时支持所有编码方式
+    CACHE_CODEC: str = 'json'
+    # 没有启用 redis 时使用进程内缓存，进程内缓存的最大内存，单位为字节
+    CACHE_MEMORY_MAX_BYTES: int = 64 * 1024 * 1024
+    # 缓存类别版本号在进程内的缓存时间，单位为秒，版本号变化时通过订阅频道通知，订阅断开期间最多延迟该时间生效
+    CACHE_GENERATION_TTL: int = 5
+    # 建立 redis 连接的超时时间，单位为秒
+    CACHE_REDIS_CONNECT_TIMEOUT: float = 1
+    # 单个缓存命令的超时时间，单位为毫秒，为 0 时不限制
+    CACHE_TIMEOUT_MILLISECONDS: int = 200
+    # 缓存命令连续失败多少次后打开熔断器，打开期间所有缓存命令直接失败，不再等待超时
+    CACHE_BREAKER_FAILURE_THRESHOLD: int = 5
+    # 熔断器打开多长时间后尝试恢复，单位为秒
+    CACHE_BREAKER_RECOVERY_SECONDS: int = 10
+
+    """
+    本地缓存设置
+    """
+    # 是否在redis之前使用进程内的一级缓存
+    CACHE_LOCAL_ENABLE: bool = False
+    # 一级缓存最多缓存的key数量
+    CACHE_LOCAL_MAX_SIZE: int = 10000
+    # 各类缓存在一级缓存中的过期时间，单位为秒，为 0 时不使用一级缓存
+    CACHE_LOCAL_MENU_TTL: int = 60
+    CACHE_LOCAL_PERMISSION_TTL: int = 10
+    CACHE_LOCAL_BLACKLIST_TTL: int = 0
+    # 是否在同一台主机的所有 worker 进程之间共享菜单、权限目录等读多写少的数据
+    CACHE_SHARED_ENABLE: bool = False
+    # 共享数据的文件目录，应当使用内存文件系统，目录不存在时使用系统临时目录
+    CACHE_SHARED_DIR: str = '/dev/shm'
+    # 共享数据的名称，同一台主机上的不同项目需要使用不同的名称，为空时使用 SITE_NAME
+    CACHE_SHARED_NAME: str = ''
+    # 共享数据的刷新间隔，单位为秒，也是其他主机修改数据后最长的生效时间
+    CACHE_SHARED_REFRESH_SECONDS: int = 5
+    # 是否在进程内缓存菜单、加载数据等接口编码后的响应内容，数据通过接口修改后立即失效
+    CACHE_RESPONSE_ENABLE: bool = True
+    # 最多缓存的响应数量
+    CACHE_RESPONSE_MAX_SIZE: int = 1024
+    # 响应内容的过期时间，单位为秒，也是没有通过接口修改的数据最长的生效时间
+    CACHE_RESPONSE_TTL: int = 60
+
+    """
+    认证缓存设置
+    """
+    # 本地黑名单与缓存对账的间隔时间，单位为秒，用于弥补订阅断开期间丢失的消息
+    BLACKLIST_RECONCILE_SECONDS: int = 60
+    # 是否在token中携带权限位图，携带后权限验证不再查询缓存
+    TOKEN_PERMISSION_BITMAP_ENABLE: bool = False
+    # 本地权限目录与缓存对账的间隔时间，单位为秒
+    PERMISSION_CATALOG_RECONCILE_SECONDS: int = 60
+    # 缓存不可用时从数据库加载权限，加载结果在进程内的缓存时间，单位为秒
+    AUTHORIZATION_FALLBACK_TTL: int = 10
+    # 缓存不可用时进程内最多缓存的用户和角色数量
+    AUTHORIZATION_FALLBACK_MAX_SIZE: int = 10000
 
     """
     日志设置
@@ -160,6 +254,10 @@ class Settings(BaseSettings):
     AUTH_MODULE_ENABLE: bool = False
     ADMIN_MODULE_ENABLE: bool = False
     CMDB_MODULE_ENABLE: bool = False
+    # 是否统计缓存命令并开启缓存熔断器、一级缓存等运行状态的查询接口
+    METRICS_ENABLE: bool = False
+    # 缓存统计中显示访问最多的key的数量
+    CACHE_METRICS_HOT_KEYS: int = 20
 
     """
     自关闭设置
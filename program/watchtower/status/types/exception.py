@@ -1,12 +1,43 @@
-from watchtower.status.types.response import GenericBaseResponse
+from watchtower.status.types.response import GenericBaseResponse, Status, dumps
 
 
 class SiteException(Exception):
-    def __init__(self, status_code: int, response: GenericBaseResponse, headers: dict[str, str] | None = None):
+    def __init__(self, status_code: int, response: GenericBaseResponse, headers: dict[str, str] | None = None, body: bytes | None = None):
+        """
+        :param status_code: 状态码
+        :param response: 响应数据
+        :param headers: 响应头
+        :param body: 已经编码好的响应内容，设置后异常处理时不再编码 response
+        """
         self.status_code = status_code
         self.headers = headers
+        self.body = body
 
         # response 初始化处理
         if response.data is None:
             response.data = dict()
         self.response = response
+
+
+class PrerenderedError:
+    """
+    内容固定的错误响应，创建时编码一次，每次抛出时只创建新的异常对象，不再重新编码
+    异常对象不能复用，重复抛出同一个异常对象会不断累积 traceback
+    """
+
+    def __init__(self, status_code: int, status: Status):
+        """
+        :param status_code: 状态码
+        :param status: 状态信息
+        """
+        self.status_code = status_code
+        self.response = GenericBaseResponse[dict](status=status)
+        self.body = dumps(self.response.as_dict())
+
+    def exception(self, headers: dict[str, str] | None = None) -> SiteException:
+        """
+        生成携带已编码内容的异常
+        :param headers: 响应头
+        :return:
+        """
+        return SiteException(status_code=self.status_code, response=self.response, headers=headers, body=self.body)
@@ -1,8 +1,18 @@
+import json
 from dataclasses import dataclass
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
 from typing import TypeVar, Generic, Optional, Any
 
 from pydantic import Field, create_model, BaseModel
 from pydantic.generics import GenericModel
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # 定义状态类型
@@ -19,6 +29,49 @@ common_error_status = Status()
 DataType = TypeVar("DataType")
 
 
+def json_default(value):
+    """
+    JSON 不能直接编码的类型，转换结果与 FastAPI 的 jsonable_encoder 一致
+    :param value: 数据
+    :return:
+    """
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(content) -> bytes:
+    """
+    将响应数据编码为 JSON，安装了 orjson 时使用 orjson，超过 64 位的整数等 orjson 不支持的数据使用 json 编码
+    :param content: 响应数据
+    :return:
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(content, default=json_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    直接将数据编码为 JSON 的响应，路由返回该响应时 FastAPI 不再按照 response_model 校验数据，也不再调用 jsonable_encoder
+    只用于数据已经是响应格式的情况，response_model 仍然用于生成接口文档
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
 class GenericBaseResponse(GenericModel, Generic[DataType]):
     code: str = Field(
         default=success_status.code,
@@ -71,6 +124,16 @@ class GenericBaseResponse(GenericModel, Generic[DataType]):
 
         return {"code": self.code, "success": self.success, "message": self.message, "data": data}
 
+    def as_response(self, status_code: int = 200, headers: dict | None = None) -> FastJSONResponse:
+        """
+        转换为直接编码的响应，跳过 FastAPI 对响应数据的校验和转换
+        :param status_code: 状态码
+        :param headers: 响应头
+        :return:
+        """
+        content = {"code": self.code, "success": self.success, "message": self.message, "data": self.data}
+        return FastJSONResponse(content, status_code=status_code, headers=headers)
+
 
 def generate_response_model(model_name: str, status: Status, data: Field = Field(default={})) -> BaseModel:
     """
@@ -0,0 +1,82 @@
+"""
+缓存编码方式测试
+
+按照缓存类别（角色权限、菜单、权限目录）比较各个编码方式的编码耗时、解码耗时和数据大小。
+legacy 为之前直接使用 json.dumps(list[dict]) 的格式。没有安装 orjson、msgpack 时跳过对应的编码方式。
+
+运行方法：
+    PYTHONPATH=program python scripts/benchmarks/cache_codec_benchmark.py --permissions 200 --menus 100
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from watchtower.depends.cache.codec import CODECS, loads, pack_permissions, unpack_permissions
+
+
+def build_permissions(count: int) -> list[dict]:
+    return [{"id": 487493878272000 + index, "url": f"/api/admin/resource{index}/\\d+", "code": f"system:get-one-resource{index}"} for index in range(count)]
+
+
+def build_menus(count: int) -> list[dict]:
+    now = str(datetime.now())
+    menus = []
+    for index in range(count):
+        menu = {"id": 487493878272000 + index, "parent": None, "title": f"菜单{index}", "icon": "setting", "hidden": False,
+                "level": 119017060125 + index, "status": "active", "create_time": now, "update_time": now}
+        # 每 5 个菜单作为上一个一级菜单的子菜单
+        if index % 5 and menus:
+            menu["parent"] = menus[-1]["id"]
+            menus[-1].setdefault("children", []).append(menu)
+        else:
+            menus.append(menu)
+    return menus
+
+
+def measure(function, value, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        function(value)
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def run(args: argparse.Namespace):
+    permissions = build_permissions(args.permissions)
+    families = {
+        "role_permission": (permissions, pack_permissions, unpack_permissions),
+        "menu": (build_menus(args.menus), None, None),
+        "permission_catalog": ({"version": 1, "ids": [permission["id"] for permission in permissions]}, None, None),
+    }
+
+    codecs = {}
+    for name, codec in CODECS.items():
+        try:
+            codecs[name] = codec()
+        except ValueError as error:
+            print(f"skip {name}: {error}")
+
+    print(f"{'family':<20}{'codec':<10}{'bytes':>10}{'encode(us)':>14}{'decode(us)':>14}")
+    for family, (value, pack, unpack) in families.items():
+        rows = [("legacy", lambda v: json.dumps(v), json.loads, value)]
+        for name, codec in codecs.items():
+            rows.append((name, lambda v, c=codec, p=pack: c.dumps(p(v) if p else v), lambda v, u=unpack: u(loads(v)) if u else loads(v), value))
+
+        for name, encode, decode, data in rows:
+            encoded = encode(data)
+            size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+            encode_cost = measure(encode, data, args.number)
+            decode_cost = measure(decode, encoded, args.number)
+            print(f"{family:<20}{name:<10}{size:>10}{encode_cost:>14.2f}{decode_cost:>14.2f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="cache codec benchmark")
+    parser.add_argument("--permissions", type=int, default=200, help="角色权限数量")
+    parser.add_argument("--menus", type=int, default=100, help="菜单数量")
+    parser.add_argument("--number", type=int, default=2000, help="每项测试的执行次数")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
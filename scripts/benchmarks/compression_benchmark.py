@@ -0,0 +1,66 @@
+"""
+响应压缩测试
+
+按照不同的每页数据量，比较各个压缩方式和压缩等级压缩列表响应的耗时和压缩后的大小；
+cached 为缓存的响应，每种压缩方式只压缩一次，之后的请求直接返回压缩后的内容，耗时为 0。
+没有安装 brotli、zstandard 时只测试 gzip。
+
+运行方法：
+    PYTHONPATH=program python scripts/benchmarks/compression_benchmark.py --rows 50 500 5000
+"""
+import argparse
+import time
+from datetime import datetime
+
+from watchtower import Response
+from watchtower.middleware.compression import AVAILABLE_ENCODINGS, COMPRESSION_PROFILES, compress
+from watchtower.status.types.response import GetAllData, PaginationData
+
+
+def build_body(count: int) -> bytes:
+    now = datetime.now()
+    rows = [
+        {
+            "id": 487493878272000 + index, "username": f"user{index}", "name": f"用户{index}", "email": f"user{index}@example.com",
+            "avatar": "/assets/images/avatar/default.jpg", "detail": "详情", "superuser": False, "level": 119017060125 + index,
+            "status": "active", "create_time": now, "update_time": now, "last_login_ip": "127.0.0.1", "last_login_time": now,
+            "roles": [487493878272001, 487493878272002],
+        }
+        for index in range(count)
+    ]
+    pagination = PaginationData(index=1, limit=count, total=count, offset=0)
+    return Response[GetAllData](data={"items": rows, "pagination": pagination}).as_response().body
+
+
+def measure(body: bytes, encoding: str, level: int, number: int) -> tuple[float, int]:
+    compressed = compress(body, encoding, level)
+    start = time.perf_counter()
+    for _ in range(number):
+        compress(body, encoding, level)
+    return (time.perf_counter() - start) / number * 1000, len(compressed)
+
+
+def run(args: argparse.Namespace):
+    print(f"{'rows':>8}{'encoding':>10}{'profile':>10}{'level':>7}{'bytes':>12}{'ratio':>8}{'ms/response':>14}")
+    for count in args.rows:
+        body = build_body(count)
+        number = max(args.number // count, 3)
+        print(f"{count:>8}{'identity':>10}{'':>10}{'':>7}{len(body):>12}{1:>8.2f}{0:>14.3f}")
+        for encoding in AVAILABLE_ENCODINGS:
+            for profile, levels in COMPRESSION_PROFILES.items():
+                cost, size = measure(body, encoding, levels[encoding], number)
+                print(f"{count:>8}{encoding:>10}{profile:>10}{levels[encoding]:>7}{size:>12}{len(body) / size:>8.2f}{cost:>14.3f}")
+            # 缓存的响应使用 best 压缩一次
+            size = len(compress(body, encoding, COMPRESSION_PROFILES['best'][encoding]))
+            print(f"{count:>8}{encoding:>10}{'cached':>10}{'':>7}{size:>12}{len(body) / size:>8.2f}{0:>14.3f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="response compression benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[50, 500, 5000], help="每页数据量")
+    parser.add_argument("--number", type=int, default=20000, help="每种数据量总共压缩的行数，决定执行次数")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
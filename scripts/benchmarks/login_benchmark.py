@@ -0,0 +1,104 @@
+"""
+登录吞吐量测试
+
+使用 sqlite 内存数据库代替 mysql，使用进程内缓存代替 redis，只测量登录流程本身的开销（数据库查询、密码校验、权限缓存、token生成）。
+需要额外安装 aiosqlite。
+
+运行方法：
+    PYTHONPATH=program python scripts/benchmarks/login_benchmark.py --users 100 --requests 1000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("AUTH_MODULE_ENABLE", "true")
+os.environ.setdefault("ADMIN_MODULE_ENABLE", "true")
+os.environ.setdefault("DB_ECHO", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from passlib.hash import bcrypt
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.ext.compiler import compiles
+
+from apps.admin.models import User, Role, Permission
+from apps.auth.views import auth
+from apps.index.views.db_init_handler.init_db_items import permission_list
+from oracle.sqlalchemy import sql_helper, ModelBase
+from oracle.write_behind import write_behind
+from watchtower.depends.cache.backend.memory_backend import MemoryBackend
+from watchtower.depends.cache.cache import cache
+
+
+@compiles(BigInteger, "sqlite")
+def compile_big_integer(type_, compiler, **kw):
+    # sqlite 只有 INTEGER 主键才会自增
+    return "INTEGER"
+
+
+async def prepare(users: int, rounds: int):
+    sql_helper.engine = create_async_engine("sqlite+aiosqlite://")
+    sql_helper.session = async_sessionmaker(sql_helper.engine, expire_on_commit=False)
+    async with sql_helper.engine.begin() as conn:
+        await conn.run_sync(ModelBase.metadata.create_all)
+
+    password = bcrypt.using(rounds=rounds).hash("benchmark")
+    async with sql_helper.get_session().begin() as session:
+        # 批量插入时显式指定id，避免同一毫秒内生成重复的雪花id
+        role = Role(id=1, name="benchmark", detail="benchmark")
+        role.permissions.extend(Permission(**permission) for permission in permission_list)
+        for index in range(users):
+            user = User(id=index + 1, username=f"user{index}", name=f"user{index}", password=password, email=f"user{index}@example.com")
+            user.roles.append(role)
+            session.add(user)
+
+
+async def login(index: int) -> float:
+    form_data = auth.OAuth2RequestForm(username=f"user{index}", password="benchmark", scope="", remember=False)
+    start = time.perf_counter()
+    await auth.generate_token(form_data, cache_client=cache, login_ip="127.0.0.1")
+    return time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace):
+    cache.backend = MemoryBackend()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index: int) -> float:
+        async with semaphore:
+            return await login(index % args.users)
+
+    try:
+        await prepare(args.users, args.rounds)
+        write_behind.start()
+        # 预热，保证角色权限已经在缓存中
+        await login(0)
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(limited(index) for index in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        # 写入所有延迟写入的登录信息
+        await write_behind.stop()
+    finally:
+        # 不释放连接时 aiosqlite 的工作线程会阻止进程退出
+        await sql_helper.engine.dispose()
+
+    latencies = sorted(latencies)
+    print(f"requests={args.requests} concurrency={args.concurrency} bcrypt_rounds={args.rounds}")
+    print(f"throughput: {args.requests / elapsed:.1f} logins/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.2f} ms, p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="login throughput benchmark")
+    parser.add_argument("--users", type=int, default=100, help="用户数量")
+    parser.add_argument("--requests", type=int, default=1000, help="登录请求数量")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发数量")
+    parser.add_argument("--rounds", type=int, default=4, help="bcrypt 计算轮数，线上默认为 12")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,84 @@
+"""
+列表响应编码测试
+
+按照不同的每页数据量比较列表接口的两种响应方式：
+legacy 为 GetAllData(...).dict() 之后由 FastAPI 按照 response_model 校验并调用 jsonable_encoder，再由 JSONResponse 编码；
+fast 为 Response.as_response() 直接将已经整理好的数据编码为 JSON。
+
+运行方法：
+    PYTHONPATH=program python scripts/benchmarks/response_benchmark.py --rows 50 500 5000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import create_model
+
+from apps.admin.views.user_handler.user_type import UserQueryData
+from oracle.types import ModelStatus
+from watchtower import Response
+from watchtower.status.types.response import GetAllData, PaginationData
+
+
+def build_rows(count: int) -> list[dict]:
+    now = datetime.now()
+    return [
+        {
+            "id": 487493878272000 + index, "username": f"user{index}", "name": f"用户{index}", "email": f"user{index}@example.com",
+            "avatar": "/assets/images/avatar/default.jpg", "detail": "详情", "superuser": False, "level": 119017060125 + index,
+            "status": ModelStatus.ACTIVE, "create_time": now, "update_time": now, "last_login_ip": "127.0.0.1", "last_login_time": now,
+            "roles": [487493878272001, 487493878272002],
+        }
+        for index in range(count)
+    ]
+
+
+async def legacy(field, rows: list[dict], pagination: PaginationData) -> bytes:
+    data = GetAllData(items=rows, pagination=pagination).dict()
+    response = Response[GetAllData](data=data)
+    content = await serialize_response(field=field, response_content=response)
+    return JSONResponse(content).body
+
+
+async def fast(field, rows: list[dict], pagination: PaginationData) -> bytes:
+    return Response[GetAllData](data={"items": rows, "pagination": pagination}).as_response().body
+
+
+async def measure(function, field, rows: list[dict], number: int) -> tuple[float, int]:
+    pagination = PaginationData(index=1, limit=len(rows), total=len(rows), offset=0)
+    body = await function(field, rows, pagination)
+    start = time.perf_counter()
+    for _ in range(number):
+        await function(field, rows, pagination)
+    return (time.perf_counter() - start) / number * 1000, len(body)
+
+
+async def run(args: argparse.Namespace):
+    # 与 SQLAlchemyCRUDRouter 生成的列表响应模型相同
+    data_model = create_model("UserGetAllDataResponse", items=(Optional[list[UserQueryData]], ...), pagination=(PaginationData, ...))
+    field = create_response_field(name="response", type_=Response[data_model])
+
+    print(f"{'rows':>8}{'method':>10}{'bytes':>12}{'ms/response':>14}{'speedup':>10}")
+    for count in args.rows:
+        rows = build_rows(count)
+        number = max(args.number // count, 3)
+        legacy_cost, legacy_size = await measure(legacy, field, rows, number)
+        fast_cost, fast_size = await measure(fast, field, rows, number)
+        print(f"{count:>8}{'legacy':>10}{legacy_size:>12}{legacy_cost:>14.3f}{'':>10}")
+        print(f"{count:>8}{'fast':>10}{fast_size:>12}{fast_cost:>14.3f}{legacy_cost / fast_cost:>9.1f}x")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="list response benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[50, 500, 5000], help="每页数据量")
+    parser.add_argument("--number", type=int, default=20000, help="每种数据量总共编码的行数，决定执行次数")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,104 @@
+"""
+雪花算法id生成测试
+
+比较逐个生成（get_id）、批量生成（get_ids）和异步批量生成（get_ids_async）的每秒生成数量，
+并在生成的同时运行一个每毫秒唤醒一次的协程，统计事件循环被阻塞的最长时间和总时间。
+spin 为之前序号用完后空转等待下一毫秒的方式。
+之后按照 SNOW_PROFILES 中的各个位数划分，比较可以同时运行的进程数量、每毫秒的id数量、过期时间、批量生成速度和解析速度。
+
+运行方法：
+    PYTHONPATH=program python scripts/benchmarks/snowflake_benchmark.py --count 100000 --batch 1000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from oracle.snowflake import SNOW_PROFILES, Snow
+
+
+def spin_get_id(snow: Snow) -> int:
+    now_timestamp = int(time.time() * 1000)
+    if now_timestamp == snow.last_timestamp:
+        snow.sequence = (snow.sequence + 1) & snow.sequence_mask
+        if snow.sequence == 0:
+            while now_timestamp <= snow.last_timestamp:
+                now_timestamp = int(time.time() * 1000)
+    else:
+        snow.sequence = 0
+    snow.last_timestamp = now_timestamp
+    return snow.make_ids(now_timestamp, snow.sequence, 1, snow.datacenter_id, snow.server_id)[0]
+
+
+async def generate(name: str, count: int, batch: int) -> int:
+    snow = Snow.from_layout(SNOW_PROFILES['js_safe'])
+    generated = 0
+    while generated < count:
+        if name == "spin":
+            spin_get_id(snow)
+            generated += 1
+        elif name == "get_id":
+            snow.get_id()
+            generated += 1
+        elif name == "get_ids":
+            generated += len(snow.get_ids(batch))
+        else:
+            generated += len(await snow.get_ids_async(batch))
+    return generated
+
+
+async def measure(name: str, count: int, batch: int) -> tuple[float, float, float]:
+    stalls = []
+    stop = False
+
+    async def ticker():
+        # 每毫秒唤醒一次，实际唤醒时间与预期的差值即为事件循环被阻塞的时间
+        while not stop:
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            stalls.append(max(time.perf_counter() - expected, 0))
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    generated = await generate(name, count, batch)
+    elapsed = time.perf_counter() - start
+    stop = True
+    await task
+    return generated / elapsed, max(stalls, default=elapsed) * 1000, elapsed * 1000
+
+
+def run(args: argparse.Namespace):
+    print(f"{'method':<16}{'ids/s':>14}{'max stall(ms)':>16}{'elapsed(ms)':>14}")
+    for name in ("spin", "get_id", "get_ids", "get_ids_async"):
+        rate, stall, elapsed = asyncio.run(measure(name, args.count, args.batch))
+        print(f"{name:<16}{rate:>14.0f}{stall:>16.2f}{elapsed:>14.2f}")
+
+    print()
+    print(f"{'profile':<18}{'bits':>6}{'nodes':>8}{'ids/ms':>9}{'expire':>8}{'ids/s':>14}{'decode(us)':>12}")
+    for name, layout in SNOW_PROFILES.items():
+        snow = Snow.from_layout(layout)
+        start = time.perf_counter()
+        ids = []
+        while len(ids) < args.count:
+            ids.extend(snow.get_ids(args.batch))
+        rate = len(ids) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for snow_id in ids:
+            snow.decode(snow_id)
+        decode_cost = (time.perf_counter() - start) / len(ids) * 1e6
+
+        expire = datetime.fromtimestamp(layout.expire_timestamp / 1000).year
+        print(f"{name:<18}{layout.total_bits:>6}{layout.nodes:>8}{layout.ids_per_millisecond:>9}{expire:>8}{rate:>14.0f}{decode_cost:>12.2f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="snowflake benchmark")
+    parser.add_argument("--count", type=int, default=100000, help="每种方式生成的id数量")
+    parser.add_argument("--batch", type=int, default=1000, help="批量生成时每批的数量")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,87 @@
+"""
+雪花算法机器id租约测试
+
+启动多个进程，每个进程从 redis 租用机器id后同时生成id，检查所有进程生成的id没有重复。
+使用 --no-lease 时所有进程使用配置的机器id，用于对比，此时会出现重复的id。
+需要启用 redis（CACHE_REDIS_ENABLE=true），并且空闲的机器id数量不少于进程数量。
+
+运行方法：
+    CACHE_REDIS_ENABLE=true PYTHONPATH=program python scripts/benchmarks/snowflake_lease_check.py --processes 8 --count 500000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from array import array
+
+
+def worker(index: int, args: argparse.Namespace, barrier, directory: str):
+    from oracle.snowflake import snow
+    from oracle.worker_lease import WorkerLease
+    from watchtower.depends.cache.cache import cache
+
+    lease = WorkerLease(cache, snow, ttl=args.ttl)
+    loop = asyncio.new_event_loop()
+    if not args.no_lease:
+        loop.run_until_complete(lease.acquire())
+
+    # 所有进程都租用到id之后同时开始生成
+    barrier.wait()
+    ids = array('q')
+    start = time.perf_counter()
+    while len(ids) < args.count:
+        ids.extend(snow.get_ids(min(args.batch, args.count - len(ids))))
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(directory, f'{index}.bin'), 'wb') as file:
+        ids.tofile(file)
+
+    barrier.wait()
+    loop.run_until_complete(lease.release())
+    loop.close()
+    print(f'process {index}: datacenter_id={snow.datacenter_id}, server_id={snow.server_id}, {args.count / elapsed:.0f} ids/s')
+
+
+def run(args: argparse.Namespace):
+    from watchtower.settings import settings
+
+    if not settings.CACHE_REDIS_ENABLE:
+        raise SystemExit('需要启用 redis：CACHE_REDIS_ENABLE=true')
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(args.processes)
+    with tempfile.TemporaryDirectory() as directory:
+        processes = [context.Process(target=worker, args=(index, args, barrier, directory)) for index in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            raise SystemExit('部分进程异常退出')
+
+        seen, total = set(), 0
+        for index in range(args.processes):
+            ids = array('q')
+            with open(os.path.join(directory, f'{index}.bin'), 'rb') as file:
+                ids.frombytes(file.read())
+            total += len(ids)
+            seen.update(ids)
+
+    print(f'total: {total}, unique: {len(seen)}, duplicate: {total - len(seen)}')
+    if total != len(seen):
+        raise SystemExit(1)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="snowflake worker lease check")
+    parser.add_argument("--processes", type=int, default=8, help="进程数量")
+    parser.add_argument("--count", type=int, default=500000, help="每个进程生成的id数量")
+    parser.add_argument("--batch", type=int, default=1000, help="每批生成的id数量")
+    parser.add_argument("--ttl", type=int, default=30, help="租约的过期时间，单位为秒")
+    parser.add_argument("--no-lease", action="store_true", help="不租用机器id，使用配置的id")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())